@@ -1,18 +1,38 @@
+import string
+import archive as ar
 import db_functions as dbf
+import db_migrations as dbm
+import calendar_functions as cf
+import config as cfg
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import mantra_functions as mf
 import extra_functions as ef
+import season_functions as sf
+import tiebreak as tb
+import vote_store as vs
 from update_database import last_day_played
 from IPython.display import display
 
 
 class Player(object):
 
-	def __init__(self, name):
+	def __init__(self, name, store=None):
 		self.name = name
+		self.store = store
+
+	@property
+	def votes(self):
+
+		"""
+		Return the VoteStore where votes are read from, the one of the main
+		database if none was given. It is not checked for changes made by
+		other processes here, League does it once before playing.
+		"""
+
+		return self.store if self.store else vs.get_vote_store(check=False)
 
 	def vote(self, day):
 
@@ -25,15 +45,7 @@ class Player(object):
 
 		"""
 
-		vote = dbf.db_select(
-				table='votes',
-				columns=['alvin'],
-				where=f'day={day} AND name="{self.name}"')
-
-		if vote:
-			return vote[0]
-		else:
-			return 'sv'
+		return self.votes.get_vote(self.name, day)
 
 	def bonus(self, day):
 
@@ -46,15 +58,7 @@ class Player(object):
 
 		"""
 
-		features = ['gf', 'rp', 'rf', 'ass']
-		values = [3, 3, 3, 1]
-
-		points = dbf.db_select(
-				table='votes',
-				columns=features,
-				where=f'day={day} AND name="{self.name}"')[0]
-
-		return sum(np.multiply(points, values))
+		return self.votes.get_bonus(self.name, day)
 
 	def malus(self, day):
 
@@ -67,15 +71,7 @@ class Player(object):
 
 		"""
 
-		features = ['gs', 'rs', 'au', 'amm', 'esp']
-		values = [1, 3, 2, .5, 1]
-
-		points = dbf.db_select(
-				table='votes',
-				columns=features,
-				where=f'day={day} AND name="{self.name}"')[0]
-
-		return sum(np.multiply(points, values))
+		return self.votes.get_malus(self.name, day)
 
 	def fantavote(self, day):
 
@@ -88,7 +84,7 @@ class Player(object):
 
 		"""
 
-		return self.vote(day) + self.bonus(day) - self.malus(day)
+		return self.votes.get_fantavote(self.name, day)
 
 
 class Fantateam(object):
@@ -117,7 +113,8 @@ class Fantateam(object):
 class Match(object):
 
 	def __init__(self, team1, team2, day, all_players,
-	             captain, captain_details, rfactor, rfactor_details):
+	             captain, captain_details, captains, rfactor, rfactor_details,
+	             database=cfg.dbase1):
 
 		"""
 		:param team1: Fantateam() instance
@@ -126,8 +123,10 @@ class Match(object):
 		:param all_players: dict, Ex: player_name: Player() instance
 		:param captain: bool
 		:param captain_details: dict
+		:param captains: dict, Ex: (team_name, day): (captain, vice)
 		:param rfactor: bool
 		:param rfactor_details: dict
+		:param database: str, database of the season
 
 		"""
 		self.team1 = team1
@@ -136,10 +135,17 @@ class Match(object):
 		self.all_players = all_players
 		self.captain = captain
 		self.captain_details = captain_details
+		self.captains = captains
 		self.rfactor = rfactor
 		self.rfactor_details = rfactor_details
+		self.database = database
 		self.result = None
 
+		# Absolute points of each fantateam split in base points and the
+		# bonus/malus of each rule, whether the rule is used or not. They are
+		# used by League.points_with_rules()
+		self.components = {}
+
 		self.play_match()
 
 	def play_match(self):
@@ -150,8 +156,10 @@ class Match(object):
 		To make it faster, lineups are defined in two ways depending on the
 		case:
 
-			1. First we look in the database in the 'mantra_lineups' table to
-			   check if they have been already calculated.
+			1. First we look in the mantra cache (memory and database) to
+			   check if they have been already calculated with the same
+			   data. League loads all of them at once before playing, so
+			   they are usually in memory already.
 
 			2. If not found we run the mantra algorithm to calculate them.
 
@@ -159,36 +167,16 @@ class Match(object):
 
 		"""
 
-		# To save time, try to find mantra lineups already calculated
-		try:
-			lineup1 = dbf.db_select(
-					table='mantra_lineups',
-					columns=[f'day_{self.day}'],
-					where=f'team_name="{self.team1.name}"')[0].split(', ')
-			malus1 = int(lineup1[0])
-			lineup1 = [tuple(el.split(':')) for el in lineup1[1:]]
-
-			lineup2 = dbf.db_select(
-					table='mantra_lineups',
-					columns=[f'day_{self.day}'],
-					where=f'team_name="{self.team2.name}"')[0].split(', ')
-			malus2 = int(lineup2[0])
-			lineup2 = [tuple(el.split(':')) for el in lineup2[1:]]
-
-			# malus1 = sum([1 for nm, rl in lineup1 if '*' in rl])
-			# malus2 = sum([1 for nm, rl in lineup2 if '*' in rl])
-
-			lineup1 = [nm for nm, rl in lineup1]
-			lineup2 = [nm for nm, rl in lineup2]
-
-		# if not found, calculate them with mantra algorithm
-		except IndexError:
-			lineup1, _, malus1 = mf.mantra(day=self.day,
-			                               fantateam=self.team1.name,
-			                               starting_players=10)
-			lineup2, _, malus2 = mf.mantra(day=self.day,
-			                               fantateam=self.team2.name,
-			                               starting_players=10)
+		lineup1, _, malus1 = mf.cached_mantra(day=self.day,
+		                                      fantateam=self.team1.name,
+		                                      starting_players=10,
+		                                      database=self.database,
+		                                      check=False)
+		lineup2, _, malus2 = mf.cached_mantra(day=self.day,
+		                                      fantateam=self.team2.name,
+		                                      starting_players=10,
+		                                      database=self.database,
+		                                      check=False)
 
 		self.update_fantateams_data(lineup1, lineup2, malus1, malus2)
 
@@ -214,34 +202,46 @@ class Match(object):
 		abs_points1 = sum(votes1) - malus1
 		abs_points2 = sum(votes2) - malus2
 
-		captain1 = captain_points(self.captain, self.team1.name, lineup1,
-		                          self.day, self.captain_details)
-		self.team1.captain_bonus_malus_balance += captain1
+		captain1 = captain_points(True,
+		                          self.captains[(self.team1.name, self.day)],
+		                          lineup1, self.day, self.captain_details,
+		                          self.database)
+		captain2 = captain_points(True,
+		                          self.captains[(self.team2.name, self.day)],
+		                          lineup2, self.day, self.captain_details,
+		                          self.database)
 
+		rfactor1 = 0
 		if len(votes1) == 11:
-			rfactor1 = rfactor_points(self.rfactor, self.rfactor_details,
-			                          lineup1, self.day)
-		else:
-			rfactor1 = 0
-		self.team1.rfactor_bonus_malus_balance += rfactor1
+			rfactor1 = rfactor_points(True, self.rfactor_details,
+			                          lineup1, self.day, self.database)
+		rfactor2 = 0
+		if len(votes2) == 11:
+			rfactor2 = rfactor_points(True, self.rfactor_details,
+			                          lineup2, self.day, self.database)
 
-		captain2 = captain_points(self.captain, self.team2.name, lineup2,
-		                          self.day, self.captain_details)
-		self.team2.captain_bonus_malus_balance += captain2
+		self.components[self.team1.name] = {'base': abs_points1,
+		                                    'captain': captain1,
+		                                    'rfactor': rfactor1}
+		self.components[self.team2.name] = {'base': abs_points2,
+		                                    'captain': captain2,
+		                                    'rfactor': rfactor2}
 
-		if len(votes2) == 11:
-			rfactor2 = rfactor_points(self.rfactor, self.rfactor_details,
-			                          lineup2, self.day)
-		else:
-			rfactor2 = 0
+		# Only the rules used in this league change the result
+		captain1, captain2 = (captain1, captain2) if self.captain else (0, 0)
+		rfactor1, rfactor2 = (rfactor1, rfactor2) if self.rfactor else (0, 0)
+
+		self.team1.captain_bonus_malus_balance += captain1
+		self.team1.rfactor_bonus_malus_balance += rfactor1
+		self.team2.captain_bonus_malus_balance += captain2
 		self.team2.rfactor_bonus_malus_balance += rfactor2
 
 		abs_points1 += captain1 + rfactor1
 		abs_points2 += captain2 + rfactor2
 
 		# From abs_points calculate corresponding goals
-		goals1 = int(max(abs_points1 - 60, 0) // 6)
-		goals2 = int(max(abs_points2 - 60, 0) // 6)
+		goals1 = int(cf.goals_from_abs_points(abs_points1))
+		goals2 = int(cf.goals_from_abs_points(abs_points2))
 
 		self.team1.abs_points.append(abs_points1)
 		self.team1.goals_scored.append(goals1)
@@ -310,19 +310,22 @@ class Match(object):
 
 		"""
 
+		step = cfg.GOAL_STEP
+
 		# Scores have to be different from each other
 		cond1 = abs_points1 != abs_points2
 
-		# Their difference has to be small, maximum 5.5
-		cond2 = abs(abs_points1 - abs_points2) < 6
+		# Their difference has to be small, maximum 5.5 with the default step
+		cond2 = abs(abs_points1 - abs_points2) < step
 
-		# At least 1 of them needs to be minimum 65.5
-		cond3 = max([abs_points1, abs_points2]) >= 65.5
+		# At least 1 of them needs to be minimum half point below the first
+		# goal, 65.5 by default
+		cond3 = max([abs_points1, abs_points2]) >= cfg.GOAL_THRESHOLD - .5
 
 		if cond1 and cond2 and cond3:
 
-			rest1 = abs_points1 % 6
-			rest2 = abs_points2 % 6
+			rest1 = (abs_points1 - cfg.GOAL_THRESHOLD) % step
+			rest2 = (abs_points2 - cfg.GOAL_THRESHOLD) % step
 
 			data = [(self.team1, abs_points1, rest1),
 			        (self.team2, abs_points2, rest2)]
@@ -330,11 +333,11 @@ class Match(object):
 
 			lower, higher = data
 
-			if higher[2] == 5.5 or lower[2] == 0:
+			if higher[2] == step - .5 or lower[2] == 0:
 				higher[0].half_point -= 2
 				lower[0].half_point += 1
 
-			if lower[2] == 5.5 or higher[2] == 0:
+			if lower[2] == step - .5 or higher[2] == 0:
 				higher[0].half_point += 2
 				lower[0].half_point -= 1
 
@@ -342,31 +345,44 @@ class Match(object):
 class League(object):
 
 	def __init__(self, fteams, a_round, n_days, all_players,
-	             captain, rfactor):
+	             captain, rfactor, database=cfg.dbase1):
 		"""
 		:param fteams: list, Ex [Ciolle United, FC STRESS, ...]
 		:param a_round: list
 		:param n_days: int
-		:param all_players: dict, Ex: player_name: Player() instance
+		:param all_players: dict, Ex: player_name: Player() instance, see
+		                    season_players()
 		:param captain: bool
 		:param rfactor: bool
+		:param database: str, database of the season, see season_league()
 
 		"""
 		self.fteams = {ft: Fantateam(ft) for ft in fteams}
 		self.a_round = a_round
 		self.n_days = n_days
 		self.all_players = all_players
+		self.database = database
 		self.captain = captain
 		self.captain_details = dict(dbf.db_select(table='captain_details',
 		                                          columns=['*'],
-		                                          where=''))
+		                                          where='',
+		                                          database=database))
+		self.captains = sf.captains(database=database)
 		self.rfactor = rfactor
 		self.rfactor_details = dict(dbf.db_select(table='rfactor_details',
 		                                          columns=['*'],
-		                                          where=''))
+		                                          where='',
+		                                          database=database))
 		self.schedule = ef.generate_schedule(a_round, self.n_days)
 		self.matches = []
 
+		# Votes and lineups changed by other processes are reloaded once
+		# here, matches and players read them without checking again. All
+		# the lineups are loaded, or calculated, at once
+		vs.get_vote_store(database)
+		mf.cached_mantra_batch(days=range(1, self.n_days + 1),
+		                       teams=fteams, database=database)
+
 		self.play_league()
 		self.ranking = None
 
@@ -384,73 +400,32 @@ class League(object):
 				team1, team2 = match.split(' - ')
 				m = Match(self.fteams[team1], self.fteams[team2], day,
 				          self.all_players, self.captain, self.captain_details,
-				          self.rfactor, self.rfactor_details)
+				          self.captains, self.rfactor, self.rfactor_details,
+				          self.database)
 
 				self.matches.append(m)
 
-	def sort_by_classifica_avulsa(self, dataframe):
-
-		"""
-		Return the dataframe sorted by classifica avulsa.
-
-		:param dataframe: pd.Dataframe
-
-		:return: pd.Dataframe
+	def head_to_head(self):
 
 		"""
+		Return the matrix with the points each fantateam has gained against
+		each of the others, rows and columns in the order of self.fteams.
+		Used to sort the teams with the same points.
 
-		df = dataframe.copy()
-		mutable_index = df.index
-
-		values = df['Pt'].value_counts()
-		values = values[values > 1].index
-
-		for value in values:
-			sub_df = df[df['Pt'] == value]
-			mutable_index = np.array([x if x not in sub_df.index else 'Unknown'
-			                          for x in mutable_index], dtype='object')
-			sub_df = self.mini_ranking(sub_df)
-			mutable_index[mutable_index == 'Unknown'] = sub_df.index
-			df = df.reindex(mutable_index)
-
-		return df
-
-	def mini_ranking(self, dataframe):
+		:return: np.array
 
 		"""
-		Order each subgroup of teams with the same points according to the
-		matches they played between themselves.
 
-		:param dataframe: pd.DataFrame
-
-		:return: pd.DataFrame
-
-		"""
-
-		df = dataframe.copy()
-		df['CA'] = 0
-
-		teams = df.index
-		teams_dict = {team: 0 for team in teams}
-		sub_matches = mf.itertools.combinations(teams, 2)
-		sub_matches = [set(match) for match in sub_matches]
+		team_id = {ft: i for i, ft in enumerate(self.fteams)}
+		h2h = np.zeros((len(team_id), len(team_id)), dtype=int)
 
 		for i, day in enumerate(self.schedule):
 			for match in day:
-				match = set(match.split(' - '))
+				tm1, tm2 = match.split(' - ')
+				h2h[team_id[tm1], team_id[tm2]] += self.fteams[tm1].points[i]
+				h2h[team_id[tm2], team_id[tm1]] += self.fteams[tm2].points[i]
 
-				for sub_match in sub_matches:
-					if not sub_match - match:
-						tm1, tm2 = match
-
-						teams_dict[tm1] += self.fteams[tm1].points[i]
-						teams_dict[tm2] += self.fteams[tm2].points[i]
-
-		df['CA'] = df.index.map(teams_dict)
-		df.sort_values(by='CA', ascending=False, inplace=True)
-		df.drop('CA', axis=1, inplace=True)
-
-		return df
+		return h2h
 
 	def create_ranking(self, double_check=True):
 
@@ -474,15 +449,11 @@ class League(object):
 		cols = ['G', 'V', 'N', 'P', 'G+', 'G-', 'Dr', 'Pt', 'Tot Pt']
 		df = pd.DataFrame.from_dict(data, orient='index', columns=cols)
 		if double_check:
-			assert_df_is_correct(df, cols)
+			assert_df_is_correct(df, cols, self.database)
 
-		df.sort_values(by='N', ascending=False, inplace=True)
-		df.sort_values(by='V', ascending=False, inplace=True)
-		df.sort_values(by='Dr', ascending=False, inplace=True)
-		df.sort_values(by='G+', ascending=False, inplace=True)
-		df = self.sort_by_classifica_avulsa(df)
-		df.sort_values(by='Tot Pt', ascending=False, inplace=True)
-		df.sort_values(by='Pt', ascending=False, inplace=True)
+		order = tb.rank_teams({col: df[col].values for col in cols},
+		                      self.head_to_head())
+		df = df.iloc[order]
 
 		self.ranking = df.index
 
@@ -499,28 +470,19 @@ class League(object):
 
 		"""
 
-		lg_c = League(fteams={ft: Fantateam(ft) for ft in self.fteams},
-		              a_round=self.a_round,
-		              n_days=self.n_days,
-		              all_players=self.all_players,
-		              captain=True,
-		              rfactor=False)
-
-		lg_rf = League(fteams={ft: Fantateam(ft) for ft in self.fteams},
-		               a_round=self.a_round,
-		               n_days=self.n_days,
-		               all_players=self.all_players,
-		               captain=False,
-		               rfactor=True)
+		# Points with only one of the two rules, from the results of the
+		# matches already played
+		points_c = self.points_with_rules(captain=True, rfactor=False)
+		points_rf = self.points_with_rules(captain=False, rfactor=True)
 
 		data_c = {ft:
 			         f'{self.fteams[ft].captain_bonus_malus_balance} '
-			         f'({sum(self.fteams[ft].points) - sum(lg_rf.fteams[ft].points)})'
+			         f'({sum(self.fteams[ft].points) - points_rf[ft]})'
 		          for ft in self.fteams}
 
 		data_rf = {ft:
 			          f'{self.fteams[ft].rfactor_bonus_malus_balance} '
-			          f'({sum(self.fteams[ft].points) - sum(lg_c.fteams[ft].points)})'
+			          f'({sum(self.fteams[ft].points) - points_c[ft]})'
 		           for ft in self.fteams}
 
 		data = {ft: (round(sum(self.fteams[ft].points) / self.n_days, 2),
@@ -543,68 +505,72 @@ class League(object):
 
 		return df.style.set_properties(**{'width': '60px'})
 
-	def switch_teams_in_round(self, team1, team2):
+	def points_with_rules(self, **rules):
 
 		"""
-		Create a new round where team1 and team2 are switched.
-		Used inside create_heatmap().
-
-		:param team1: str
-		:param team2: str
+		Return the points each fantateam would have if the league were played
+		with the rules in 'rules' on or off, Ex. captain=False. Rules not
+		given are the ones of the league. Matches are not played again, the
+		absolute points are rebuilt from the components recorded by each
+		Match.
 
-		:return: list, each element of the list is a list of tuples
+		:return: dict, Ex. {'Ciolle United': 54, 'FC STRESS': 48, ...}
 
 		"""
 
-		new_round = [[match.replace(team1, 'XXX') for match in day]
-		             for day in self.a_round]
-		new_round = [[match.replace(team2, team1) for match in day]
-		             for day in new_round]
-		new_round = [[match.replace('XXX', team2) for match in day]
-		             for day in new_round]
-		new_round = [[(tm1, tm2) for x in i for tm1, tm2 in
-		              (x.split(' - '),)] for i in new_round]
+		rules = {'captain': self.captain, 'rfactor': self.rfactor, **rules}
+		teams = list(self.fteams)
+		team_id = {ft: i for i, ft in enumerate(teams)}
 
-		return new_round
+		abs_points = np.zeros((len(teams), self.n_days))
+		for match in self.matches:
+			for ft, comp in match.components.items():
+				abs_points[team_id[ft], match.day - 1] = comp['base'] + sum(
+						comp[rule] for rule, used in rules.items() if used)
 
-	def create_heatmap(self):
+		res = cf.simulate_leagues(abs_points, self.schedule_array(teams)[None])
 
-		"""
-		Create a heatmap which shows how many points (relative to the real
-		points) the teams on the vertical axis would have when switching its
-		calendar with each of the teams in the horizontal axis.
+		return dict(zip(teams, res['points'][0].tolist()))
 
-		:return: sns.heatmap
+	def schedule_array(self, teams):
 
 		"""
+		Return self.schedule as an array of team indexes, where the index of
+		each team is its position in 'teams'. See cf.rounds_to_array().
+
+		:param teams: list
 
-		teams = self.ranking
-		points = {tm: sum(self.fteams[tm].points) for tm in teams}
-		abs_points = create_abs_points_dict(teams, self.n_days)
+		:return: np.array, (days, matches, 2)
 
-		df = pd.DataFrame(0, index=teams, columns=teams)
+		"""
 
-		for tm1 in teams:
-			for tm2 in teams:
+		return cf.rounds_to_array(
+				[[[tuple(match.split(' - ')) for match in day]
+				  for day in self.schedule]], teams)[0]
 
-				if tm1 == tm2 or df.loc[tm1, tm2]:
-					continue
+	def create_heatmap(self, positions=False):
 
-				new_round = self.switch_teams_in_round(tm1, tm2)
+		"""
+		Create a heatmap which shows how many points (relative to the real
+		points) the teams on the vertical axis would have when switching its
+		calendar with each of the teams in the horizontal axis. All the
+		swaps are played in a single batch, see cf.swap_matrix().
 
-				new_teams = {ft: Fantateam(ft) for ft in self.fteams}
+		:param positions: bool, show the positions gained instead of the
+		                  points
 
-				new_lg = FastLeague(new_teams, abs_points, new_round,
-				                    self.n_days)
+		:return: sns.heatmap
 
-				idx1 = np.argwhere(new_lg.ranking[0] == tm1).flatten()
-				idx2 = np.argwhere(new_lg.ranking[0] == tm2).flatten()
+		"""
 
-				pt1 = new_lg.ranking[1][idx1][0]
-				pt2 = new_lg.ranking[1][idx2][0]
+		teams = list(self.ranking)
+		abs_points = create_abs_points_dict(teams, self.n_days, self.database)
+		delta_points, delta_positions = cf.swap_matrix(
+				cf.abs_points_matrix(abs_points, teams),
+				self.schedule_array(teams))
 
-				df.loc[tm1, tm2] = pt1 - points[tm1]
-				df.loc[tm2, tm1] = pt2 - points[tm2]
+		df = pd.DataFrame(delta_positions if positions else delta_points,
+		                  index=teams, columns=teams)
 
 		fig, ax = plt.subplots(figsize=(6, 6))
 		fig.subplots_adjust(left=.3, bottom=.3)
@@ -615,133 +581,100 @@ class League(object):
 		plt.show()
 
 
-class FastFantateam(object):
-
-	def __init__(self, name):
-		self.name = name
-		self.points = 0
-		self.abs_points = 0
-
-
-class FastMatch(object):
-
-	def __init__(self, team1, team2, day, abs_points):
-
-		self.team1 = team1
-		self.team2 = team2
-		self.day = day
-		self.abs_points1 = abs_points[self.team1.name][self.day - 1]
-		self.abs_points2 = abs_points[self.team2.name][self.day - 1]
-
-		self.update_fantateams_data(self.abs_points1, self.abs_points2)
-
-	def update_fantateams_data(self, abs_points1, abs_points2):
-
-		"""
-		Update FastFantateam attributes.
-
-		:param abs_points1: float
-		:param abs_points2: float
-
-		:return: nothing
-
-		"""
-
-		goals1 = int(max(abs_points1 - 60, 0) // 6)
-		goals2 = int(max(abs_points2 - 60, 0) // 6)
-
-		self.team1.abs_points += abs_points1
-		self.team2.abs_points += abs_points2
-
-		if goals1 == goals2:
-			self.team1.points += 1
-			self.team2.points += 1
-
-		elif goals1 > goals2:
-			self.team1.points += 3
-
-		else:
-			self.team2.points += 3
-
-
-class FastLeague(object):
-
-	def __init__(self, fteams, abs_points, a_round, n_days):
-
-		self.fteams = {ft: FastFantateam(ft) for ft in fteams}
-		self.abs_points = abs_points
-		self.a_round = a_round
-		self.schedule = ef.generate_schedule(a_round, n_days)
-
-		self.play_league()
-		self.ranking = self.create_ranking(n_days)
-
-	def play_league(self):
-
-		"""
-		Cerate and play all the matches of the league.
-
-		:return: nothing
-
-		"""
-
-		for day, matches in enumerate(self.schedule, 1):
-			for team1, team2 in matches:
-				FastMatch(self.fteams[team1], self.fteams[team2], day,
-				          self.abs_points)
-
-	def create_ranking(self, days):
-
-		"""
-		Create the dataframe with the main attributes for each fantateam.
-
-		:param days: int
-
-		:return: pd.Index, pd.Series
-
-		"""
-
-		data = {ft: (days, self.fteams[ft].points,
-		             self.fteams[ft].abs_points) for ft in self.fteams}
-
-		cols = ['G', 'Pt', 'Tot Pt']
-		df = pd.DataFrame.from_dict(data, orient='index', columns=cols)
-
-		df.sort_values(by='Tot Pt', ascending=False, inplace=True)
-		df.sort_values(by='Pt', ascending=False, inplace=True)
-
-		return df.index, df['Pt'].values
-
-
 class Calendar(object):
 
-	def __init__(self, fteams, n_leagues, n_days, verbose=True):
+	def __init__(self, fteams, n_leagues, n_days, verbose=True, exact=False,
+	             seed=None, workers=cfg.WORKERS, database=cfg.dbase1):
 
 		"""
 		:param fteams: list
-		:param n_leagues: int
+		:param n_leagues: int, ignored when exact is True
 		:param n_days: int
+		:param verbose: bool
+		:param exact: bool, if True play every possible league instead of
+		              'n_leagues' random ones. Positions are then exact
+		              probabilities and the archive only keeps, for each
+		              position and team, the league with the most points
+		:param seed: int, to sample the same random leagues every time
+		:param workers: int, number of processes playing the leagues. The
+		                results do not depend on it
+		:param database: str, database of the season, see season_calendar()
 
 		"""
 
 		self.teams = {team: Fantateam(team) for team in fteams}
 		self.n_leagues = n_leagues
-		self.abs_points = create_abs_points_dict(self.teams, n_days)
+		self.database = database
+		self.abs_points = create_abs_points_dict(self.teams, n_days, database)
 		self.positions = {i: {team: 0 for team in fteams} for i in range(1, 9)}
 		self.archive = {i: {team: [] for team in fteams} for i in range(1, 9)}
-		self.rounds = ef.random_rounds(n_leagues)
+		self.counts = {i: {team: 0 for team in fteams} for i in range(1, 9)}
+		self.rounds = (None if exact else
+		               ef.random_rounds_array(n_leagues, seed, fteams))
 		self.max_pt = {team: 0 for team in fteams}
 		self.min_pt = {team: 100 for team in fteams}
 		self.avg = {team: 0 for team in fteams}
 		self.verbose = verbose
+		self.workers = workers
 
-		self.simulation(fteams, n_days)
+		if exact:
+			self.exact_simulation(fteams, n_days)
+		else:
+			self.simulation(fteams, n_days)
 		for pos in self.archive:
 			for team in self.archive[pos]:
 				self.archive[pos][team].sort(key=lambda x: x[0], reverse=True)
 				self.archive[pos][team] = [rn for pt, rn in self.archive[pos][team]]
+				if not exact:
+					self.counts[pos][team] = len(self.archive[pos][team])
 		self.stats = self.stats(fteams)
 
+	def exact_simulation(self, teams, n_days):
+
+		"""
+		Play every possible league and update the attributes. Leagues are
+		not played one by one: see calendar_functions.exact_leagues().
+
+		:param teams: list, Ex ['Ciolle United', 'FC STRESS', 'Bucalina',...]
+		:param n_days: int
+
+		:return: nothing
+
+		"""
+
+		letters = [string.ascii_uppercase[i] for i in range(len(teams))]
+		unordered = cf.rounds_to_array(ef.all_unordered_rounds(len(teams)),
+		                               letters)
+
+		res = cf.play_all_leagues(
+				abs_points=cf.abs_points_matrix(self.abs_points, teams),
+				unordered_rounds=unordered,
+				n_days=n_days,
+				workers=self.workers,
+				verbose=self.verbose)
+
+		self.n_leagues = res['n_leagues']
+
+		# Only the best leagues are kept, letter i is teams[i]
+		best = {key: i for i, key in enumerate(res['best'])}
+		self.rounds = np.array([unordered[rn][list(order)]
+		                        for _, rn, order in res['best'].values()])
+
+		for t, tm in enumerate(teams):
+			self.max_pt[tm] = int(res['max_points'][t])
+			self.min_pt[tm] = int(res['min_points'][t])
+			self.avg[tm] = float(res['sum_points'][t]) / self.n_leagues
+
+			for pos in range(len(teams)):
+				count = int(res['counts'][pos, t])
+				self.counts[pos + 1][tm] = count
+				self.positions[pos + 1][tm] = count / self.n_leagues * 100
+
+				if (pos, t) in res['best']:
+					points = res['best'][(pos, t)][0]
+					self.archive[pos + 1][tm].append((points,
+					                                  best[(pos, t)]))
+
 	def simulation(self, teams, n_days):
 
 		"""
@@ -754,27 +687,42 @@ class Calendar(object):
 
 		"""
 
-		for i, a_round in enumerate(self.rounds, 1):
+		res = cf.play_leagues(
+				abs_points=cf.abs_points_matrix(self.abs_points, teams),
+				rounds=self.rounds,
+				n_days=n_days,
+				workers=self.workers,
+				chunk=cfg.SIMULATION_CHUNK,
+				verbose=self.verbose)
 
-			fl = FastLeague(teams, self.abs_points, a_round, n_days)
+		n_rounds = len(self.rounds)
+		for t, tm in enumerate(teams):
+			self.max_pt[tm] = int(res['max_points'][t])
+			self.min_pt[tm] = int(res['min_points'][t])
+			self.avg[tm] = float(res['sum_points'][t]) / n_rounds
 
-			names, points = fl.ranking
+			for pos in range(len(teams)):
+				idx = np.flatnonzero(res['positions'][:, t] == pos)
+				self.positions[pos + 1][tm] = len(idx) / n_rounds * 100
+				self.archive[pos + 1][tm] = [(int(res['points'][i, t]), i)
+				                             for i in idx]
 
-			for pos, tm in enumerate(names, 1):
-				self.positions[pos][tm] += (1 / len(self.rounds))*100
+	def named_round(self, idx):
 
-				if points[pos - 1] > self.max_pt[tm]:
-					self.max_pt[tm] = points[pos - 1]
+		"""
+		Return the round in position 'idx' of self.rounds with the names of
+		the teams. The archive only stores these positions.
+
+		:param idx: int
 
-				if points[pos - 1] < self.min_pt[tm]:
-					self.min_pt[tm] = points[pos - 1]
+		:return: list, Ex. [(('FC STRESS', 'Bucalina'), ...), ...]
 
-				self.archive[pos][tm].append((points[pos - 1], a_round))
+		"""
 
-				self.avg[tm] += points[pos - 1] / len(self.rounds)
+		teams = list(self.teams)
 
-			if self.verbose:
-				print(f'\rCampionati giocati: {i}/{len(self.rounds)}', end='')
+		return [tuple((teams[tm1], teams[tm2]) for tm1, tm2 in day)
+		        for day in self.rounds[idx].tolist()]
 
 	def stats(self, teams):
 
@@ -822,18 +770,20 @@ class Calendar(object):
 		"""
 
 		res = self.archive[position][team]
+		count = self.counts[position][team]
 		if not res:
 			print(f'{team} mai in {position}° posizione.')
 		else:
-			if len(res) == 1:
+			if count == 1:
 				name = 'campionato'
 			else:
 				name = 'campionati'
 
 			print(f'{team} in {position}° posizione: '
-			      f'{len(res)} {name} su {self.n_leagues}.')
+			      f'{count} {name} su {self.n_leagues}.')
 
-			rn = [[f'{tm1} - {tm2}' for tm1, tm2 in el] for el in res[0]]
+			rn = [[f'{tm1} - {tm2}' for tm1, tm2 in el]
+			      for el in self.named_round(res[0])]
 
 			rn_complete = ef.generate_schedule(rn, n_days)
 
@@ -841,7 +791,8 @@ class Calendar(object):
 			for day, matches in enumerate(rn_complete, 1):
 				for match in matches:
 					tm1, tm2 = match.split(' - ')
-					data.append((match, get_result(tm1, tm2, day)))
+					data.append((match, get_result(tm1, tm2, day,
+					                               self.database)))
 
 			new_data = []
 			added = []
@@ -867,17 +818,18 @@ class Calendar(object):
 			df.set_index('N', drop=True, inplace=True)
 			df.index.name = None
 
-			sp = League(fteams=fantateams,
+			sp = League(fteams=list(self.teams),
 		                a_round=rn,
-		                n_days=DAYS,
-		                all_players=players,
+		                n_days=n_days,
+		                all_players=season_players(self.database),
 		                captain=True,
-		                rfactor=True)
+		                rfactor=True,
+		                database=self.database)
 			display(sp.create_ranking(double_check=False))
 			display(df.style.set_properties(**{'width': '50px'}))
 
 
-def assert_df_is_correct(dataframe, columns):
+def assert_df_is_correct(dataframe, columns, database=cfg.dbase1):
 
 	"""
 	Check if code is working correctly by comparing the result with the real
@@ -885,10 +837,12 @@ def assert_df_is_correct(dataframe, columns):
 
 	:param dataframe: Pandas DataFrame
 	:param columns: list
+	:param database: str
 
 	"""
 
-	classifica = dbf.db_select(table='classifica', columns=['*'], where='')
+	classifica = dbf.db_select(table='classifica', columns=['*'], where='',
+	                           database=database)
 	classifica = {team[0]: team[1:] for team in classifica}
 	df = pd.DataFrame.from_dict(classifica, orient='index', columns=columns)
 
@@ -903,35 +857,27 @@ def assert_df_is_correct(dataframe, columns):
 		raise ValueError('La classifica non coincide con quella reale')
 
 
-def create_abs_points_dict(fteams, n_days):
+def create_abs_points_dict(fteams, n_days, database=cfg.dbase1):
 
 	"""
 	Create a dict with each fantateam's abs_points day by day.
 
 	:param fteams: list, Ex. ['Ciolle United', ' FC STRESS', ...]
 	:param n_days: int
+	:param database: str
 
 	:return: dict, Ex. {'Ciolle United': [67.5, 72, 68, ...],
 						'FC STRESS': [72, 70.5, 64, ...], ...}
 
 	"""
 
-	abs_points = {tm: None for tm in fteams}
+	days = range(1, n_days + 1)
+	points = sf.abs_points(fteams, days, database)
 
-	for tm in abs_points:
-		p = dbf.db_select(
-				table='absolute_points',
-				columns=[f'day_{day}' for day in range(1, n_days + 1)],
-				where=f'team_name="{tm}"')[0]
-		if type(p) == tuple:
-			abs_points[tm] = p
-		else:
-			abs_points[tm] = [p]
-
-	return abs_points
+	return {tm: [points.get((tm, day)) for day in days] for tm in fteams}
 
 
-def get_result(team1, team2, day):
+def get_result(team1, team2, day, database=cfg.dbase1):
 
 	"""
 	Return a string with the result of the match. Used inside specific_round().
@@ -939,27 +885,23 @@ def get_result(team1, team2, day):
 	:param team1: str
 	:param team2: str
 	:param day: int
+	:param database: str
 
 	:return: str
 
 	"""
 
-	abs_points1 = dbf.db_select(
-			table='absolute_points',
-			columns=[f'day_{day}'],
-			where=f'team_name="{team1}"')[0]
-	abs_points2 = dbf.db_select(
-			table='absolute_points',
-			columns=[f'day_{day}'],
-			where=f'team_name="{team2}"')[0]
+	points = sf.abs_points([team1, team2], [day], database)
+	abs_points1, abs_points2 = points[(team1, day)], points[(team2, day)]
 
-	goals1 = int(max(abs_points1 - 60, 0) // 6)
-	goals2 = int(max(abs_points2 - 60, 0) // 6)
+	goals1 = int(cf.goals_from_abs_points(abs_points1))
+	goals2 = int(cf.goals_from_abs_points(abs_points2))
 
 	return f'{goals1} - {goals2}'
 
 
-def average_global_std(fteams, days, num_leagues, iterations):
+def average_global_std(fteams, days, num_leagues, iterations, seed=None,
+                       workers=cfg.WORKERS):
 
 	"""
 	Compute the average std in the final positions (in %) of each team after
@@ -971,6 +913,8 @@ def average_global_std(fteams, days, num_leagues, iterations):
 	:param days: int
 	:param num_leagues: int
 	:param iterations: int
+	:param seed: int, iteration i uses seed + i
+	:param workers: int
 
 	:return: dict
 
@@ -979,7 +923,9 @@ def average_global_std(fteams, days, num_leagues, iterations):
 	avg_std = {team: [] for team in fteams}
 
 	for i in range(iterations):
-		cl = Calendar(fteams, num_leagues, days, verbose=False)
+		cl = Calendar(fteams, num_leagues, days, verbose=False,
+		              seed=None if seed is None else seed + i,
+		              workers=workers)
 		positions = cl.positions
 
 		for team in fteams:
@@ -994,17 +940,19 @@ def average_global_std(fteams, days, num_leagues, iterations):
 	return avg_std
 
 
-def captain_points(captain_true_false, fantateam_name, lineup,
-                   day, captain_details):
+def captain_points(captain_true_false, captain_and_vice, lineup,
+                   day, captain_details, database=cfg.dbase1):
 
 	"""
 	Return the bonus/malus points associated with the vote of the captain.
 
 	:param captain_true_false: bool
-	:param fantateam_name: str
+	:param captain_and_vice: tuple, Ex. ('HANDANOVIC', 'SKRINIAR'), see
+	                         sf.captains()
 	:param lineup: list
 	:param day: int
 	:param captain_details: dict
+	:param database: str
 
 	:return: float
 
@@ -1013,22 +961,21 @@ def captain_points(captain_true_false, fantateam_name, lineup,
 	if not captain_true_false:
 		return 0
 
-	text = dbf.db_select(table='captains',
-	                     columns=[f'day_{day}'],
-	                     where=f'team_name = "{fantateam_name}"')[0]
-	captain, vice = text.split(', ')
+	captain, vice = captain_and_vice
 
+	votes = vs.get_vote_store(database, check=False)
 	if captain in lineup:
-		vote = players[captain].vote(day)
+		vote = votes.get_vote(captain, day)
 	elif vice in lineup:
-		vote = players[vice].vote(day)
+		vote = votes.get_vote(vice, day)
 	else:
 		vote = 'sv'
 
 	return captain_details[vote]
 
 
-def rfactor_points(rfac_true_false, rfac_details, lineup, day):
+def rfactor_points(rfac_true_false, rfac_details, lineup, day,
+                   database=cfg.dbase1):
 
 	"""
 	Return the bonus/malus points associated with the R-factor.
@@ -1037,6 +984,7 @@ def rfactor_points(rfac_true_false, rfac_details, lineup, day):
 	:param rfac_details: dict
 	:param lineup: list
 	:param day: int
+	:param database: str
 
 	:return: float
 
@@ -1045,8 +993,9 @@ def rfactor_points(rfac_true_false, rfac_details, lineup, day):
 	if not rfac_true_false:
 		return 0
 
-	list_of_votes = [players[i].vote(day) for i in lineup]
-	n_suff = sum([1 for vote in list_of_votes if vote >= 6])
+	votes = vs.get_vote_store(database, check=False)
+	list_of_votes = votes.votes_of(lineup, day)
+	n_suff = int((list_of_votes >= 6).sum())
 	return rfac_details[n_suff]
 
 
@@ -1054,7 +1003,8 @@ def optimal_number_iterations(verbose):
 
 	"""
 	Run many random leagues in order to find out the number of random leagues
-	needed to have stable and reproducible results.
+	needed to have stable and reproducible results. Not needed when using
+	Calendar(..., exact=True), which has no sampling error.
 
 	:param verbose: bool
 
@@ -1085,10 +1035,101 @@ def optimal_number_iterations(verbose):
 	plt.show()
 
 
+def season_players(database=cfg.dbase1):
+
+	"""
+	Return all the players with a vote in the season of 'database', reading
+	from its VoteStore.
+
+	:param database: str
+
+	:return: dict, Ex: player_name: Player() instance
+
+	"""
+
+	store = vs.get_vote_store(database)
+	return {pl: Player(pl, store) for pl in store.names}
+
+
+def season_league(season, captain=True, rfactor=True):
+
+	"""
+	Play the real league of 'season' with its own teams, round and days
+	played. Archived seasons only read their database, lineups are already
+	there, see ar.archive_season().
+
+	:param season: str, Ex. '2019-20', see ar.available_seasons()
+	:param captain: bool
+	:param rfactor: bool
+
+	:return: League() instance
+
+	"""
+
+	database = ar.season_database(season)
+	teams = dbf.db_select(table='teams', columns=['team_name'], where='',
+	                      database=database)
+	a_round = [dbf.db_select(table='round', columns=[f'day_{i}'], where='',
+	                         database=database)
+	           for i in range(1, len(teams))]
+
+	return League(fteams=teams,
+	              a_round=a_round,
+	              n_days=sf.last_day_played(database),
+	              all_players=season_players(database),
+	              captain=captain,
+	              rfactor=rfactor,
+	              database=database)
+
+
+def season_calendar(season, n_leagues, **kwargs):
+
+	"""
+	Run the random leagues of 'season', see Calendar().
+
+	:param season: str, Ex. '2019-20', see ar.available_seasons()
+	:param n_leagues: int
+	:param kwargs: other arguments of Calendar()
+
+	:return: Calendar() instance
+
+	"""
+
+	database = ar.season_database(season)
+	teams = dbf.db_select(table='teams', columns=['team_name'], where='',
+	                      database=database)
+
+	return Calendar(teams, n_leagues, sf.last_day_played(database),
+	                database=database, **kwargs)
+
+
+def seasons_ranking(seasons=None, captain=True, rfactor=True):
+
+	"""
+	Create the ranking of each season with the same rules, to compare them.
+
+	:param seasons: list, all the available ones if None
+	:param captain: bool
+	:param rfactor: bool
+
+	:return: pd.DataFrame, indexed by (season, team)
+
+	"""
+
+	rankings = {}
+	for season in seasons or ar.available_seasons():
+		lg = season_league(season, captain, rfactor)
+		rankings[season] = lg.create_ranking(double_check=False).data
+
+	return pd.concat(rankings, names=['Stagione', 'Team'])
+
+
+# Migrations are applied explicitly, see db_migrations
+dbm.check_version()
+
 fantateams = dbf.db_select(table='teams', columns=['team_name'], where='')
 
-players = set(dbf.db_select(table='votes', columns=['name'], where=''))
-players = {pl: Player(pl) for pl in players}
+players = {pl: Player(pl) for pl in vs.get_vote_store().names}
 
 our_round = [dbf.db_select(table='round', columns=[f'day_{i}'], where='')
              for i in range(1, len(fantateams))]
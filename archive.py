@@ -0,0 +1,166 @@
+import os
+import glob
+import sqlite3
+import db_functions as dbf
+import mantra_functions as mf
+import season_functions as sf
+import standings as st
+import vote_store as vs
+import config as cfg
+
+
+def _archive_path(season: str) -> str:
+    return os.path.join(cfg.ARCHIVE_DIR, f'fantascandalo_{season}.db')
+
+
+def _schema(season: str) -> str:
+
+    """
+    Return the name the database of 'season' is attached with, Ex.
+    'season_2019_20' for '2019-20'.
+    """
+
+    return 'season_' + season.replace('-', '_')
+
+
+def archive_season(season: str = cfg.YEAR, database: str = cfg.dbase1,
+                   verbose: bool = True) -> str:
+
+    """
+    Save a copy of 'database' as the archived 'season', replacing the one
+    already there. Lineups calculated by mantra and standings are completed
+    before copying, so the archived season can be analyzed without
+    calculating anything again. Return the path of the copy.
+    """
+
+    lineups = sf.lineups(database=database)
+    for i, (tm, day) in enumerate(sorted(lineups), 1):
+        mf.cached_mantra(day, tm, database=database)
+        if verbose:
+            print(f'\rFormazioni calcolate: {i}/{len(lineups)}', end='')
+    if verbose and lineups:
+        print()
+
+    st.update_standings(database=database)
+
+    path = _archive_path(season)
+    os.makedirs(cfg.ARCHIVE_DIR, exist_ok=True)
+    target = sqlite3.connect(path)
+    try:
+        dbf.get_connection(database).backup(target)
+    finally:
+        target.close()
+
+    # Data of the copy kept in memory by this process are now stale
+    vs.refresh_vote_store(path)
+    mf.refresh_roles(path)
+    mf.invalidate_mantra_cache(database=path)
+
+    if verbose:
+        print(f'Stagione {season} archiviata in {path}')
+
+    return path
+
+
+def attach_seasons(seasons: list = None,
+                   database: str = cfg.dbase1) -> dict:
+
+    """
+    Attach the databases of 'seasons' (all the available ones if None) to the
+    connection of 'database', the ones already attached are skipped. It
+    cannot be called inside a transaction and SQLite attaches at most 10
+    databases by default.
+
+    :param seasons: list, Ex. ['2019-20', '2020-21']
+    :param database: str
+
+    :return: dict, {season: name of its schema}, 'main' for the season of
+             'database' itself
+
+    """
+
+    db = dbf.get_connection(database)
+    attached = {name for _, name, _ in db.execute('PRAGMA database_list')}
+
+    schemas = {}
+    for season in seasons or available_seasons():
+        path = season_database(season)
+        if path == database:
+            schemas[season] = 'main'
+            continue
+
+        schema = _schema(season)
+        if schema not in attached:
+            db.execute(f'ATTACH DATABASE ? AS {schema}', (path, ))
+        schemas[season] = schema
+
+    return schemas
+
+
+def available_seasons() -> list:
+
+    """
+    Return the archived seasons and the current one, cfg.YEAR, in order.
+    """
+
+    prefix, suffix = _archive_path('*').split('*')
+    seasons = {path[len(prefix):-len(suffix)]
+               for path in glob.glob(_archive_path('*'))}
+
+    return sorted(seasons | {cfg.YEAR})
+
+
+def season_database(season: str) -> str:
+
+    """
+    Return the database of 'season': cfg.dbase1 for the current one, the
+    archived copy for the others.
+    """
+
+    if season == cfg.YEAR:
+        return cfg.dbase1
+
+    path = _archive_path(season)
+    if not os.path.exists(path):
+        raise ValueError(f'Stagione {season} non archiviata')
+
+    return path
+
+
+def seasons_select(table: str, columns: list, where='',
+                   seasons: list = None, params: tuple = (),
+                   database: str = cfg.dbase1) -> list:
+
+    """
+    Select 'columns' of 'table' in all 'seasons' with a single UNION ALL
+    query over the attached databases, see attach_seasons(). Each row starts
+    with the season.
+
+    Ex.
+        seasons_select(table='team_days',
+                       columns=['team_name', 'AVG(abs_points)'],
+                       where='day <= ? GROUP BY team_name', params=(10, ))
+
+    :param table: str
+    :param columns: list
+    :param where: dict or str, see dbf.where_clause(). Applied to each season
+    :param seasons: list, all the available ones if None
+    :param params: tuple
+    :param database: str, the one whose connection is used
+
+    :return: list, Ex. [('2019-20', 'Ciolle United', 71.3), ...]
+
+    """
+
+    schemas = attach_seasons(seasons, database)
+    where, params = dbf.where_clause(where, params)
+
+    cols = ', '.join(columns)
+    where = f' WHERE {where}' if where else ''
+    query = ' UNION ALL '.join(
+            f'SELECT * FROM (SELECT ? AS season, {cols} '
+            f'FROM {schema}.{table}{where})' for schema in schemas.values())
+    all_params = [value for season in schemas
+                  for value in (season, *params)]
+
+    return list(dbf.get_connection(database).execute(query, all_params))
@@ -0,0 +1,567 @@
+import numpy as np
+import tiebreak as tb
+import config as cfg
+from math import factorial
+from itertools import combinations, permutations
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Data shared read-only by the workers of the process pool, set once per
+# worker by _init_worker() instead of being sent with every shard
+_SHARED = {}
+
+
+def _init_worker(abs_points: np.array) -> None:
+    _SHARED['abs_points'] = abs_points
+
+
+def _play_all_shard(args: tuple) -> dict:
+    unordered_rounds, start, n_days = args
+    res = exact_leagues(_SHARED['abs_points'], unordered_rounds, n_days)
+    res['best'] = {k: (pt, start + rn, order) for k, (pt, rn, order) in
+                   res['best'].items()}
+    return res
+
+
+def _play_shard(args: tuple) -> dict:
+    rounds, n_days = args
+    schedules = schedules_from_rounds(rounds, n_days)
+    return summarize_leagues(simulate_leagues(_SHARED['abs_points'],
+                                              schedules))
+
+
+def _run_shards(function, shards: list, abs_points: np.array, workers: int,
+                verbose: bool, total: int, sizes: list) -> list:
+
+    """
+    Run 'function' on every shard, in a pool of 'workers' processes if more
+    than 1. Results are returned in the same order of the shards, whatever
+    the number of workers, so merging them is deterministic.
+    """
+
+    results = []
+    done = 0
+
+    # No need to start the pool for a single shard
+    workers = min(workers, len(shards))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(abs_points, )) as executor:
+            for res, size in zip(executor.map(function, shards), sizes):
+                results.append(res)
+                done += size
+                if verbose:
+                    print(f'\rCampionati giocati: {done}/{total}', end='')
+    else:
+        _init_worker(abs_points)
+        for shard, size in zip(shards, sizes):
+            results.append(function(shard))
+            done += size
+            if verbose:
+                print(f'\rCampionati giocati: {done}/{total}', end='')
+
+    return results
+
+
+def abs_points_matrix(abs_points: dict, teams: list) -> np.array:
+
+    """
+    Return the absolute points as a (teams, days) matrix where rows follow
+    the order of 'teams'.
+
+    :param abs_points: dict, output of create_abs_points_dict()
+    :param teams: list
+
+    :return: np.array
+
+    """
+
+    return np.array([abs_points[tm] for tm in teams], dtype=float)
+
+
+def calendar_schedules(schedule: np.array, calendars: np.array) -> np.array:
+
+    """
+    Return the schedules where each team plays with the calendar of another
+    team, obtained by renaming the teams of 'schedule', without building any
+    league.
+
+    :param schedule: np.array, (days, matches, 2) with team indexes
+    :param calendars: np.array, (P, teams), calendars[k, t] is the team
+                      whose calendar team t plays in the k-th schedule. Each
+                      row must be a permutation of the teams
+
+    :return: np.array, (P, days, matches, 2)
+
+    """
+
+    # Team in the place of each team of 'schedule'
+    names = np.argsort(calendars, axis=1)
+    return names[:, schedule]
+
+
+def exact_leagues(abs_points: np.array, unordered_rounds: np.array,
+                  n_days: int, chunk: int = 50, verbose: bool = False) -> dict:
+
+    """
+    Play every possible league, i.e. every unordered round with its days in
+    every possible order.
+    The result of a team in a league only depends on which opponent it meets
+    in each position of the round, so we first compute, for each team, each
+    opponent and each position j of the round, the points, goals taken,
+    victories and draws collected in all the days of the season played with
+    the j-th day of the round. Then the stats of every ordering of the days
+    are just sums of these values, goals scored do not depend on the order
+    at all. Each team meets each opponent once in a round, so the
+    head-to-head points are the same values too. Teams are then sorted with
+    tiebreak.rank_teams(), as in simulate_leagues().
+
+    :param abs_points: np.array, (teams, days)
+    :param unordered_rounds: np.array, (F, days_in_round, matches, 2)
+    :param n_days: int
+    :param chunk: int, number of unordered rounds processed at once
+    :param verbose: bool
+
+    :return: dict, with keys
+             - 'n_leagues': int
+             - 'counts': (positions, teams), number of leagues where each
+                team ends in each position
+             - 'max_points', 'min_points', 'sum_points': (teams, )
+             - 'best': dict, (position, team) -> (points, round, order),
+               the league with the max points among those where team ends
+               in position. 'round' is the index of the unordered round and
+               'order' the order of its days
+
+    """
+
+    n_teams = abs_points.shape[0]
+    n_rounds, days_in_round = unordered_rounds.shape[:2]
+    abs_points = abs_points[:, :n_days]
+
+    # Stats of each match, (teams, opponents, days)
+    goals = goals_from_abs_points(abs_points)
+    all_points = match_points(goals[:, None, :], goals[None, :, :])
+    by_match = {'Pt': all_points,
+                'G-': np.broadcast_to(goals[None, :, :], all_points.shape),
+                'V': all_points == 3,
+                'N': all_points == 1}
+
+    # (teams, opponents, position in round, stats). Stats are the last axis
+    # so the gathers below copy contiguous blocks
+    by_pos = np.zeros((n_teams, n_teams, days_in_round, len(by_match)),
+                      dtype=np.int32)
+    for s, values in enumerate(by_match.values()):
+        for j in range(days_in_round):
+            by_pos[:, :, j, s] = values[:, :, j::days_in_round].sum(axis=2)
+
+    goals_scored = goals.sum(axis=1)
+    tot_points = abs_points.sum(axis=1)
+
+    orders = np.array(list(permutations(range(days_in_round))), dtype=int)
+    # Position in the round of each day, for each order
+    day_pos = np.argsort(orders, axis=1)
+    days = np.arange(days_in_round)
+    team_idx = np.arange(n_teams)[None, None, None, :]
+    pos_idx = np.arange(days_in_round)[None, None, :, None]
+
+    counts = np.zeros((n_teams, n_teams), dtype=np.int64)
+    max_points = np.full(n_teams, -1)
+    min_points = np.full(n_teams, np.iinfo(int).max)
+    sum_points = np.zeros(n_teams, dtype=np.int64)
+    best = {}
+
+    for start in range(0, n_rounds, chunk):
+        rounds = unordered_rounds[start:start + chunk]
+
+        # (rounds, day of the round, position in round, teams, stats)
+        opponents = opponents_matrix(rounds, n_teams)
+        contrib = by_pos[team_idx, opponents[:, :, None, :], pos_idx]
+
+        # (rounds, orders, teams, stats). Values are at most 3 * n_days so a
+        # small dtype is enough and makes the gathers much faster
+        totals = np.zeros((len(rounds), len(orders), n_teams, len(by_match)),
+                          dtype=np.int32)
+        for j in range(days_in_round):
+            totals += contrib[:, orders[:, j], j]
+
+        stats = {name: totals[..., s] for s, name in enumerate(by_match)}
+        points = stats['Pt']
+        stats.update({'G+': goals_scored,
+                      'Dr': goals_scored - stats['G-'],
+                      'P': abs_points.shape[1] - stats['V'] - stats['N'],
+                      'Tot Pt': tot_points})
+
+        # Head-to-head points, skipped if unused: the points of each day of
+        # the round where the opponent has the same points
+        if 'h2h' in cfg.RANKING_CRITERIA:
+            stats['h2h'] = np.zeros_like(points)
+            for r in range(len(rounds)):
+                # (orders, day of the round, teams)
+                same = points[r][:, None, :] == points[r][:, opponents[r]]
+                day_points = contrib[r, days, day_pos, :, 0]
+                stats['h2h'][r] = (day_points * same).sum(axis=1)
+
+        positions = np.argsort(tb.rank_teams(stats), axis=-1)
+
+        max_points = np.maximum(max_points, points.max(axis=(0, 1)))
+        min_points = np.minimum(min_points, points.min(axis=(0, 1)))
+        sum_points += points.sum(axis=(0, 1))
+
+        for t in range(n_teams):
+            pos_t = positions[:, :, t].ravel()
+            points_t = points[:, :, t].ravel()
+            counts[:, t] += np.bincount(pos_t, minlength=n_teams)
+
+            best_t = np.full(n_teams, -1, dtype=points.dtype)
+            np.maximum.at(best_t, pos_t, points_t)
+            for pos in np.flatnonzero(best_t >= 0).tolist():
+                if best_t[pos] <= best.get((pos, t), (-1, ))[0]:
+                    continue
+                idx = np.flatnonzero((pos_t == pos) &
+                                     (points_t == best_t[pos]))[0]
+                rn, order = np.unravel_index(idx, points.shape[:2])
+                best[(pos, t)] = (int(best_t[pos]), start + int(rn),
+                                  orders[order])
+
+        if verbose:
+            done = min(start + chunk, n_rounds) * len(orders)
+            print(f'\rCampionati giocati: {done}/{n_rounds * len(orders)}',
+                  end='')
+
+    return {'n_leagues': n_rounds * len(orders),
+            'counts': counts,
+            'max_points': max_points,
+            'min_points': min_points,
+            'sum_points': sum_points,
+            'best': best}
+
+
+def goals_from_abs_points(abs_points: np.array,
+                          threshold=cfg.GOAL_THRESHOLD,
+                          step=cfg.GOAL_STEP) -> np.array:
+
+    """
+    Convert absolute points (of any shape) into goals: 'threshold' points
+    are the first goal and then 1 goal every 'step' points. 'threshold' and
+    'step' can also be arrays broadcastable to 'abs_points'.
+    """
+
+    return (np.maximum(abs_points - threshold + step, 0) // step).astype(int)
+
+
+def match_points(goals: np.array, goals_opp: np.array) -> np.array:
+
+    """
+    Return 3 for a victory, 1 for a draw and 0 for a defeat, element-wise.
+    """
+
+    return np.where(goals > goals_opp, 3, np.where(goals == goals_opp, 1, 0))
+
+
+def merge_summaries(summaries: list) -> dict:
+
+    """
+    Merge the outputs of summarize_leagues() relative to consecutive groups
+    of leagues.
+    """
+
+    return {'points': np.concatenate([sm['points'] for sm in summaries]),
+            'positions': np.concatenate([sm['positions']
+                                         for sm in summaries]),
+            'counts': sum(sm['counts'] for sm in summaries),
+            'max_points': np.max([sm['max_points'] for sm in summaries],
+                                 axis=0),
+            'min_points': np.min([sm['min_points'] for sm in summaries],
+                                 axis=0),
+            'sum_points': sum(sm['sum_points'] for sm in summaries)}
+
+
+def opponents_matrix(schedules: np.array, n_teams: int) -> np.array:
+
+    """
+    Return, for each league, day and team, the index of the opponent.
+
+    :param schedules: np.array, (leagues, days, matches, 2)
+    :param n_teams: int
+
+    :return: np.array, (leagues, days, teams)
+
+    """
+
+    n_leagues, n_days, _, _ = schedules.shape
+
+    lg_idx = np.arange(n_leagues)[:, None, None]
+    day_idx = np.arange(n_days)[None, :, None]
+    home = schedules[..., 0]
+    away = schedules[..., 1]
+
+    opponents = np.empty((n_leagues, n_days, n_teams), dtype=int)
+    opponents[lg_idx, day_idx, home] = away
+    opponents[lg_idx, day_idx, away] = home
+
+    return opponents
+
+
+def play_all_leagues(abs_points: np.array, unordered_rounds: np.array,
+                     n_days: int, workers: int = 1, chunk: int = 50,
+                     verbose: bool = False) -> dict:
+
+    """
+    Parallel version of exact_leagues(): unordered rounds are split in
+    shards of 'chunk' rounds and played by 'workers' processes. The result
+    is the same as exact_leagues() for any number of workers.
+    """
+
+    starts = list(range(0, len(unordered_rounds), chunk))
+    shards = [(unordered_rounds[st:st + chunk], st, n_days) for st in starts]
+    n_orders = factorial(unordered_rounds.shape[1])
+    sizes = [len(sh[0]) * n_orders for sh in shards]
+
+    results = _run_shards(_play_all_shard, shards, abs_points, workers,
+                          verbose, sum(sizes), sizes)
+
+    merged = {'n_leagues': sum(res['n_leagues'] for res in results),
+              'counts': sum(res['counts'] for res in results),
+              'max_points': np.max([res['max_points'] for res in results],
+                                   axis=0),
+              'min_points': np.min([res['min_points'] for res in results],
+                                   axis=0),
+              'sum_points': sum(res['sum_points'] for res in results),
+              'best': {}}
+
+    # Shards are in order so, as in exact_leagues(), the first league with
+    # the max points wins
+    for res in results:
+        for key, value in res['best'].items():
+            if value[0] > merged['best'].get(key, (-1, ))[0]:
+                merged['best'][key] = value
+
+    return merged
+
+
+def play_calendars(abs_points: np.array, schedule: np.array,
+                   calendars: np.array) -> dict:
+
+    """
+    Play, in a single batch, the leagues where each team plays with the
+    calendar of another team, see calendar_schedules().
+
+    :param abs_points: np.array, (teams, days)
+    :param schedule: np.array, (days, matches, 2)
+    :param calendars: np.array, (P, teams)
+
+    :return: dict, see summarize_leagues(), one league for each row of
+             'calendars'
+
+    """
+
+    return summarize_leagues(simulate_leagues(
+            abs_points, calendar_schedules(schedule, calendars)))
+
+
+def play_leagues(abs_points: np.array, rounds: np.array, n_days: int,
+                 workers: int = 1, chunk: int = 2000,
+                 verbose: bool = False) -> dict:
+
+    """
+    Play all the leagues generated by 'rounds', split in shards of 'chunk'
+    rounds played by 'workers' processes.
+
+    :param abs_points: np.array, (teams, days)
+    :param rounds: np.array, (K, days_in_round, matches, 2)
+    :param n_days: int
+    :param workers: int
+    :param chunk: int
+    :param verbose: bool
+
+    :return: dict, see summarize_leagues(), for all the K leagues
+
+    """
+
+    shards = [(rounds[st:st + chunk], n_days)
+              for st in range(0, len(rounds), chunk)]
+    sizes = [len(sh[0]) for sh in shards]
+
+    results = _run_shards(_play_shard, shards, abs_points, workers, verbose,
+                          len(rounds), sizes)
+
+    return merge_summaries(results)
+
+
+def rounds_to_array(rounds: list, teams: list) -> np.array:
+
+    """
+    Convert rounds expressed with team names into an array of team indexes.
+
+    :param rounds: list, each round is a list of days and each day a list of
+                   (team1, team2) tuples
+    :param teams: list, team names, the position is the index
+
+    :return: np.array, (rounds, days, matches, 2)
+
+    """
+
+    team2idx = {tm: i for i, tm in enumerate(teams)}
+
+    return np.array([[[[team2idx[tm1], team2idx[tm2]] for tm1, tm2 in day]
+                      for day in a_round] for a_round in rounds], dtype=int)
+
+
+def schedules_from_rounds(rounds: np.array, n_days: int) -> np.array:
+
+    """
+    Vectorized version of generate_schedule(): repeat each round until it
+    covers 'n_days' days.
+
+    :param rounds: np.array, (rounds, days_in_round, matches, 2)
+    :param n_days: int
+
+    :return: np.array, (rounds, n_days, matches, 2)
+
+    """
+
+    return rounds[:, np.arange(n_days) % rounds.shape[1]]
+
+
+def simulate_leagues(abs_points: np.array, schedules: np.array,
+                     goals: np.array = None) -> dict:
+
+    """
+    Play K leagues at once.
+
+    :param abs_points: np.array, (teams, days) if the same for every league
+                       or (K, teams, days)
+    :param schedules: np.array, (K, days, matches, 2) with team indexes
+    :param goals: np.array, same shape of 'abs_points'. If None they are
+                  calculated from 'abs_points' with the default rules
+
+    :return: dict, with keys
+             - 'points': (K, teams)
+             - 'goals_scored': (K, teams)
+             - 'goals_taken': (K, teams)
+             - 'tot_points': (teams, ) or (K, teams), as 'abs_points'
+             - 'ranking': (K, teams), team indexes sorted by position, see
+               tiebreak.rank_teams()
+
+    """
+
+    n_teams = abs_points.shape[-2]
+    n_days = schedules.shape[1]
+    abs_points = abs_points[..., :n_days]
+    if goals is None:
+        goals = goals_from_abs_points(abs_points)
+
+    # (days, teams) or (K, days, teams) to be indexed with the opponents
+    # (K, days, teams)
+    goals = np.swapaxes(goals[..., :n_days], -1, -2)
+    opponents = opponents_matrix(schedules, n_teams)
+    goals_opp = np.take_along_axis(np.broadcast_to(goals, opponents.shape),
+                                   opponents, axis=-1)
+
+    day_points = match_points(goals, goals_opp)
+    points = day_points.sum(axis=1)
+    goals_scored = np.broadcast_to(goals.sum(axis=-2), points.shape)
+    goals_taken = goals_opp.sum(axis=1)
+    tot_points = abs_points.sum(axis=-1)
+
+    stats = {'Pt': points, 'G+': goals_scored, 'G-': goals_taken,
+             'Dr': goals_scored - goals_taken,
+             'V': (day_points == 3).sum(axis=1),
+             'N': (day_points == 1).sum(axis=1),
+             'P': (day_points == 0).sum(axis=1),
+             'Tot Pt': tot_points}
+
+    # The head-to-head matrix is the most expensive part, skip it if unused
+    h2h = None
+    if 'h2h' in cfg.RANKING_CRITERIA:
+        h2h = tb.h2h_matrix(opponents, day_points)
+
+    return {'points': points,
+            'goals_scored': goals_scored,
+            'goals_taken': goals_taken,
+            'tot_points': tot_points,
+            'ranking': tb.rank_teams(stats, h2h)}
+
+
+def summarize_leagues(results: dict) -> dict:
+
+    """
+    Reduce the output of simulate_leagues() to what Calendar needs.
+
+    :param results: dict, output of simulate_leagues()
+
+    :return: dict, with keys
+             - 'points': (K, teams)
+             - 'positions': (K, teams), 0 is the first position
+             - 'counts': (positions, teams), number of leagues where each
+               team ends in each position
+             - 'max_points', 'min_points', 'sum_points': (teams, )
+
+    """
+
+    points = results['points']
+    positions = np.argsort(results['ranking'], axis=1)
+    n_teams = points.shape[1]
+
+    counts = np.zeros((n_teams, n_teams), dtype=np.int64)
+    for t in range(n_teams):
+        counts[:, t] = np.bincount(positions[:, t], minlength=n_teams)
+
+    return {'points': points,
+            'positions': positions,
+            'counts': counts,
+            'max_points': points.max(axis=0),
+            'min_points': points.min(axis=0),
+            'sum_points': points.sum(axis=0)}
+
+
+def swap_calendars(n_teams: int) -> (np.array, list):
+
+    """
+    Return the calendars of all the leagues where two teams swap their
+    calendar, the real one first, and the pairs of teams swapped.
+
+    :param n_teams: int
+
+    :return: np.array, (1 + pairs, teams), see calendar_schedules(), and
+             list of (team1, team2)
+
+    """
+
+    pairs = list(combinations(range(n_teams), 2))
+    calendars = np.tile(np.arange(n_teams), (len(pairs) + 1, 1))
+    for k, (tm1, tm2) in enumerate(pairs, 1):
+        calendars[k, [tm1, tm2]] = tm2, tm1
+
+    return calendars, pairs
+
+
+def swap_matrix(abs_points: np.array, schedule: np.array) -> tuple:
+
+    """
+    Play all the leagues where two teams swap their calendar in one batch.
+
+    :param abs_points: np.array, (teams, days)
+    :param schedule: np.array, (days, matches, 2)
+
+    :return: tuple, two (teams, teams) arrays with the points and the
+             positions gained by the team in the row when playing with the
+             calendar of the team in the column
+
+    """
+
+    n_teams = abs_points.shape[0]
+    calendars, pairs = swap_calendars(n_teams)
+    res = play_calendars(abs_points, schedule, calendars)
+    points, positions = res['points'], res['positions']
+
+    delta_points = np.zeros((n_teams, n_teams), dtype=int)
+    delta_positions = np.zeros((n_teams, n_teams), dtype=int)
+    tm1, tm2 = np.array(pairs).T
+    swap = np.arange(1, len(pairs) + 1)
+    for row, col in ((tm1, tm2), (tm2, tm1)):
+        delta_points[row, col] = points[swap, row] - points[0, row]
+        delta_positions[row, col] = positions[0, row] - positions[swap, row]
+
+    return delta_points, delta_positions
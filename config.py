@@ -3,6 +3,24 @@ import os
 dbase1 = 'fantascandalo_db.db'
 dbase2 = '/Users/andrea/Desktop/Cartelle/Bots/FantAstaBot/fanta_asta_db.db'
 
+# archive.py
+# Folder with one database for each archived season
+ARCHIVE_DIR = 'seasons'
+
+# season_functions.py
+# Number of days of the season, columns of the compatibility views
+SEASON_DAYS = 35
+
+# db_functions.py
+# Applied to every pooled connection when it is opened
+DB_PRAGMAS = {'foreign_keys': 'ON',
+              'journal_mode': 'WAL',
+              'synchronous': 'NORMAL',
+              'mmap_size': 256 * 1024 * 1024,
+              'busy_timeout': 5000}
+# Number of compiled statements kept by each connection
+DB_STATEMENT_CACHE = 256
+
 # update_database.py
 CHROME_PATH = os.getcwd() + '/chromedriver'
 WAIT = 10
@@ -12,6 +30,34 @@ VOTES_URL = f'https://www.fantacalcio.it/voti-fantacalcio-serie-a/{YEAR}/'
 QUOTAZIONI_FILENAME = ('/Users/andrea/Downloads/Quotazioni_' +
                        'Fantacalcio_Ruoli_Mantra.xlsx')
 
+# FantaClasses.py
+# Number of random leagues played at once by the vectorized engine
+SIMULATION_CHUNK = 2000
+# Default number of processes for Calendar
+WORKERS = os.cpu_count()
+
+# calendar_functions.py
+# Absolute points needed for the first goal and for each of the others
+GOAL_THRESHOLD = 66
+GOAL_STEP = 6
+
+# tiebreak.py
+# Criteria used to sort the teams, in order. 'h2h' are the points gained in
+# the matches between the teams with the same points
+RANKING_CRITERIA = ['Pt', 'h2h', 'G+', 'Dr', 'V', 'N', 'Tot Pt']
+
+# mantra_functions.py
+# Number of lineups kept in memory by cached_mantra()
+MANTRA_CACHE_SIZE = 1024
+# Solver used by solution_exists(), 'matching' or 'matrix'
+MANTRA_SOLVER = 'matching'
+# Run both solvers and raise an error if results are different
+MANTRA_CROSS_CHECK = False
+# Print the number of nodes visited and pruned by rec_cart() at each call
+MANTRA_STATS = False
+
 # extra_functions.py
 ALL_LEAGUES = ('/Users/andrea/Desktop/Cartelle/FantaScandalo/'
                'All_Leagues_8teams.txt')
+ALL_LEAGUES_BIN = ('/Users/andrea/Desktop/Cartelle/FantaScandalo/'
+                   'All_Leagues_8teams.bin')
@@ -1,10 +1,69 @@
+import os
+import atexit
 import sqlite3
+import threading
 import numpy as np
+from contextlib import contextmanager
 from nltk.metrics.distance import jaccard_distance
 from nltk.util import ngrams
 import config as cfg
 
 
+# Long-lived connections, one per (process, thread, database). Each thread
+# keeps its own dict so sqlite3 objects are never shared between threads and
+# the pid is part of the key so forked workers open fresh connections
+_POOL = threading.local()
+_ALL_CONNECTIONS = []
+_ALL_CONNECTIONS_LOCK = threading.Lock()
+
+
+def close_connections() -> None:
+
+    """
+    Close every pooled connection opened by this process.
+    """
+
+    with _ALL_CONNECTIONS_LOCK:
+        while _ALL_CONNECTIONS:
+            pid, db = _ALL_CONNECTIONS.pop()
+            if pid != os.getpid():
+                continue
+            try:
+                db.close()
+            except sqlite3.ProgrammingError:
+                # Connection created in another thread, it will be closed
+                # when that thread is garbage collected
+                pass
+
+    _POOL.__dict__.clear()
+
+
+def commit(db: sqlite3.Connection, database: str) -> None:
+
+    """
+    Commit unless we are inside a transaction() block, in which case the
+    commit is deferred to the end of the block.
+    """
+
+    if not in_transaction(database):
+        db.commit()
+
+
+def data_version(database: str = cfg.dbase1) -> tuple:
+
+    """
+    Return a token that changes whenever another connection, of this or of
+    another process, commits changes to 'database'. Data cached in memory
+    store it and are loaded again when it differs. Changes committed through
+    the pooled connection itself leave it unchanged, the caches are refreshed
+    explicitly by the code making them.
+    """
+
+    # PRAGMA data_version is only comparable within the same connection
+    db = get_connection(database)
+    return id(db), db.execute('PRAGMA data_version').fetchone()[0]
+
+
 def empty_table(table: str, database: str = cfg.dbase1):
 
     db, c = start_db(database)
@@ -12,19 +71,19 @@ def empty_table(table: str, database: str = cfg.dbase1):
     query = f'DELETE FROM {table}'
 
     c.execute(query)
-    db.commit()
-    db.close()
+    commit(db, database)
 
 
-def db_delete(table: str, where: str, database: str = cfg.dbase1):
+def db_delete(table: str, where, database: str = cfg.dbase1,
+              params: tuple = ()):
 
     db, c = start_db(database)
 
+    where, params = where_clause(where, params)
     query = f'DELETE FROM {table} WHERE {where}'
 
-    c.execute(query)
-    db.commit()
-    db.close()
+    c.execute(query, params)
+    commit(db, database)
 
 
 def db_insert(table: str, columns: list, values: list,
@@ -33,27 +92,52 @@ def db_insert(table: str, columns: list, values: list,
     db, c = start_db(database)
 
     cols = ', '.join(columns)
-    vals = ', '.join([f'"{v}"' for v in values])
+    vals = ', '.join(['?'] * len(values))
     query = f'INSERT INTO {table} ({cols}) VALUES ({vals})'
 
-    c.execute(query)
-    db.commit()
-    db.close()
+    c.execute(query, tuple(values))
+    commit(db, database)
 
 
-def db_select(table: str, columns: list, where: str,
-              database: str = cfg.dbase1):
+def db_insert_many(table: str, columns: list, rows: list,
+                   database: str = cfg.dbase1, conflict: str = ''):
+
+    """
+    Insert all the rows with a single executemany inside one transaction.
+
+    :param table: str
+    :param columns: list
+    :param rows: list of tuples, each with the values of 'columns'
+    :param database: str
+    :param conflict: str, conflict resolution for unique keys, Ex. 'REPLACE'
+
+    """
+
+    if not rows:
+        return
+
+    cols = ', '.join(columns)
+    vals = ', '.join(['?'] * len(columns))
+    insert = f'INSERT OR {conflict}' if conflict else 'INSERT'
+    query = f'{insert} INTO {table} ({cols}) VALUES ({vals})'
+
+    with transaction(database) as db:
+        db.executemany(query, [tuple(row) for row in rows])
+
+
+def db_select(table: str, columns: list, where, database: str = cfg.dbase1,
+              params: tuple = ()):
 
     db, c = start_db(database)
 
     cols = ', '.join(columns)
+    where, params = where_clause(where, params)
     if where:
         query = f'SELECT {cols} FROM {table} WHERE {where}'
     else:
         query = f'SELECT {cols} FROM {table}'
 
-    content = list(c.execute(query))
-    db.close()
+    content = list(c.execute(query, params))
 
     if len(columns) == 1 and columns[0] != '*':
         content = [el[0] for el in content if el[0]]
@@ -61,17 +145,44 @@ def db_select(table: str, columns: list, where: str,
     return content
 
 
-def db_update(table: str, columns: list, values: list, where: str,
-              database: str = cfg.dbase1):
+def db_update(table: str, columns: list, values: list, where,
+              database: str = cfg.dbase1, params: tuple = ()):
 
     db, c = start_db(database)
 
-    vals = ', '.join([f'{c}="{v}"' for c, v in zip(columns, values)])
+    vals = ', '.join([f'{col} = ?' for col in columns])
+    where, params = where_clause(where, params)
     query = f'UPDATE {table} SET {vals} WHERE {where}'
 
-    c.execute(query)
-    db.commit()
-    db.close()
+    c.execute(query, tuple(values) + params)
+    commit(db, database)
+
+
+def get_connection(database: str = cfg.dbase1) -> sqlite3.Connection:
+
+    """
+    Return the pooled connection to 'database' for the current thread,
+    opening and configuring it the first time.
+    """
+
+    key = (os.getpid(), database)
+    connections = _POOL.__dict__.setdefault('connections', {})
+
+    if key not in connections:
+        db = sqlite3.connect(database,
+                             cached_statements=cfg.DB_STATEMENT_CACHE)
+        for pragma, value in cfg.DB_PRAGMAS.items():
+            db.execute(f'PRAGMA {pragma} = {value}')
+        connections[key] = db
+
+        with _ALL_CONNECTIONS_LOCK:
+            _ALL_CONNECTIONS.append((os.getpid(), db))
+
+    return connections[key]
+
+
+def in_transaction(database: str = cfg.dbase1) -> bool:
+    return _POOL.__dict__.get('depth', {}).get(database, 0) > 0
 
 
 def jaccard_result(in_opt: str, all_opt: list, ngrm: int) -> str:
@@ -93,8 +204,90 @@ def jaccard_result(in_opt: str, all_opt: list, ngrm: int) -> str:
 
 def start_db(database: str) -> tuple:
 
-    db = sqlite3.connect(database)
+    db = get_connection(database)
     c = db.cursor()
-    c.execute("PRAGMA foreign_keys = ON")
 
     return db, c
+
+
+@contextmanager
+def transaction(database: str = cfg.dbase1):
+
+    """
+    Group all the db_* calls made inside the block into a single transaction,
+    committed when the block ends or rolled back if it raises. Blocks can be
+    nested, only the outermost one commits. Each inner block is a SAVEPOINT,
+    so if it raises only its own writes are rolled back, even when the error
+    is caught by the outer block.
+
+    Ex.
+        with transaction():
+            db_update(...)
+            db_update(...)
+    """
+
+    db = get_connection(database)
+    depth = _POOL.__dict__.setdefault('depth', {})
+    level = depth.get(database, 0) + 1
+    savepoint = f'transaction_{level}'
+
+    if level == 1:
+        # Explicit BEGIN, otherwise the first SAVEPOINT would open the
+        # transaction and its RELEASE would commit it
+        if not db.in_transaction:
+            db.execute('BEGIN')
+    else:
+        db.execute(f'SAVEPOINT {savepoint}')
+    depth[database] = level
+
+    try:
+        yield db
+    except BaseException:
+        depth[database] = level - 1
+        if level == 1:
+            db.rollback()
+        else:
+            db.execute(f'ROLLBACK TO {savepoint}')
+            db.execute(f'RELEASE {savepoint}')
+        raise
+    else:
+        depth[database] = level - 1
+        if level == 1:
+            db.commit()
+        else:
+            db.execute(f'RELEASE {savepoint}')
+
+
+def where_clause(where, params: tuple = ()) -> (str, tuple):
+
+    """
+    Return the WHERE clause with '?' placeholders and the values to bind.
+    'where' can be:
+
+        - a dict, Ex. {'day': 3, 'name': "N'DICKA"}, which becomes
+          'day = ? AND name = ?' with params (3, "N'DICKA"). None values
+          become 'IS NULL'
+
+        - a str already containing the placeholders, Ex. 'day = ?', whose
+          values are passed in 'params'
+
+    Since the statement text only depends on the columns, SQLite can reuse
+    the compiled statement from the connection cache.
+    """
+
+    if not isinstance(where, dict):
+        return where, tuple(params)
+
+    conditions = []
+    values = []
+    for col, value in where.items():
+        if value is None:
+            conditions.append(f'{col} IS NULL')
+        else:
+            conditions.append(f'{col} = ?')
+            values.append(value)
+
+    return ' AND '.join(conditions), tuple(values) + tuple(params)
+
+
+atexit.register(close_connections)
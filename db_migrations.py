@@ -0,0 +1,380 @@
+import sqlite3
+import db_functions as dbf
+import config as cfg
+
+
+# Lists of players are joined in the order of their slot: SQLite aggregates
+# the rows in the order of the subquery
+_PLAYERS_TEXT = ("SELECT {key}, day, group_concat(name, ', ') AS value "
+                 'FROM (SELECT * FROM {table} ORDER BY {key}, day, slot) '
+                 'GROUP BY {key}, day')
+_TEAMS = 'SELECT team_name FROM teams'
+
+# Views with the layout of the tables replaced by migration 4, see
+# wide_view(). Each one is (table, key, keys, values)
+WIDE_VIEWS = [
+    ('absolute_points', 'team_name', _TEAMS,
+     'SELECT team_name, day, abs_points AS value FROM team_days'),
+
+    ('schemes', 'team_name', _TEAMS,
+     'SELECT team_name, day, scheme AS value FROM team_days'),
+
+    ('captains', 'team_name', _TEAMS,
+     "SELECT team_name, day, captain || ', ' || vice AS value "
+     "FROM team_days"),
+
+    ('lineups', 'team_name', _TEAMS,
+     _PLAYERS_TEXT.format(key='team_name', table='lineup_players')),
+
+    ('all_players', 'team_name', _TEAMS,
+     _PLAYERS_TEXT.format(key='team_name', table='roster_players')),
+
+    ('all_players_serie_a', 'team',
+     'SELECT DISTINCT team FROM serie_a_players',
+     _PLAYERS_TEXT.format(key='team', table='serie_a_players')),
+
+    # Malus first, then 'NAME:Role' of each player
+    ('mantra_lineups', 'team_name', _TEAMS,
+     "SELECT team_name, day, malus || ', ' || group_concat("
+     "name || ':' || ifnull(role, ''), ', ') AS value "
+     "FROM mantra_cache JOIN (SELECT * FROM mantra_cache_players "
+     "ORDER BY team_name, day, position) USING (team_name, day) "
+     "GROUP BY team_name, day"),
+]
+
+
+def _is_table(db: sqlite3.Connection, name: str) -> bool:
+    kind = db.execute('SELECT type FROM sqlite_master WHERE name = ?',
+                      (name, )).fetchone()
+    return bool(kind) and kind[0] == 'table'
+
+
+def _wide_rows(db: sqlite3.Connection, table: str, key: str) -> list:
+
+    """
+    Return [(key, day, value), ...] of the non-empty cells of the wide
+    'table', with one 'day_N' column for each day. Empty if 'table' is not a
+    table anymore (already replaced by its view).
+    """
+
+    if not _is_table(db, table):
+        return []
+
+    columns = [col for _, col, *_ in
+               db.execute(f'PRAGMA table_info({table})')]
+    days = [int(col[4:]) for col in columns if col.startswith('day_')]
+
+    return [(k, day, value) for k, *values in db.execute(
+            f'SELECT {key}, {", ".join(f"day_{d}" for d in days)} '
+            f'FROM {table}').fetchall()
+            for day, value in zip(days, values) if value not in (None, '')]
+
+
+def copy_legacy_mantra_lineups(db: sqlite3.Connection) -> None:
+
+    """
+    Copy the lineups saved as strings in 'mantra_lineups', Ex.
+    '1, HANDANOVIC:Por, SKRINIAR:Dc, ...' where the first element is the
+    malus, into the typed cache tables. Digest is NULL since we do not know
+    the data they were calculated from, see mantra_functions.cached_mantra().
+    """
+
+    columns = [col for _, col, *_ in
+               db.execute('PRAGMA table_info(mantra_lineups)')]
+    days = [int(col[4:]) for col in columns if col.startswith('day_')]
+
+    for team_name, *lineups in db.execute(
+            f'SELECT team_name, {", ".join(f"day_{d}" for d in days)} '
+            f'FROM mantra_lineups').fetchall():
+        for day, lineup in zip(days, lineups):
+            if not lineup:
+                continue
+            malus, *players = lineup.split(', ')
+            db.execute('INSERT OR IGNORE INTO mantra_cache (team_name, day, '
+                       'digest, scheme, malus) VALUES (?, ?, NULL, NULL, ?)',
+                       (team_name, day, int(malus)))
+            db.executemany(
+                    'INSERT OR IGNORE INTO mantra_cache_players (team_name, '
+                    'day, position, name, role) VALUES (?, ?, ?, ?, ?)',
+                    [(team_name, day, i, *pl.rsplit(':', 1))
+                     for i, pl in enumerate(players)])
+
+
+def copy_wide_tables(db: sqlite3.Connection) -> None:
+
+    """
+    Copy the tables with one 'day_N' column for each day, where lists of
+    players are strings, Ex. 'HANDANOVIC, SKRINIAR, ...', into the long
+    tables and replace them with views with the same name and columns, see
+    wide_view(). 'mantra_lineups' has already been copied into the mantra
+    cache tables by migration 2.
+    """
+
+    for table, column in (('absolute_points', 'abs_points'),
+                          ('schemes', 'scheme')):
+        rows = _wide_rows(db, table, 'team_name')
+        db.executemany('INSERT OR IGNORE INTO team_days (team_name, day) '
+                       'VALUES (?, ?)', [row[:2] for row in rows])
+        db.executemany(f'UPDATE team_days SET {column} = ? '
+                       f'WHERE team_name = ? AND day = ?',
+                       [(value, tm, day) for tm, day, value in rows])
+
+    rows = _wide_rows(db, 'captains', 'team_name')
+    db.executemany('INSERT OR IGNORE INTO team_days (team_name, day) '
+                   'VALUES (?, ?)', [row[:2] for row in rows])
+    db.executemany('UPDATE team_days SET captain = ?, vice = ? '
+                   'WHERE team_name = ? AND day = ?',
+                   [(*(text.split(', ', 1) + [None])[:2], tm, day)
+                    for tm, day, text in rows])
+
+    for wide, table, key in (('lineups', 'lineup_players', 'team_name'),
+                             ('all_players', 'roster_players', 'team_name'),
+                             ('all_players_serie_a', 'serie_a_players',
+                              'team')):
+        db.executemany(
+                f'INSERT OR IGNORE INTO {table} ({key}, day, slot, name) '
+                f'VALUES (?, ?, ?, ?)',
+                [(k, day, slot, nm) for k, day, text in
+                 _wide_rows(db, wide, key)
+                 for slot, nm in enumerate(text.split(', '))])
+
+    for table, key, keys, values in WIDE_VIEWS:
+        if _is_table(db, table):
+            db.execute(f'DROP TABLE {table}')
+        db.execute(wide_view(table, key, keys, values))
+
+
+def wide_view(table: str, key: str, keys: str, values: str) -> str:
+
+    """
+    Return the statement creating the view 'table' with the old wide layout,
+    one row for each element of 'keys' and one 'day_N' column for each day
+    of the season, Ex. (team_name, day_1, ..., day_35), so the queries
+    written for the old tables keep working.
+
+    :param table: str
+    :param key: str, name of the first column
+    :param keys: str, query returning the rows, Ex. 'SELECT team_name FROM
+                 teams'
+    :param values: str, query returning (key, day, value)
+
+    :return: str
+
+    """
+
+    days = ', '.join(f'MAX(CASE WHEN day = {day} THEN value END) AS day_{day}'
+                     for day in range(1, cfg.SEASON_DAYS + 1))
+
+    return (f'CREATE VIEW IF NOT EXISTS {table} AS '
+            f'SELECT {key}, {days} FROM ({keys}) '
+            f'LEFT JOIN ({values}) USING ({key}) GROUP BY {key}')
+
+
+# Each migration is (version, description, statements). Versions are applied
+# in order and the last one applied is stored in the 'user_version' pragma of
+# the database, so running migrate() again only applies the new ones.
+# Statements must be idempotent as well (IF NOT EXISTS) to be safe on dbs
+# where part of the schema has been created by hand. A statement can also be
+# a function, called with the connection, for data that cannot be migrated
+# with plain SQL.
+MIGRATIONS = [
+    (1, 'votes: remove duplicates and add indexes',
+     [
+         # Keep only the last row scraped for each (day, name)
+         '''DELETE FROM votes WHERE rowid NOT IN
+            (SELECT MAX(rowid) FROM votes GROUP BY day, name)''',
+
+         # Player.vote/bonus/malus, player_vote. It is also used by the
+         # queries filtering by day only
+         '''CREATE UNIQUE INDEX IF NOT EXISTS votes_day_name
+            ON votes (day, name)''',
+
+         # calculate_* stats helpers
+         'CREATE INDEX IF NOT EXISTS votes_name ON votes (name)',
+
+         # add_6_politico_if_needed, wrong_day_for_votes
+         'CREATE INDEX IF NOT EXISTS votes_day_team ON votes (day, team)',
+     ]),
+
+    (2, 'mantra: typed cache of the lineups',
+     [
+         # One row for each lineup calculated by mantra(). 'digest' is the
+         # hash of the data used to calculate it
+         '''CREATE TABLE IF NOT EXISTS mantra_cache (
+                team_name TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                digest TEXT,
+                scheme TEXT,
+                malus INTEGER NOT NULL,
+                PRIMARY KEY (team_name, day))''',
+
+         # The players of each lineup, in order
+         '''CREATE TABLE IF NOT EXISTS mantra_cache_players (
+                team_name TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                role TEXT,
+                PRIMARY KEY (team_name, day, position))''',
+
+         copy_legacy_mantra_lineups,
+     ]),
+
+    (3, 'standings: snapshot of the table after each day',
+     [
+         # Cumulative stats of each team after 'day', same columns of
+         # 'classifica', see standings.update_standings()
+         '''CREATE TABLE IF NOT EXISTS standings (
+                day INTEGER NOT NULL,
+                team_name TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                G INTEGER NOT NULL,
+                V INTEGER NOT NULL,
+                N INTEGER NOT NULL,
+                P INTEGER NOT NULL,
+                Gf INTEGER NOT NULL,
+                Gs INTEGER NOT NULL,
+                Dr INTEGER NOT NULL,
+                Pt INTEGER NOT NULL,
+                Tot REAL NOT NULL,
+                PRIMARY KEY (day, team_name))''',
+
+         # Points gained by each team against each opponent until 'day', to
+         # sort the teams with the same points without replaying the season
+         '''CREATE TABLE IF NOT EXISTS standings_h2h (
+                day INTEGER NOT NULL,
+                team_name TEXT NOT NULL,
+                opponent TEXT NOT NULL,
+                points INTEGER NOT NULL,
+                PRIMARY KEY (day, team_name, opponent))''',
+     ]),
+
+    (4, 'long tables replacing the day_N columns',
+     [
+         # One row for each team in each day, values are NULL until scraped
+         '''CREATE TABLE IF NOT EXISTS team_days (
+                team_name TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                scheme TEXT,
+                captain TEXT,
+                vice TEXT,
+                abs_points REAL,
+                PRIMARY KEY (team_name, day))''',
+
+         # Ranges of days for all the teams, Ex. last_day_played()
+         'CREATE INDEX IF NOT EXISTS team_days_day ON team_days (day)',
+
+         # Lineups as scraped, regular players first and then the bench
+         '''CREATE TABLE IF NOT EXISTS lineup_players (
+                team_name TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                slot INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                PRIMARY KEY (team_name, day, slot))''',
+
+         # Complete set of players of each fantateam
+         '''CREATE TABLE IF NOT EXISTS roster_players (
+                team_name TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                slot INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                PRIMARY KEY (team_name, day, slot))''',
+
+         # Players of each Serie A team, used for the 6 politico
+         '''CREATE TABLE IF NOT EXISTS serie_a_players (
+                team TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                slot INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                PRIMARY KEY (team, day, slot))''',
+
+         copy_wide_tables,
+     ]),
+]
+
+
+def backup(database: str = cfg.dbase1) -> str:
+
+    """
+    Save a copy of 'database' next to it, named after its current version,
+    Ex. 'fantascandalo_db.db.v3.bak'. Return the path of the copy.
+    """
+
+    path = f'{database}.v{current_version(database)}.bak'
+    target = sqlite3.connect(path)
+    try:
+        dbf.get_connection(database).backup(target)
+    finally:
+        target.close()
+
+    return path
+
+
+def check_version(database: str = cfg.dbase1) -> None:
+
+    """
+    Raise if 'database' has migrations not applied yet. Migrating is an
+    explicit step, run 'python db_migrations.py' or update_database.py.
+    """
+
+    version = current_version(database)
+    if version < latest_version():
+        raise RuntimeError(f'Database {database} alla versione {version}, '
+                           f'eseguire prima "python db_migrations.py" per '
+                           f'aggiornarlo alla {latest_version()}')
+
+
+def current_version(database: str = cfg.dbase1) -> int:
+    db = dbf.get_connection(database)
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0]
+
+
+def migrate(database: str = cfg.dbase1, verbose: bool = False,
+            make_backup: bool = True) -> int:
+
+    """
+    Apply all the pending migrations to 'database', each one inside its own
+    transaction. If any is pending and 'make_backup' is True, a copy of the
+    database is saved first, see backup(). Return the version of the
+    database after migrating.
+    """
+
+    db = dbf.get_connection(database)
+    version = current_version(database)
+
+    if make_backup and version < latest_version():
+        path = backup(database)
+        if verbose:
+            print(f'Backup of version {version} saved in {path}')
+
+    for mig_version, description, statements in MIGRATIONS:
+        if mig_version <= version:
+            continue
+
+        try:
+            db.execute('BEGIN')
+            for statement in statements:
+                if callable(statement):
+                    statement(db)
+                else:
+                    db.execute(statement)
+            db.execute(f'PRAGMA user_version = {mig_version}')
+            db.commit()
+        except BaseException:
+            # Callable steps can fail with any Python error too
+            db.rollback()
+            raise
+
+        version = mig_version
+        if verbose:
+            print(f'Migration {mig_version} applied: {description}')
+
+    return version
+
+
+if __name__ == '__main__':
+    migrate(verbose=True)
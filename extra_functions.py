@@ -1,9 +1,10 @@
 import os
-import random
 import string
+import struct
+import numpy as np
 import db_functions as dbf
 import config as cfg
-from itertools import combinations, zip_longest
+from itertools import combinations, permutations
 
 
 def generate_schedule(a_round, days):
@@ -39,40 +40,91 @@ def clean_round(a_round):
 	return ''.join([''.join(match) for day in a_round for match in day])
 
 
-def no_repeated_teams(day, teams):
+def day_masks(days, n_teams):
 
 	"""
-    Checks whether a team appears more than once in one day. If not, the day
-    is a valid one and returns True, else False.
+	Returns a list with one bitmask for each day in 'days'. Each one of the
+	n_teams * (n_teams - 1) / 2 possible matches is a bit, so two days can
+	be in the same round only if their masks have no common bits.
 
 	"""
 
-	res = [team for match in day for team in match]
-	if len(set(res)) == len(teams):
-		return True
-	else:
-		return False
+	teams = [string.ascii_uppercase[i] for i in range(n_teams)]
+	pair_bit = {pair: 1 << i for i, pair in enumerate(combinations(teams, 2))}
+
+	return [sum(pair_bit[match] for match in day) for day in days]
 
 
-def available_days(day, all_days, teams):
+def all_ordered_rounds(n_teams, start=None):
 
 	"""
-	Returns the list of the days which are available in the round where the
-	day "day" is already present. This is to avoid that any match can be
-	played more than once in one round.
+	Generates all the possible rounds as lists of indexes of
+	valid_days(n_teams), in the same order used by the .txt file. If 'start'
+	is a round, generation restarts from the one following it.
 
 	"""
 
-	res = []
-	for new_day in all_days:
-		comb = day + new_day
-		if len(set(comb)) == len(teams):
-			res.append(new_day)
+	def recursive_rounds(round_to_fill, only_valid_days, start):
 
-	return res
+		level = len(round_to_fill)
+		if level == n_teams - 1:
+			# When resuming, the round in 'start' is already in the file
+			if start is None:
+				yield round_to_fill
+			return
+
+		for day in only_valid_days:
+			resume = start
+			if start is not None:
+				if day < start[level]:
+					continue
+				elif day > start[level]:
+					start = resume = None
+
+			mask = masks[day]
+			round_to_fill.append(day)
+			yield from recursive_rounds(
+					round_to_fill,
+					[d for d in only_valid_days if not masks[d] & mask],
+					resume)
+			round_to_fill.pop()
+			start = None
+
+	masks = day_masks(valid_days(n_teams), n_teams)
+
+	yield from recursive_rounds([], list(range(len(masks))), start)
+
+
+def last_complete_line(filename, block=4096):
+
+	"""
+	Returns the last complete line of the file, or '' if there is none, and
+	removes any incomplete line after it, Ex. the one left by an interrupted
+	run of all_leagues_generator_txt().
+
+	"""
+
+	size = os.stat(filename).st_size
+	with open(filename, 'rb+') as myfile:
+		end = size
+		while end > 0:
+			begin = max(0, end - block)
+			myfile.seek(begin)
+			data = myfile.read(size - begin)
+			last_newline = data.rfind(b'\n')
+			if last_newline != -1:
+				myfile.truncate(begin + last_newline + 1)
+				lines = data[:last_newline].split(b'\n')
+				if len(lines) > 1 or begin == 0:
+					return lines[-1].decode()
+			end = begin
+
+		myfile.truncate(0)
+		return ''
 
 
-def all_leagues_generator_txt(n_teams):
+def all_leagues_generator_txt(n_teams, filename=cfg.ALL_LEAGUES,
+                              resume=False, chunk=100000, verbose=True):
 
 	"""
 	Generates a .txt file containing all the possible rounds considering
@@ -85,124 +137,349 @@ def all_leagues_generator_txt(n_teams):
     	   - 2 teams per match
 
 	So each line in our file will have 56 letters, each letter representing
-	one of the real fantateams. The transformation from letters to real team
-	will be done later by using the function real_round_from_line.
+	one of the real fantateams. The file is then converted with txt_to_bin()
+	and the letters are mapped to the real teams by teams_by_letter().
+
+	Lines are written in blocks of 'chunk' rounds. If 'resume' is True and
+	the file already exists, generation continues after its last complete
+	line, so an interrupted run does not have to start again.
+
+	Only 8 teams are feasible: 31,449,600 rounds, about 1.8 GB, written in
+	minutes at roughly 80k rounds per second. With 10 teams there are about
+	4.4e14 rounds (1,225,566,720 sets of days, each in 9! orders), nearly
+	two centuries at that speed and petabytes on disk; with 12 teams about
+	1e25. See all_leagues_generator_bin() for the unordered rounds.
+
+	"""
+
+	days = valid_days(n_teams)
+	day2code = {day: i for i, day in enumerate(days)}
+	n_matches = n_teams // 2
+
+	start = None
+	if resume and os.path.isfile(filename):
+		line = last_complete_line(filename)
+		if line:
+			pairs = [tuple(line[i:i + 2]) for i in range(0, len(line), 2)]
+			start = [day2code[tuple(pairs[i:i + n_matches])]
+			         for i in range(0, len(pairs), n_matches)]
+
+	written = 0
+	with open(filename, 'a' if start else 'w') as myfile:
+		buffer = []
+		for a_round in all_ordered_rounds(n_teams, start):
+			buffer.append(clean_round([days[day] for day in a_round]))
+			if len(buffer) == chunk:
+				myfile.write('\n'.join(buffer) + '\n')
+				myfile.flush()
+				written += len(buffer)
+				buffer = []
+				if verbose:
+					progress = (a_round[0] + 1) / len(days) * 100
+					print(f'\r{written} rounds written, first day '
+					      f'{a_round[0] + 1}/{len(days)} ({progress:.1f}%)',
+					      end='')
+		if buffer:
+			myfile.write('\n'.join(buffer) + '\n')
+			written += len(buffer)
+
+	if verbose:
+		print(f'\r{written} rounds written to {filename}')
+
+
+def valid_days(n_teams):
 
 	"""
+	Returns the list of all the possible days with 'n_teams' teams, always in
+	the same order. The position of each day in this list is the code used
+	for it in the binary file.
 
-	def recursive_rounds(round_to_fill, only_valid_days):
+	Days are built as perfect matchings: the first team still free plays
+	against each of the others in turn, then the rest of the day is filled
+	the same way. So only the (n_teams - 1)!! valid days are generated (105
+	with 8 teams, 945 with 10, 10395 with 12), already sorted, instead of
+	filtering all the combinations of matches.
 
-		"""
-		Writes recursively the rounds in the file.
+	"""
 
-		"""
+	def recursive_days(day_to_fill, free_teams):
 
-		for valid_day in only_valid_days:
-			round_copy = round_to_fill.copy()
-			round_copy.append(valid_day)
+		if not free_teams:
+			yield tuple(day_to_fill)
+			return
 
-			if len(round_copy) == len(teams) - 1:
-				cleaned_round = str(clean_round(round_copy))
-				myfile.write(cleaned_round + '\n')
-			else:
-				new_list = available_days(valid_day, only_valid_days, teams)
-				recursive_rounds(round_copy, new_list)
+		first, others = free_teams[0], free_teams[1:]
+		for i, opponent in enumerate(others):
+			day_to_fill.append((first, opponent))
+			yield from recursive_days(day_to_fill,
+			                          others[:i] + others[i + 1:])
+			day_to_fill.pop()
 
 	teams = [string.ascii_uppercase[i] for i in range(n_teams)]
 
-	# All the possible matches
-	pairs = list(combinations(teams, 2))
+	return list(recursive_days([], teams))
 
-	n_matches_per_day = len(teams) // 2
 
-	# All the possible days
-	all_days = combinations(pairs, n_matches_per_day)
+def all_unordered_rounds(n_teams):
 
-	# # If there are NO repeated teams in all the matches forming a day, it means
-	# # it is a valid day
-	all_valid_days = [day for day in all_days if no_repeated_teams(day, teams)]
+	"""
+	Generates all the possible rounds without considering the order of the
+	days, so each set of days is generated only once. Every round contains
+	exactly one day where team 'A' plays against each of the other teams, so
+	days are sorted by the opponent of 'A': in the case of 8 teams the first
+	day always contains ('A', 'B'), the second ('A', 'C') and so on.
+	All the rounds in the .txt file are these ones with their days in every
+	possible order.
+
+	"""
 
-	a_round = []
-	myfile = open(cfg.ALL_LEAGUES, 'w')
-	recursive_rounds(a_round, all_valid_days)
-	myfile.close()
+	def recursive_rounds(round_to_fill, used_pairs):
 
+		if len(round_to_fill) == len(teams) - 1:
+			yield list(round_to_fill)
+			return
 
-def get_random_line(filename):
+		opponent = teams[len(round_to_fill) + 1]
+		for day in days_by_opponent[opponent]:
+			if used_pairs.isdisjoint(day):
+				round_to_fill.append(day)
+				yield from recursive_rounds(round_to_fill,
+				                            used_pairs.union(day))
+				round_to_fill.pop()
+
+	teams = [string.ascii_uppercase[i] for i in range(n_teams)]
+
+	# The first match of each day is the one of 'A'
+	days_by_opponent = {tm: [day for day in valid_days(n_teams)
+	                         if day[0] == (teams[0], tm)] for tm in teams[1:]}
+
+	yield from recursive_rounds([], set())
+
+
+# Binary file with all the rounds. It starts with a header of 16 bytes:
+#
+#   - magic string 'FSCAL'
+#   - format version
+#   - number of teams
+#   - number of days in a round
+#   - 1 if rounds are ordered, 0 if each record is an unordered round
+#   - size in bytes of each day code (1 or 2)
+#
+# then fixed-size records follow, one per round. Each record contains the
+# codes of the days of the round, i.e. their index in valid_days(n_teams), so
+# with 8 teams a round takes 7 bytes instead of the 57 of the .txt file.
+# When rounds are unordered every record stands for all the orderings of its
+# days, which are applied when sampling.
+BIN_MAGIC = b'FSCAL'
+BIN_VERSION = 1
+BIN_HEADER = struct.Struct('<5sBBBBB6x')
+
+
+def write_leagues_bin(filename, rounds, n_teams, ordered, chunk=100000):
 
 	"""
-	Returns the content of a random line inside a .txt file.
+	Writes the rounds in the binary format described above. Rounds are
+	encoded and written in chunks of 'chunk' rounds.
 
 	"""
 
-	# First extract the number of bytes of the file
-	total_bytes = os.stat(filename).st_size
+	days = valid_days(n_teams)
+	day2code = {day: i for i, day in enumerate(days)}
+	dtype = np.uint8 if len(days) <= 256 else np.uint16
+
+	with open(filename, 'wb') as myfile:
+		myfile.write(BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, n_teams,
+		                             n_teams - 1, int(ordered),
+		                             np.dtype(dtype).itemsize))
+		buffer = []
+		for a_round in rounds:
+			buffer.append([day2code[tuple(day)] for day in a_round])
+			if len(buffer) == chunk:
+				myfile.write(np.array(buffer, dtype=dtype).tobytes())
+				buffer = []
+		if buffer:
+			myfile.write(np.array(buffer, dtype=dtype).tobytes())
 
-	# Then we select a random point in the file by selecting a random byte
-	random_point = random.randint(0, total_bytes)
 
-	# Open the file
-	myfile = open(filename)
+def all_leagues_generator_bin(n_teams, ordered=False,
+                              filename=cfg.ALL_LEAGUES_BIN):
 
-	# Go to the randomly selected point
-	myfile.seek(random_point)
+	"""
+	Generates the binary file with all the possible rounds. By default only
+	unordered rounds are saved (6240 records for 8 teams), since sampling
+	one of them and then a random order of its days is the same as sampling
+	one of the rounds of the .txt file.
+
+	With 10 teams there are 1,225,566,720 unordered rounds, about 22 GB and
+	most of a day at roughly 20k rounds per second. 12 teams are out of
+	reach (about 2.5e17 unordered rounds).
 
-	# Skip this line to clear the partial line
-	myfile.readline()
+	"""
 
-	# Assing the content of the next complete line to a variable and close the
-	# file
-	line = myfile.readline()
-	myfile.close()
+	rounds = all_unordered_rounds(n_teams)
+	if ordered:
+		rounds = (list(order) for a_round in rounds
+		          for order in permutations(a_round))
 
-	# Returns everything except the last carachter of the string which is '\n'
-	return line[:-1]
+	write_leagues_bin(filename, rounds, n_teams, ordered)
 
 
-def real_round_from_line(line):
+def txt_to_bin(txt_filename=cfg.ALL_LEAGUES, bin_filename=cfg.ALL_LEAGUES_BIN):
 
 	"""
-	Takes the input which is a random line from the .txt file and has the
-	form:
+	Converts the .txt file generated by all_leagues_generator_txt() into the
+	binary format.
 
-    	   ABCDEFGHAC..........
+	"""
+
+	def line_to_round(line):
+		pairs = [tuple(line[i:i + 2]) for i in range(0, len(line), 2)]
+		return [tuple(pairs[i:i + n_matches])
+		        for i in range(0, len(pairs), n_matches)]
+
+	with open(txt_filename) as myfile:
+		n_teams = len(set(myfile.readline().strip()))
+		myfile.seek(0)
+		n_matches = n_teams // 2
+		rounds = (line_to_round(line.strip()) for line in myfile
+		          if line.strip())
+		write_leagues_bin(bin_filename, rounds, n_teams, ordered=True)
 
-	and transforms it into a complete round with the real names of the
-	fantateams by using the dict 'letters'.
+
+def load_leagues_bin(filename=cfg.ALL_LEAGUES_BIN):
+
+	"""
+	Memory-maps the binary file. Returns the header as a dict and the
+	records as an array with one row per round, so any round can be read in
+	O(1) by its index without loading the file.
 
 	"""
 
-	def grouper(iterable, n, fillvalue=None):
-		args = [iter(iterable)] * n
-		return zip_longest(*args, fillvalue=fillvalue)
+	with open(filename, 'rb') as myfile:
+		magic, version, n_teams, n_days, ordered, size = BIN_HEADER.unpack(
+				myfile.read(BIN_HEADER.size))
+
+	if magic != BIN_MAGIC or version != BIN_VERSION:
+		raise ValueError(f'{filename} is not a valid rounds file')
+
+	dtype = np.dtype(np.uint8 if size == 1 else '<u2')
+	n_records = ((os.stat(filename).st_size - BIN_HEADER.size) //
+	             (n_days * dtype.itemsize))
+
+	records = np.memmap(filename, dtype=dtype, mode='r',
+	                    offset=BIN_HEADER.size, shape=(n_records, n_days))
+
+	header = {'n_teams': n_teams, 'n_days': n_days, 'ordered': bool(ordered)}
+
+	return header, records
+
+
+def random_records(number, seed=None, filename=cfg.ALL_LEAGUES_BIN):
+
+	"""
+	Returns 'number' rounds sampled uniformly from the binary file, as an
+	array of day codes (one row per round). Records are picked by index, so
+	every round has the same probability. For unordered files the days of
+	each record are also shuffled.
+
+	"""
+
+	header, records = load_leagues_bin(filename)
+	rng = np.random.default_rng(seed)
+
+	res = np.array(records[rng.integers(0, len(records), number)])
+	if not header['ordered']:
+		res = rng.permuted(res, axis=1)
+
+	return res
+
+
+def record_to_line(record, n_teams):
+
+	"""
+	Converts a record of day codes into a line of letters in the same form
+	of the .txt file, Ex. ABCDEFGHAC..........
+
+	"""
+
+	days = valid_days(n_teams)
+
+	return ''.join([''.join(match) for code in record
+	                for match in days[code]])
+
+
+def teams_by_letter():
+
+	"""
+	Returns the names of the fantateams in the order used to convert the
+	letters of the rounds: 'A' is the first one, 'B' the second and so on.
+
+	"""
+
+	return dbf.db_select(table='teams', columns=['team_name'], where='')
+
+
+def day_table(n_teams):
+
+	"""
+	Returns an array with shape (valid days, matches, 2) where row i contains
+	the day with code i, with letters replaced by their index: 'A' -> 0,
+	'B' -> 1, etc.
+
+	"""
 
-	fantateams = dbf.db_select(table='teams',
-	                           columns=['team_name'],
-	                           where='')
 	letters = string.ascii_uppercase
 
-	letter2team = {letters[i]: fantateams[i] for i in range(len(fantateams))}
+	return np.array([[[letters.index(tm1), letters.index(tm2)]
+	                  for tm1, tm2 in day] for day in valid_days(n_teams)],
+	                dtype=int)
+
 
-	final_round = [letter2team[i] for i in list(line)]
-	final_round = grouper(final_round, 2)
+def decode_records(records, n_teams):
 
-	return list(grouper(final_round, len(letter2team) // 2))
+	"""
+	Decodes many records of the binary file at once. Returns an array with
+	shape (rounds, days, matches, 2) containing letter indexes.
+
+	"""
 
+	return day_table(n_teams)[np.asarray(records)]
 
-def random_rounds(number):
+
+def random_rounds_array(number, seed=None, teams=None):
+
+	"""
+	Returns 'number' random rounds as an array with shape
+	(rounds, days, matches, 2) of team indexes, ready for the functions in
+	calendar_functions. Indexes refer to the letters, i.e. to
+	teams_by_letter(), or to the positions in 'teams' if it is given.
+	The same 'seed' always gives the same rounds.
+
+	"""
+
+	header, _ = load_leagues_bin(cfg.ALL_LEAGUES_BIN)
+	records = random_records(number, seed, cfg.ALL_LEAGUES_BIN)
+	rounds = decode_records(records, header['n_teams'])
+
+	if teams is not None:
+		letter2idx = np.array([teams.index(tm) for tm in teams_by_letter()])
+		rounds = letter2idx[rounds]
+
+	return rounds
+
+
+def random_rounds(number, seed=None):
 
 	"""
 	Returns a list of 'number' random rounds ready to be used in the
 	simulation. Each of these rounds will be used later to generate a
 	complete schedule by using the function generate_schedule(a_round,
-	total_days).
+	total_days). The same 'seed' always gives the same rounds.
 
 	"""
 
-	res = []
-	for x in range(number):
-		line = get_random_line(cfg.ALL_LEAGUES)
-		real_round = real_round_from_line(line)
-		res.append(real_round)
+	fantateams = teams_by_letter()
 
-	return res
+	return [[tuple((fantateams[tm1], fantateams[tm2]) for tm1, tm2 in day)
+	         for day in a_round]
+	        for a_round in random_rounds_array(number, seed).tolist()]
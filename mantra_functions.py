@@ -1,29 +1,202 @@
+import hashlib
 import numpy as np
 import itertools
-from collections import Counter
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import db_functions as dbf
+import season_functions as sf
+import vote_store as vs
+import config as cfg
+
+
+# In-process front of the mantra cache tables, see cached_mantra()
+_LINEUP_CACHE = OrderedDict()
+
+# SchemeCatalog of each database, see get_scheme_catalog()
+_CATALOGS = {}
+
+# {name: role} of each database, see get_roles()
+_ROLES = {}
+
+# dbf.data_version() of each database when its lineups and roles were cached
+_DATA_VERSIONS = {}
+
+
+def _check_data_version(database: str) -> None:
+
+    """
+    Drop the lineups and roles of 'database' cached in memory if another
+    connection changed it since they were loaded.
+    """
+
+    version = dbf.data_version(database)
+    if _DATA_VERSIONS.get(database) != version:
+        invalidate_mantra_cache(database=database)
+        _ROLES.pop(database, None)
+        _DATA_VERSIONS[database] = version
+
+
+def _init_worker(catalog: 'SchemeCatalog') -> None:
+    _CATALOGS[catalog.database] = catalog
+
+
+def _mantra_task(args: tuple) -> tuple:
+    day, fantateam, starting_players, data, database = args
+    return mantra(day, fantateam, starting_players, data, database)
+
+
+class SchemeCatalog(object):
+
+    def __init__(self, database: str = cfg.dbase1):
+
+        """
+        Read 'schemes_details' and 'malus' once and keep, for each scheme,
+        the roles of its positions and the roles they can be adapted to.
+        The matrices with all the role options of a scheme are compiled the
+        first time they are needed and then reused, see matrix().
+
+        :param database: str
+
+        """
+
+        self.database = database
+
+        details = dbf.db_select(table='schemes_details',
+                                columns=['scheme', 'details'],
+                                where='', database=database)
+        self.roles = {sch: det.split(', ')[1:] for sch, det in details}
+
+        malus = dbf.db_select(table='malus', columns=['role', 'malus'],
+                              where='', database=database)
+        self.malus = {rl: opts.split(';') for rl, opts in malus}
+
+        self._matrices = {}
+        self._options = {}
+
+    def adapted_roles(self, scheme: str) -> dict:
+
+        """
+        Return the roles each role can be adapted to in 'scheme'. The
+        difference between T1 and T2 only matters for the special schemes.
+        """
+
+        options_per_role = {k: list(v) for k, v in self.malus.items()}
+
+        special_schemes = ['4-1-4-1']
+        if scheme not in special_schemes:
+            options_per_role['T'] = options_per_role['T1']
+            options_per_role['W'].remove('T1')
+        else:
+            options_per_role['T'] = options_per_role['T2']
+            options_per_role['W'].remove('T')
+            options_per_role['W'].remove('T1')
+        del options_per_role['T1'], options_per_role['T2']
+
+        return options_per_role
+
+    def matrix(self, scheme: str, players_needed: int, is_adapted: bool,
+               counting_malus: bool, number_of_a: int,
+               number_of_pc: int) -> tuple:
+
+        """
+        Return all the distinct ways of assigning one role to each position
+        of the scheme as (id_matrix, count_matrix), see expand_role_options().
+        Nothing is filtered here: it depends on the lineup and it is done by
+        filter_role_matrix(). Both are empty if the scheme is not valid.
+        """
+
+        if is_adapted:
+            key = (scheme, players_needed, counting_malus, number_of_a,
+                   number_of_pc)
+        else:
+            key = (scheme, players_needed)
+
+        if key not in self._matrices:
+            options = self.options(scheme, players_needed, is_adapted,
+                                   counting_malus, number_of_a, number_of_pc)
+            self._matrices[key] = expand_role_options(options)
+
+        return self._matrices[key]
+
+    def options(self, scheme: str, players_needed: int, is_adapted: bool,
+                counting_malus: bool, number_of_a: int,
+                number_of_pc: int) -> list:
+
+        """
+        Return the role options of 'scheme', Ex.
+        [['Dc', 'Dc', 'Dc', 'E', 'M/C', ...], ...]. When the lineup has less
+        than 11 players there is one option for each combination of the
+        positions. In adapted solutions the positions taken by the attackers
+        in field are removed and, unless we are counting malus, each position
+        also accepts the roles it can be adapted to.
+        """
+
+        key = (scheme, players_needed, is_adapted, counting_malus,
+               number_of_a, number_of_pc)
+        if key not in self._options:
+            self._options[key] = self._build_options(*key)
+        return self._options[key]
+
+    def _build_options(self, scheme: str, players_needed: int,
+                       is_adapted: bool, counting_malus: bool,
+                       number_of_a: int, number_of_pc: int) -> list:
+
+        roles_in_scheme = list(itertools.combinations(self.roles[scheme],
+                                                      players_needed))
+        roles_in_scheme = [sorted(list(t)) for t in roles_in_scheme]
+        roles_in_scheme = np.unique(np.array(roles_in_scheme), axis=0)
+
+        if not is_adapted:
+            return [list(opt) for opt in roles_in_scheme]
+
+        roles_in_scheme = remove_attackers_from_scheme(
+                all_roles=roles_in_scheme, pc_in_field=number_of_pc,
+                a_in_field=number_of_a)
+
+        if counting_malus:
+            return roles_in_scheme
+
+        options_per_role = self.adapted_roles(scheme)
+        adapted = []
+        for orig in split_roles(list_of_options=roles_in_scheme, by='/'):
+            opt = []
+            for el in orig:
+                tmp = [el] + [options_per_role[rl] for rl in el]
+                res = list(set([rl for ls in tmp for rl in ls]))
+                opt.append('/'.join(res))
+            adapted.append(opt)
+        return adapted
+
+    def schemes(self, scheme_to_exclude: str = '') -> list:
+        return [sch for sch in self.roles if sch != scheme_to_exclude]
 
 
 def adapted_solution(field_info: list, bench_names_options: list,
-                     bench_roles_options: list, players_needed: int) -> tuple:
+                     bench_roles_options: list, players_needed: int,
+                     database: str = cfg.dbase1) -> tuple:
 
     field_roles = [rl.replace(';', '/') for _, rl in field_info]
 
-    already_tried = []
+    valid = prune_combinations(field_roles=field_roles,
+                               bench_roles_options=bench_roles_options,
+                               players_needed=players_needed,
+                               scheme_used='')
+
+    already_tried = set()
     results = []
-    for n_comb, r_comb in zip(bench_names_options, bench_roles_options):
-        if set(r_comb) in already_tried:
+    for n_comb, r_comb, is_valid in zip(bench_names_options,
+                                        bench_roles_options, valid):
+        if frozenset(r_comb) in already_tried:
             continue
-        already_tried.append(set(r_comb))
-        tmp = field_roles + list(r_comb)
-        if (too_many_attackers(list_of_roles=tmp) or
-                not enough_defenders(players_needed=players_needed,
-                                     list_of_roles=tmp, scheme_used='')):
+        already_tried.add(frozenset(r_comb))
+        if not is_valid:
             continue
+        tmp = field_roles + list(r_comb)
 
         all_schemes = only_compatible_schemes(list_of_roles=tmp,
                                               players_needed=players_needed,
-                                              scheme_to_exclude='')
+                                              scheme_to_exclude='',
+                                              database=database)
         n_pc = count_roles(['Pc'], tmp)
         n_a = count_roles(['A'], tmp)
         tmp = [rl for rl in tmp if rl not in ['A', 'Pc']]
@@ -33,28 +206,25 @@ def adapted_solution(field_info: list, bench_names_options: list,
             lineup_mtx_full, all_res = solution_exists(
                     players_needed=players_needed, scheme_used=sch,
                     roles_in_lineup=[tmp], field_counter=fld_cnt,
-                    is_adapted=True, number_of_a=n_a, number_of_pc=n_pc)
+                    is_adapted=True, number_of_a=n_a, number_of_pc=n_pc,
+                    database=database)
 
             if lineup_mtx_full.sum():
                 good_lineups = lineup_mtx_full[all_res]
-                good_lineups = [Counter(i) for i in good_lineups]
 
                 id_arr, _ = scheme_matrix_and_nrepeat(
                         players_needed=players_needed, scheme_used=sch,
                         field_counter=Counter([]), is_adapted=True,
                         counting_malus=True, number_of_a=n_a,
-                        number_of_pc=n_pc)
-
-                id_arr = [Counter(i) for i in id_arr]
-                for c1, c2 in itertools.product(good_lineups, id_arr):
-                    n_malus = sum((c1-c2).values())
+                        number_of_pc=n_pc, database=database)
 
-                    if n_malus == 1:
-                        return field_info + list(
-                            zip(n_comb, r_comb)), sch, n_malus
+                n_malus = count_malus(lineups=good_lineups, scheme_rows=id_arr)
+                if (n_malus == 1).any():
+                    return field_info + list(zip(n_comb, r_comb)), sch, 1
+                if n_malus.size:
                     results.append((field_info + list(zip(n_comb, r_comb)),
                                     sch,
-                                    n_malus))
+                                    int(n_malus.min())))
 
     if not results:
         return [], '', 0
@@ -63,15 +233,14 @@ def adapted_solution(field_info: list, bench_names_options: list,
     return results[0]
 
 
-def add_roles(list_of_players: list) -> (list, list):
+def add_roles(list_of_players: list, roles: dict = None,
+              database: str = cfg.dbase1) -> (list, list):
 
     gkeep_list = []
     field_list = []
+    roles = get_roles(database) if roles is None else roles
     for player in list_of_players:
-        role = dbf.db_select(
-                table='roles',
-                columns=['role'],
-                where=f'name = "{player}"')[0]
+        role = roles[player]
 
         if role == 'Por':
             gkeep_list.append((player, role))
@@ -81,6 +250,100 @@ def add_roles(list_of_players: list) -> (list, list):
     return gkeep_list, field_list
 
 
+def cached_mantra(day: int, fantateam: str, starting_players: int = 10,
+                  database: str = cfg.dbase1, check: bool = True) -> tuple:
+
+    """
+    Same as mantra() but lineups are only calculated once. They are looked
+    up in:
+
+        1. an LRU cache in memory, keyed by (database, fantateam, day). It
+           is emptied when another connection changes 'database', see
+           dbf.data_version(). With check=False this costs no query, for
+           callers that already checked, see cached_mantra_batch()
+
+        2. the 'mantra_cache' tables of 'database', where each lineup is
+           stored with the digest of the data used to calculate it (lineup,
+           scheme, roles and votes of the players). A stored lineup is used
+           only if the digest still matches, so after a vote correction only
+           the affected (fantateam, day) are calculated again
+
+    Lineups copied from the old 'mantra_lineups' table have no digest, so
+    they are calculated again the first time, see
+    recalculate_legacy_lineups().
+
+    Return names, scheme and malus, as mantra().
+    """
+
+    return cached_mantra_batch([day], [fantateam], starting_players,
+                               database, check)[(fantateam, day)]
+
+
+def cached_mantra_batch(days: list, teams: list, starting_players: int = 10,
+                        database: str = cfg.dbase1,
+                        check: bool = True) -> dict:
+
+    """
+    Same as cached_mantra() for every team in 'teams' in every day in 'days'
+    with a constant number of queries: data and stored lineups of the pairs
+    not in memory are loaded in bulk and the ones calculated again are saved
+    in a single transaction. Pairs without a lineup are skipped.
+
+    Return {(team, day): (names, scheme, malus)}.
+    """
+
+    if check:
+        _check_data_version(database)
+
+    lineups = {}
+    missing = []
+    for tm in teams:
+        for day in days:
+            key = (database, tm, day, starting_players)
+            if key in _LINEUP_CACHE:
+                _LINEUP_CACHE.move_to_end(key)
+                lineups[(tm, day)] = _LINEUP_CACHE[key]
+            else:
+                missing.append((tm, day))
+
+    if not missing:
+        return lineups
+
+    miss_days = sorted({day for _, day in missing})
+    miss_teams = sorted({tm for tm, _ in missing})
+    data = load_mantra_data(miss_days, miss_teams, database)
+    stored = load_mantra_lineups(miss_days, miss_teams, database)
+
+    to_save = []
+    for tm, day in missing:
+        if not data[(tm, day)]['lineup']:
+            continue
+
+        digest, roles = lineup_digest(day, tm, starting_players,
+                                      data[(tm, day)])
+        lineup = stored.get((tm, day))
+        if lineup and lineup[0] == digest:
+            _, names, scheme, malus = lineup
+        else:
+            names, scheme, malus = mantra(day, tm, starting_players,
+                                          data[(tm, day)], database)
+            to_save.append((day, tm, digest, names, roles, scheme, malus))
+
+        lineups[(tm, day)] = names, scheme, malus
+        _LINEUP_CACHE[(database, tm, day, starting_players)] = lineups[
+                (tm, day)]
+        if len(_LINEUP_CACHE) > cfg.MANTRA_CACHE_SIZE:
+            _LINEUP_CACHE.popitem(last=False)
+
+    # Lineups are calculated before, the write lock is only held to save them
+    if to_save:
+        with dbf.transaction(database):
+            for args in to_save:
+                save_mantra_lineup(*args, database=database)
+
+    return lineups
+
+
 def count_roles(which_roles: list, list_of_roles: list) -> int:
     res = 0
     for rl in which_roles:
@@ -88,6 +351,30 @@ def count_roles(which_roles: list, list_of_roles: list) -> int:
     return res
 
 
+def count_malus(lineups: np.array, scheme_rows: np.array) -> np.array:
+
+    """
+    Return the number of malus for each pair (lineup, scheme option), Ex.
+    [[0, 1], [2, 1]]. It is the cost of the best assignment of the players
+    to the positions when a natural role costs 0 and an adapted one costs 1,
+    i.e. the number of roles in the lineup which are not matched by the same
+    role in the scheme.
+
+    :param lineups: np.array, role ids, one lineup for each row
+    :param scheme_rows: np.array, role ids, one option for each row
+
+    """
+
+    ids = np.arange(1, len(RL_MAP) + 1)
+    lineup_counts = (np.asarray(lineups)[:, :, None] == ids).sum(axis=1)
+    scheme_counts = (np.asarray(scheme_rows)[:, :, None] == ids).sum(axis=1)
+
+    matched = np.minimum(lineup_counts[:, None, :],
+                         scheme_counts[None, :, :]).sum(axis=2)
+
+    return lineup_counts.sum(axis=1)[:, None] - matched
+
+
 def deploy_goalkeeper(gkeep_field, gkeep_bench):
 
     if gkeep_field:
@@ -107,27 +394,31 @@ def deploy_goalkeeper(gkeep_field, gkeep_bench):
 
 def efficient_solution(scheme_used: str, field_info: list,
                        bench_names_options: list, bench_roles_options: list,
-                       players_needed: int) -> tuple:
+                       players_needed: int,
+                       database: str = cfg.dbase1) -> tuple:
 
     field_roles = [rl.replace(';', '/') for nm, rl in field_info]
 
-    for n_comb, r_comb in zip(bench_names_options, bench_roles_options):
+    valid = prune_combinations(field_roles=field_roles,
+                               bench_roles_options=bench_roles_options,
+                               players_needed=players_needed,
+                               scheme_used='')
+
+    for i in np.flatnonzero(valid):
+        n_comb, r_comb = bench_names_options[i], bench_roles_options[i]
         tmp = field_roles + list(r_comb)
-        if (too_many_attackers(list_of_roles=tmp) or
-                not enough_defenders(players_needed=players_needed,
-                                     list_of_roles=tmp,
-                                     scheme_used='')):
-            continue
 
         other_schemes = only_compatible_schemes(list_of_roles=tmp,
                                                 players_needed=players_needed,
-                                                scheme_to_exclude=scheme_used)
+                                                scheme_to_exclude=scheme_used,
+                                                database=database)
 
         fld_cnt = Counter([i for j in tmp for i in j.split('/')])
         for sch in other_schemes:
             if solution_exists(players_needed=players_needed,
                                scheme_used=sch, roles_in_lineup=[tmp],
-                               field_counter=fld_cnt, is_adapted=False):
+                               field_counter=fld_cnt, is_adapted=False,
+                               database=database):
                 return field_info + list(zip(n_comb, r_comb)), sch
 
     return [], ''
@@ -162,8 +453,169 @@ def enough_defenders(players_needed: int, list_of_roles: list,
     return True if def_in_lineup >= min_def else False
 
 
-def filter_players_without_vote(day, players):
-    return [pl for pl in players if player_vote(day, pl) != 'sv']
+def expand_role_options(list_of_roles: list) -> tuple:
+
+    """
+    Return all the distinct multisets of roles obtained by choosing one role
+    for each position in any of the options in 'list_of_roles', Ex.
+    [['Dc', 'M/C', 'W/A'], ...]. Instead of the cartesian product of the
+    positions, which explodes with adapted roles, we keep only the distinct
+    multisets position after position: each one is encoded as an integer
+    with 4 bits for the count of each role.
+
+    :return: (np.array, np.array), the sorted role ids of each multiset
+             (one row each) and the count of each role (columns in the order
+             of RL_MAP)
+
+    """
+
+    weights = {rl: 1 << (4 * (rl_id - 1)) for rl, rl_id in RL_MAP.items()}
+
+    keys = [np.zeros(0, dtype=np.int64)]
+    for opt in list_of_roles:
+        opt_keys = np.zeros(1, dtype=np.int64)
+        for position in opt:
+            position_weights = np.array(sorted({weights[rl] for rl in
+                                                position.split('/')}),
+                                        dtype=np.int64)
+            opt_keys = np.unique(opt_keys[:, None] + position_weights)
+        keys.append(opt_keys)
+    keys = np.unique(np.concatenate(keys))
+    n_roles = len(list_of_roles[0]) if list_of_roles else 0
+
+    counts = (keys[:, None] >> (4 * np.arange(len(RL_MAP)))) & 15
+    cumulative = counts.cumsum(axis=1)
+    id_arr = 1 + (cumulative[:, None, :] <=
+                  np.arange(n_roles)[None, :, None]).sum(axis=2)
+
+    return id_arr, counts
+
+
+def filter_players_without_vote(day, players, votes: dict = None,
+                                database: str = cfg.dbase1):
+    if votes is not None:
+        return [pl for pl in players if (votes.get(pl) or 'sv') != 'sv']
+    store = vs.get_vote_store(database)
+    return [pl for pl in players if store.get_vote(pl, day) != 'sv']
+
+
+def filter_role_matrix(id_arr: np.array, counts: np.array,
+                       players_needed: int, scheme_used: str,
+                       field_counter: Counter) -> np.array:
+
+    """
+    Vectorized version of the filters applied by rec_cart(): keep only the
+    rows which
+
+        - have no role more times than 'field_counter' (if not empty)
+        - do not have too many attackers
+        - have enough defenders for the scheme
+
+    :param id_arr: np.array, see expand_role_options()
+    :param counts: np.array, see expand_role_options()
+
+    :return: np.array
+
+    """
+
+    col = {rl: rl_id - 1 for rl, rl_id in RL_MAP.items()}
+    keep = np.ones(len(counts), dtype=bool)
+
+    if field_counter:
+        in_field = np.array([field_counter[rl] for rl in RL_MAP])
+        keep &= (counts <= in_field).all(axis=1)
+
+    keep &= valid_role_counts(
+            n_pc=counts[:, col['Pc']], n_a=counts[:, col['A']],
+            n_t=counts[:, col['T']],
+            n_def=counts[:, [col['Dc'], col['Dd'], col['Ds']]].sum(axis=1),
+            players_needed=players_needed, scheme_used=scheme_used)
+
+    return id_arr[keep]
+
+
+def get_roles(database: str = cfg.dbase1) -> dict:
+
+    """
+    Return {name: role} of all the players in the 'roles' table of
+    'database', loading them the first time or when another connection
+    changed 'database'.
+    """
+
+    _check_data_version(database)
+    if database not in _ROLES:
+        _ROLES[database] = dict(dbf.db_select(table='roles',
+                                              columns=['name', 'role'],
+                                              where='', database=database))
+    return _ROLES[database]
+
+
+def get_scheme_catalog(database: str = cfg.dbase1) -> SchemeCatalog:
+
+    """
+    Return the SchemeCatalog of 'database', compiling it the first time.
+    """
+
+    if database not in _CATALOGS:
+        _CATALOGS[database] = SchemeCatalog(database)
+    return _CATALOGS[database]
+
+
+def invalidate_mantra_cache(day: int = None, fantateam: str = None,
+                            database: str = None) -> None:
+
+    """
+    Drop from memory the lineups of 'day' and/or 'fantateam' and/or
+    'database' (all of them if None). To be called when lineups, votes or
+    roles change, the ones stored in the db are checked against their digest
+    anyway.
+    """
+
+    for key in list(_LINEUP_CACHE):
+        lineup_database, team_name, lineup_day, _ = key
+        if database not in (None, lineup_database):
+            continue
+        if day not in (None, lineup_day):
+            continue
+        if fantateam not in (None, team_name):
+            continue
+        del _LINEUP_CACHE[key]
+
+
+def lineup_days(database: str = cfg.dbase1) -> list:
+
+    """
+    Return all the days with at least one lineup saved.
+    """
+
+    return sorted(dbf.db_select(table='lineup_players',
+                                columns=['DISTINCT day'], where='',
+                                database=database))
+
+
+def lineup_digest(day: int, fantateam: str, starting_players: int,
+                  data: dict = None, database: str = cfg.dbase1) -> tuple:
+
+    """
+    Return the digest of all the data used by mantra() to calculate the
+    lineup of 'fantateam' in 'day' and the roles of the players. 'data' is
+    the one returned by load_mantra_data() for (fantateam, day), loaded here
+    from 'database' if not given.
+    """
+
+    if data is None:
+        data = load_mantra_data([day], [fantateam],
+                                database)[(fantateam, day)]
+
+    lineup = [data['lineup']] if data['lineup'] else []
+    scheme = [data['scheme']] if data['scheme'] else []
+    players = data['lineup'].split(', ') if data['lineup'] else []
+    roles, votes = data['roles'], data['votes']
+
+    data = [starting_players, lineup, scheme,
+            [(pl, roles.get(pl), votes.get(pl, 'sv')) for pl in players]]
+
+    return hashlib.sha1(repr(data).encode()).hexdigest(), roles
 
 
 def lineup_matrix_and_ntiles(players_needed: int, roles_in_lineup: list,
@@ -176,28 +628,119 @@ def lineup_matrix_and_ntiles(players_needed: int, roles_in_lineup: list,
     return id_arr, id_arr.shape[0]
 
 
-def mantra(day, fantateam, starting_players):
+def load_mantra_data(days: list = None, teams: list = None,
+                     database: str = cfg.dbase1) -> dict:
+
+    """
+    Load all the data needed by mantra() for every team in 'teams' in every
+    day in 'days' (all of them if None) with one query per table, instead of
+    one per player. Roles come from get_roles().
+
+    Return {(team, day): {'lineup': str, 'scheme': str, 'roles': dict,
+    'votes': dict}} where 'roles' and 'votes' only contain the players in the
+    lineup and the missing lineups or schemes are None.
+    """
+
+    if days is None:
+        days = lineup_days(database)
+    if teams is None:
+        teams = dbf.db_select(table='teams', columns=['team_name'], where='',
+                              database=database)
+    if not days or not teams:
+        return {}
+
+    lineups = sf.lineups(teams, days, database)
+    schemes = sf.schemes(teams, days, database)
+
+    players = {(tm, day): lineups.get((tm, day), [])
+               for tm in teams for day in days}
+    names = sorted({nm for pls in players.values() for nm in pls if nm})
+
+    roles = get_roles(database)
+
+    marks = ', '.join(['?'] * len(names))
+    day_marks = ', '.join(['?'] * len(days))
+    votes = {(day, nm): alvin for day, nm, alvin in
+             dbf.db_select(table='votes', columns=['day', 'name', 'alvin'],
+                           where=f'day IN ({day_marks}) AND name IN ({marks})',
+                           params=list(days) + names, database=database)}
 
-    def save_mantra_lineup(which_day, fteam, final_lineup, n_malus):
+    data = {}
+    for (tm, day), pls in players.items():
+        data[(tm, day)] = {
+            'lineup': ', '.join(pls) if pls else None,
+            'scheme': schemes.get((tm, day)),
+            'roles': {nm: roles[nm] for nm in pls if nm in roles},
+            'votes': {nm: votes[(day, nm)] for nm in pls
+                      if (day, nm) in votes}}
 
-        result = [f"{nm}:{rl}" for nm, rl in final_lineup]
-        result.insert(0, str(n_malus))
-        dbf.db_update(
-                table='mantra_lineups',
-                columns=[f'day_{which_day}'],
-                values=[', '.join(result)],
-                where=f'team_name="{fteam}"')
+    return data
+
+
+def load_mantra_lineup(day: int, fantateam: str,
+                       database: str = cfg.dbase1):
+
+    """
+    Return digest, names, scheme and malus of the lineup stored in the
+    'mantra_cache' tables or None if there is not.
+    """
+
+    return load_mantra_lineups([day], [fantateam],
+                               database).get((fantateam, day))
+
+
+def load_mantra_lineups(days: list, teams: list,
+                        database: str = cfg.dbase1) -> dict:
+
+    """
+    Return {(team, day): (digest, names, scheme, malus)} of the lineups of
+    'teams' in 'days' stored in the 'mantra_cache' tables, with one query
+    per table. Pairs without a stored lineup are missing.
+    """
+
+    team_marks = ', '.join(['?'] * len(teams))
+    day_marks = ', '.join(['?'] * len(days))
+    where = f'team_name IN ({team_marks}) AND day IN ({day_marks})'
+    params = list(teams) + list(days)
+
+    lineups = dbf.db_select(
+            table='mantra_cache',
+            columns=['team_name', 'day', 'digest', 'scheme', 'malus'],
+            where=where, params=params, database=database)
+
+    names = {}
+    for tm, day, _, nm in sorted(dbf.db_select(
+            table='mantra_cache_players',
+            columns=['team_name', 'day', 'position', 'name'],
+            where=where, params=params, database=database)):
+        names.setdefault((tm, day), []).append(nm)
+
+    return {(tm, day): (digest, names.get((tm, day), []), scheme or '', malus)
+            for tm, day, digest, scheme, malus in lineups}
+
+
+def mantra(day, fantateam, starting_players, data: dict = None,
+           database: str = cfg.dbase1):
+
+    # Data preloaded by load_mantra_data(), if any. Otherwise everything is
+    # selected from 'database'
+    data = data or {}
 
     # Separate field and bench
-    field, bench = select_lineup(day, fantateam)
+    field, bench = select_lineup(day, fantateam, data.get('lineup'),
+                                 database)
 
     # Keep only players with vote
-    field_with_vote = filter_players_without_vote(day, field)
-    bench_with_vote = filter_players_without_vote(day, bench)
+    field_with_vote = filter_players_without_vote(day, field,
+                                                  data.get('votes'), database)
+    bench_with_vote = filter_players_without_vote(day, bench,
+                                                  data.get('votes'), database)
 
     # Extract goal-keepers from field and bench
-    gkeep_field, field_with_roles = add_roles(field_with_vote)
-    gkeep_bench, bench_with_roles = add_roles(bench_with_vote)
+    gkeep_field, field_with_roles = add_roles(field_with_vote,
+                                              data.get('roles'), database)
+    gkeep_bench, bench_with_roles = add_roles(bench_with_vote,
+                                              data.get('roles'), database)
 
     # Define the goal-keeper to use and the max number of substitutions allowed
     gkeep, max_subst = deploy_goalkeeper(gkeep_field, gkeep_bench)
@@ -206,10 +749,10 @@ def mantra(day, fantateam, starting_players):
     n_subst = min(max_subst, starting_players - len(field_with_roles))
 
     malus = 0
-    scheme = dbf.db_select(
-            table='schemes',
-            columns=[f'day_{day}'],
-            where=f'team_name = "{fantateam}"')[0]
+    if data:
+        scheme = data['scheme']
+    else:
+        scheme = sf.schemes([fantateam], [day], database)[(fantateam, day)]
     # If no substitutions needed
     if not n_subst:
         complete_lineup, new_scheme = field_with_roles, scheme
@@ -224,7 +767,8 @@ def mantra(day, fantateam, starting_players):
                 field_info=field_with_roles,
                 bench_names_options=bench_names_comb,
                 bench_roles_options=bench_roles_comb,
-                players_needed=starting_players)
+                players_needed=starting_players,
+                database=database)
 
         if not complete_lineup:
             complete_lineup, new_scheme = efficient_solution(
@@ -232,31 +776,172 @@ def mantra(day, fantateam, starting_players):
                     field_info=field_with_roles,
                     bench_names_options=bench_names_comb,
                     bench_roles_options=bench_roles_comb,
-                    players_needed=starting_players)
+                    players_needed=starting_players,
+                    database=database)
 
         if not complete_lineup:
             complete_lineup, new_scheme, malus = adapted_solution(
                     field_info=field_with_roles,
                     bench_names_options=bench_names_comb,
                     bench_roles_options=bench_roles_comb,
-                    players_needed=starting_players)
+                    players_needed=starting_players,
+                    database=database)
 
     if complete_lineup:
         complete_lineup = [gkeep] + complete_lineup
-        save_mantra_lineup(which_day=day, fteam=fantateam,
-                           final_lineup=complete_lineup, n_malus=malus)
         names = [nm for nm, _ in complete_lineup]
         return names, new_scheme, malus
     else:
-        return mantra(day, fantateam, starting_players-1)
+        return mantra(day, fantateam, starting_players-1, data, database)
+
+
+def mantra_batch(days: list = None, teams: list = None,
+                 starting_players: int = 10, workers: int = cfg.WORKERS,
+                 verbose: bool = True, database: str = cfg.dbase1) -> dict:
+
+    """
+    Calculate the lineups of every team in 'teams' in every day in 'days'
+    (all of them if None) and store them in the 'mantra_cache' tables of
+    'database', replacing the ones already there. Data are loaded in bulk
+    before starting, the (team, day) pairs are solved in a pool of 'workers'
+    processes and the results are written back in a single transaction.
+
+    Return {(team, day): (names, scheme, malus)}.
+    """
+
+    data = load_mantra_data(days, teams, database)
+    pairs = sorted(key for key, value in data.items() if value['lineup'])
+    tasks = [(day, tm, starting_players, data[(tm, day)], database)
+             for tm, day in pairs]
+
+    # Read once and handed to each worker, which would otherwise read it
+    # again from the db when started with spawn (the default on macOS)
+    catalog = get_scheme_catalog(database)
+
+    results = []
+    workers = min(workers, len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(catalog, )) as executor:
+            chunksize = max(1, len(tasks) // (4 * workers))
+            for res in executor.map(_mantra_task, tasks, chunksize=chunksize):
+                results.append(res)
+                if verbose:
+                    print(f'\rFormazioni calcolate: {len(results)}/'
+                          f'{len(tasks)}', end='')
+    else:
+        for task in tasks:
+            results.append(_mantra_task(task))
+            if verbose:
+                print(f'\rFormazioni calcolate: {len(results)}/'
+                      f'{len(tasks)}', end='')
+    if verbose and tasks:
+        print()
+
+    with dbf.transaction(database):
+        for (tm, day), (names, scheme, malus) in zip(pairs, results):
+            digest, roles = lineup_digest(day, tm, starting_players,
+                                          data[(tm, day)])
+            save_mantra_lineup(day, tm, digest, names, roles, scheme, malus,
+                               database)
+
+    for tm, day in pairs:
+        invalidate_mantra_cache(day=day, fantateam=tm, database=database)
+
+    return dict(zip(pairs, results))
+
+
+def matching_solution_exists(players_needed: int, scheme_used: str,
+                             roles_in_lineup: list, field_counter: Counter,
+                             is_adapted: bool, number_of_a=0, number_of_pc=0,
+                             database: str = cfg.dbase1):
+
+    """
+    Same as matrix_solution_exists() but the lineup is assigned to the
+    positions of the scheme as a bipartite matching instead of comparing all
+    the role options of both.
+
+        - Not adapted: players keep all their roles. We only branch on the
+          type of role each player uses (defender, A, Pc, T or other) since
+          the constraints on attackers and defenders only depend on that,
+          and for each valid branch we look for a perfect matching
+
+        - Adapted: the lineup options are still built by roles2matrix()
+          since adapted_solution() needs them to count the malus, then each
+          of them is matched against the adapted positions
+
+    """
+
+    options = get_scheme_catalog(database).options(
+            scheme=scheme_used, players_needed=players_needed,
+            is_adapted=is_adapted, counting_malus=False,
+            number_of_a=number_of_a, number_of_pc=number_of_pc)
+    all_slots = [[set(position.split('/')) for position in opt]
+                 for opt in options]
+
+    if not is_adapted:
+        players = [set(rl.split('/')) for rl in roles_in_lineup[0]]
+        return any(roles_fit_scheme(players=players, slots=slots,
+                                    players_needed=players_needed,
+                                    scheme_used=scheme_used)
+                   for slots in all_slots)
+
+    lineup_mtx, _ = lineup_matrix_and_ntiles(
+            players_needed=players_needed, roles_in_lineup=roles_in_lineup,
+            scheme_used=scheme_used, field_counter=field_counter)
+
+    # For each option, the positions each role can take
+    positions = [{rl_id: [j for j, slot in enumerate(slots) if rl in slot]
+                  for rl, rl_id in RL_MAP.items()} for slots in all_slots]
+    fits = np.array([any(perfect_matching([pos[rl_id] for rl_id in row])
+                         for pos, slots in zip(positions, all_slots)
+                         if len(slots) == len(row))
+                     for row in lineup_mtx.tolist()], dtype=bool)
+
+    if not fits.any():
+        return np.array([]), np.array([])
+
+    return lineup_mtx[fits], fits[fits]
+
+
+def matrix_solution_exists(players_needed: int, scheme_used: str,
+                           roles_in_lineup: list, field_counter: Counter,
+                           is_adapted: bool, number_of_a=0, number_of_pc=0,
+                           database: str = cfg.dbase1):
+
+    lineup_mtx, n_tiles = lineup_matrix_and_ntiles(
+            players_needed=players_needed, roles_in_lineup=roles_in_lineup,
+            scheme_used=scheme_used, field_counter=field_counter)
+
+    scheme_mtx, n_repeat = scheme_matrix_and_nrepeat(
+            players_needed=players_needed, scheme_used=scheme_used,
+            field_counter=field_counter, is_adapted=is_adapted,
+            counting_malus=False, number_of_a=number_of_a,
+            number_of_pc=number_of_pc, database=database)
+
+    # This check is only needed for adapted solutions
+    if is_adapted and not scheme_mtx.sum():
+        return np.array([]), np.array([])
+
+    lineup_mtx_full = np.repeat(lineup_mtx, n_repeat, axis=0)
+    scheme_mtx_full = np.tile(scheme_mtx, (n_tiles, 1))
+
+    all_res = (lineup_mtx_full == scheme_mtx_full).all(axis=1)
+
+    if not is_adapted:
+        return all_res.any()
+
+    return ((lineup_mtx_full, all_res) if all_res.any() else
+            (np.array([]), np.array([])))
 
 
 def only_compatible_schemes(list_of_roles: list, players_needed: int,
-                            scheme_to_exclude) -> list:
+                            scheme_to_exclude,
+                            database: str = cfg.dbase1) -> list:
 
-    all_schemes = dbf.db_select(table='schemes_details',
-                                columns=['scheme'],
-                                where=f'scheme != "{scheme_to_exclude}"')
+    catalog = get_scheme_catalog(database)
+    all_schemes = catalog.schemes(scheme_to_exclude)
 
     # First of all we need to remove all those schemes whose number of
     # defenders is not compatible with the roles in field
@@ -268,10 +953,7 @@ def only_compatible_schemes(list_of_roles: list, players_needed: int,
     res = []
     n_pc = count_roles(['Pc'], list_of_roles)
     for sch in all_schemes:
-        rl_in_scheme = dbf.db_select(
-                table='schemes_details',
-                columns=['details'],
-                where=f'scheme = "{sch}"')[0].split(', ')[1:]
+        rl_in_scheme = catalog.roles[sch]
 
         # To be a compatible scheme it must at least equal the number of
         # attackers playing
@@ -282,66 +964,141 @@ def only_compatible_schemes(list_of_roles: list, players_needed: int,
 
 def optimal_solution(scheme_used: str, field_info: list,
                      bench_names_options: list, bench_roles_options: list,
-                     players_needed: int) -> tuple:
+                     players_needed: int,
+                     database: str = cfg.dbase1) -> tuple:
 
     field_roles = [rl.replace(';', '/') for nm, rl in field_info]
 
-    for n_comb, r_comb in zip(bench_names_options, bench_roles_options):
+    valid = prune_combinations(field_roles=field_roles,
+                               bench_roles_options=bench_roles_options,
+                               players_needed=players_needed,
+                               scheme_used=scheme_used)
+
+    for i in np.flatnonzero(valid):
+        n_comb, r_comb = bench_names_options[i], bench_roles_options[i]
         tmp = field_roles + list(r_comb)
-        if (too_many_attackers(list_of_roles=tmp) or
-                not enough_defenders(players_needed=players_needed,
-                                     list_of_roles=tmp,
-                                     scheme_used=scheme_used)):
-            continue
 
         fld_cnt = Counter([i for j in tmp for i in j.split('/')])
         if solution_exists(players_needed=players_needed,
                            scheme_used=scheme_used, roles_in_lineup=[tmp],
-                           field_counter=fld_cnt, is_adapted=False):
+                           field_counter=fld_cnt, is_adapted=False,
+                           database=database):
             return field_info + list(zip(n_comb, r_comb)), ''
 
     return [], ''
 
 
-def player_vote(day, player_name):
+def perfect_matching(candidates: list) -> bool:
+
+    """
+    Return True if each element can be assigned to a different position,
+    where candidates[i] are the positions element i can take (Kuhn's
+    algorithm).
+    """
+
+    owner = {}
+
+    def assign(i: int, seen: set) -> bool:
+        for j in candidates[i]:
+            if j in seen:
+                continue
+            seen.add(j)
+            if j not in owner or assign(owner[j], seen):
+                owner[j] = i
+                return True
+        return False
+
+    return all(assign(i, set()) for i in range(len(candidates)))
+
+
+def player_vote(day, player_name, database: str = cfg.dbase1):
 
     vote = dbf.db_select(
             table='votes',
             columns=['alvin'],
-            where=f'day={day} AND name="{player_name}"')
+            where={'day': day, 'name': player_name},
+            database=database)
 
     return vote[0] if vote else 'sv'
 
 
-def rec_cart(start: int, list_of_roles: list, partial: list, results: list,
-             players_needed: int, scheme_used: str, some_counter: Counter,
-             used_counters: list):
+def prune_combinations(field_roles: list, bench_roles_options: list,
+                       players_needed: int, scheme_used: str) -> np.array:
 
-    def option_is_not_compatible(field_counter: Counter,
-                                 option_counter: Counter) -> bool:
+    """
+    Check all the bench combinations at once: return a boolean array which is
+    True for the combinations which, together with the roles in field, pass
+    too_many_attackers() and enough_defenders(). Each role is encoded as the
+    counts used by those functions, so the counts of a lineup are the sum of
+    the counts of field and bench.
 
-        # To be compatible, option_counter must contain ALL the roles in field
-        return True if option_counter - field_counter else False
+    :param field_roles: list, Ex. ['Dc', 'M/C', 'W/A', ...]
+    :param bench_roles_options: list of tuples, Ex. [('E', 'A/Pc'), ...]
+    :param players_needed: int
+    :param scheme_used: str, '' for the general check
 
-    # To avoid repeating calculations: if roles are the same the result is the
-    # same no matter the players
-    if Counter(partial) in used_counters:
-        return
+    :return: np.array
+
+    """
+
+    def role_counts(role: str) -> list:
+        # Pc, A, T, T/A, defenders
+        return [role == 'Pc', role == 'A', role == 'T', role == 'T/A',
+                bool({'Dc', 'Dd', 'Ds'} & set(role.split('/')))]
+
+    if not len(bench_roles_options):
+        return np.zeros(0, dtype=bool)
+
+    all_roles = set(field_roles).union(*bench_roles_options)
+    counts = {rl: role_counts(rl) for rl in all_roles}
+
+    field = np.array([counts[rl] for rl in field_roles],
+                     dtype=int).reshape(-1, 5).sum(axis=0)
+    bench = np.array([[counts[rl] for rl in comb] for comb in
+                      bench_roles_options], dtype=int).sum(axis=1)
+    n_pc, n_a, n_t, n_ta, n_def = (field + bench).T
+
+    too_many = ((n_pc == 3) | ((n_pc == 2) & (n_a > 0)) |
+                ((n_pc == 2) & (n_t + n_ta > 1)) | (n_pc + n_a > 3))
+
+    missing_players = 10 - players_needed
+    min_def = (int(scheme_used[0]) if scheme_used else 3) - missing_players
+
+    return ~too_many & (n_def >= min_def)
+
+
+def rec_cart(start: int, list_of_roles: list, partial: list, results: list,
+             players_needed: int, scheme_used: str, some_counter: Counter,
+             used_keys: set, stats: Counter = None):
+
+    if stats is not None:
+        stats['visited'] += 1
 
     # Define 2 conditions to filter
     cond1 = too_many_attackers(list_of_roles=partial)
-    if some_counter:
-        cond2 = option_is_not_compatible(field_counter=some_counter,
-                                         option_counter=Counter(partial))
+    if some_counter and partial:
+        # To be compatible, the option must contain ALL the roles in field.
+        # Since the parent node was compatible only the last role can exceed
+        cond2 = partial.count(partial[-1]) > some_counter[partial[-1]]
     else:
         # When we count the number of malus we use the original roles (not the
         # adapted ones) which we already know are not compatible
         cond2 = False
 
     if partial and (cond1 | cond2):
+        if stats is not None:
+            stats['pruned'] += 1
         return
 
     if len(partial) == len(list_of_roles):
+        # To avoid repeating calculations: if roles are the same the result
+        # is the same no matter the players
+        key = tuple(sorted(partial))
+        if key in used_keys:
+            if stats is not None:
+                stats['duplicates'] += 1
+            return
+
         # Once option is complete we check if there are enough defenders. We
         # check the defenders because it is the only role which can not be
         # replaced, not even with malus
@@ -349,14 +1106,94 @@ def rec_cart(start: int, list_of_roles: list, partial: list, results: list,
                             list_of_roles=partial,
                             scheme_used=scheme_used):
             results.append(partial)
-            used_counters.append(Counter(partial))
+            used_keys.add(key)
+        elif stats is not None:
+            stats['pruned'] += 1
         return
 
     for element in list_of_roles[start]:
         rec_cart(start=start+1, list_of_roles=list_of_roles,
                  partial=partial+[element], results=results,
                  players_needed=players_needed, scheme_used=scheme_used,
-                 some_counter=some_counter, used_counters=used_counters)
+                 some_counter=some_counter, used_keys=used_keys, stats=stats)
+
+
+def recalculate_legacy_lineups(workers: int = cfg.WORKERS,
+                               verbose: bool = True,
+                               database: str = cfg.dbase1) -> int:
+
+    """
+    Calculate again with mantra_batch() the lineups stored without digest,
+    the ones copied from the old 'mantra_lineups' table, so that
+    cached_mantra() does not find them one by one. Return how many there
+    were.
+    """
+
+    legacy = dbf.db_select(table='mantra_cache', columns=['team_name', 'day'],
+                           where='digest IS NULL', database=database)
+    if legacy:
+        mantra_batch(days=sorted({day for _, day in legacy}),
+                     teams=sorted({tm for tm, _ in legacy}), workers=workers,
+                     verbose=verbose, database=database)
+
+    return len(legacy)
+
+
+def refresh_roles(database: str = cfg.dbase1) -> None:
+
+    """
+    Reload the roles of 'database'. To be called whenever the 'roles' table
+    changes.
+    """
+
+    if database in _ROLES:
+        del _ROLES[database]
+        get_roles(database)
+
+
+def remove_attackers_from_scheme(all_roles: np.array, pc_in_field: int,
+                                 a_in_field: int) -> list:
+
+    res = []
+    for opt in all_roles:
+        opt = list(opt)
+        pc_copy = pc_in_field
+        a_copy = a_in_field
+
+        # First remove Pc
+        if count_roles(which_roles=['A/Pc'], list_of_roles=opt):
+            for _ in range(pc_in_field):
+                opt.remove('A/Pc')
+                pc_copy -= 1
+        # Pc can not be adapted to other roles so they don't fit in the
+        # scheme option, option is not valid
+        if pc_copy:
+            continue
+
+        # Then remove A: first look for A/Pc
+        n = count_roles(which_roles=['A/Pc'], list_of_roles=opt)
+        for _ in range(n):
+            opt.remove('A/Pc')
+            a_copy -= 1
+
+        # Pure A
+        n = count_roles(which_roles=['A'], list_of_roles=opt)
+        for _ in range(n):
+            opt.remove('A')
+            a_copy -= 1
+
+        # Finally W/A and T/A since they are never together
+        if a_copy and a_copy <= count_roles(['W/A', 'T/A'], opt):
+            a = [rl for rl in opt if 'A' in rl][:a_copy]
+            for rl in a:
+                opt.remove(rl)
+                a_copy -= 1
+        if a_copy:
+            continue
+
+        res.append(opt)
+
+    return res
 
 
 def roles2matrix(players_needed: int, list_of_roles: list, scheme_used: str,
@@ -367,10 +1204,15 @@ def roles2matrix(players_needed: int, list_of_roles: list, scheme_used: str,
 
     # Create valid options
     perms = []
+    stats = Counter()
     for opt in split:
         rec_cart(start=0, list_of_roles=opt, partial=[], results=perms,
                  players_needed=players_needed, scheme_used=scheme_used,
-                 some_counter=field_counter, used_counters=[])
+                 some_counter=field_counter, used_keys=set(), stats=stats)
+
+    if cfg.MANTRA_STATS:
+        print(f'rec_cart: {stats["visited"]} nodes visited, '
+              f'{stats["pruned"]} pruned, {stats["duplicates"]} duplicates')
 
     # Map into ids
     roles2id = [RL_MAP[rl] for c in perms for rl in c]
@@ -378,125 +1220,91 @@ def roles2matrix(players_needed: int, list_of_roles: list, scheme_used: str,
     return np.sort(id_array, axis=1)
 
 
-def scheme_matrix_and_nrepeat(players_needed: int, scheme_used: str,
-                              field_counter: Counter, is_adapted: bool,
-                              counting_malus: bool, number_of_a: int,
-                              number_of_pc: int) -> tuple:
-
-    def adapt_roles(scheme: str, list_of_roles: list) -> list:
-
-        original = split_roles(list_of_options=list_of_roles, by='/')
-        options_per_role = dict(dbf.db_select(table='malus',
-                                              columns=['role', 'malus'],
-                                              where=''))
-        options_per_role = {k: v.split(';') for k, v in
-                            options_per_role.items()}
-
-        special_schemes = ['4-1-4-1']
-        if scheme not in special_schemes:
-            options_per_role['T'] = options_per_role['T1']
-            options_per_role['W'].remove('T1')
-        else:
-            options_per_role['T'] = options_per_role['T2']
-            options_per_role['W'].remove('T')
-            options_per_role['W'].remove('T1')
-        del options_per_role['T1'], options_per_role['T2']
-
-        adapted = []
-        for orig in original:
-            opt = []
-            for el in orig:
-                tmp = [el] + [options_per_role[rl] for rl in el]
-                res = list(set([rl for ls in tmp for rl in ls]))
-                opt.append('/'.join(res))
-            adapted.append(opt)
-        return adapted
-
-    def remove_attackers_from_scheme(all_roles: np.array,
-                                     pc_in_field: int,
-                                     a_in_field: int) -> list:
-
-        res = []
-        for opt in all_roles:
-            opt = list(opt)
-            pc_copy = pc_in_field
-            a_copy = a_in_field
-
-            # First remove Pc
-            if count_roles(which_roles=['A/Pc'], list_of_roles=opt):
-                for _ in range(pc_in_field):
-                    opt.remove('A/Pc')
-                    pc_copy -= 1
-            # Pc can not be adapted to other roles so they don't fit in the
-            # scheme option, option is not valid
-            if pc_copy:
-                continue
-
-            # Then remove A: first look for A/Pc
-            n = count_roles(which_roles=['A/Pc'], list_of_roles=opt)
-            for _ in range(n):
-                opt.remove('A/Pc')
-                a_copy -= 1
-
-            # Pure A
-            n = count_roles(which_roles=['A'], list_of_roles=opt)
-            for _ in range(n):
-                opt.remove('A')
-                a_copy -= 1
-
-            # Finally W/A and T/A since they are never together
-            if a_copy and a_copy <= count_roles(['W/A', 'T/A'], opt):
-                a = [rl for rl in opt if 'A' in rl][:a_copy]
-                for rl in a:
-                    opt.remove(rl)
-                    a_copy -= 1
-            if a_copy:
-                continue
+def roles_fit_scheme(players: list, slots: list, players_needed: int,
+                     scheme_used: str) -> bool:
 
-            res.append(opt)
+    """
+    Return True if the players, each one a set of roles, can be assigned to
+    the positions in 'slots', also sets of roles, with a valid number of
+    attackers and defenders.
+    """
+
+    if len(players) != len(slots):
+        return False
+
+    # Roles of each player grouped by type and the positions they can take
+    positions = []
+    for pl in players:
+        by_type = {}
+        for rl in pl:
+            by_type.setdefault(ROLE_TYPES.get(rl, 'other'), set()).add(rl)
+        positions.append({tp: [j for j, slot in enumerate(slots)
+                               if roles & slot]
+                          for tp, roles in by_type.items()})
+
+    for choice in itertools.product(*[sorted(pos) for pos in positions]):
+        n = Counter(choice)
+        if not valid_role_counts(n_pc=n['Pc'], n_a=n['A'], n_t=n['T'],
+                                 n_def=n['D'], players_needed=players_needed,
+                                 scheme_used=scheme_used):
+            continue
 
-        return res
+        if perfect_matching([pos[tp] for pos, tp in zip(positions, choice)]):
+            return True
 
-    roles_in_scheme = dbf.db_select(
-            table='schemes_details',
-            columns=['details'],
-            where=f'scheme = "{scheme_used}"')[0].split(', ')[1:]
+    return False
 
-    # To handle the case when lineup has less than 11 players we need to create
-    # all the combinations of the original lineup. Most of the times all
-    # players will play so there will be only 1 combination
-    roles_in_scheme = list(itertools.combinations(roles_in_scheme,
-                                                  players_needed))
-    roles_in_scheme = [sorted(list(t)) for t in roles_in_scheme]
-    roles_in_scheme = np.unique(np.array(roles_in_scheme), axis=0)
 
-    if is_adapted:
-        roles_in_scheme = remove_attackers_from_scheme(
-                all_roles=roles_in_scheme, pc_in_field=number_of_pc,
-                a_in_field=number_of_a)
+def save_mantra_lineup(day: int, fantateam: str, digest: str, names: list,
+                       roles: dict, scheme: str, malus: int,
+                       database: str = cfg.dbase1) -> None:
 
-        if not roles_in_scheme:
-            # It means scheme is not valid
-            return np.array([]), 0
+    where = {'team_name': fantateam, 'day': day}
+    with dbf.transaction(database):
+        dbf.db_delete(table='mantra_cache_players', where=where,
+                      database=database)
+        dbf.db_insert_many(
+                table='mantra_cache',
+                columns=['team_name', 'day', 'digest', 'scheme', 'malus'],
+                rows=[(fantateam, day, digest, scheme, malus)],
+                database=database, conflict='REPLACE')
+        dbf.db_insert_many(
+                table='mantra_cache_players',
+                columns=['team_name', 'day', 'position', 'name', 'role'],
+                rows=[(fantateam, day, i, nm, roles.get(nm))
+                      for i, nm in enumerate(names)],
+                database=database)
 
-        # When we count malus this adaptation must be skipped
-        if not counting_malus:
-            roles_in_scheme = adapt_roles(scheme=scheme_used,
-                                          list_of_roles=roles_in_scheme)
 
-    id_arr = roles2matrix(players_needed=players_needed,
-                          list_of_roles=roles_in_scheme,
-                          scheme_used=scheme_used,
-                          field_counter=field_counter)
+def scheme_matrix_and_nrepeat(players_needed: int, scheme_used: str,
+                              field_counter: Counter, is_adapted: bool,
+                              counting_malus: bool, number_of_a: int,
+                              number_of_pc: int,
+                              database: str = cfg.dbase1) -> tuple:
+
+    id_arr, counts = get_scheme_catalog(database).matrix(
+            scheme=scheme_used, players_needed=players_needed,
+            is_adapted=is_adapted, counting_malus=counting_malus,
+            number_of_a=number_of_a, number_of_pc=number_of_pc)
+
+    if is_adapted and not len(id_arr):
+        # It means scheme is not valid
+        return np.array([]), 0
+
+    id_arr = filter_role_matrix(id_arr=id_arr, counts=counts,
+                                players_needed=players_needed,
+                                scheme_used=scheme_used,
+                                field_counter=field_counter)
     return id_arr, id_arr.shape[0]
 
 
-def select_lineup(day, fantateam):
+def select_lineup(day, fantateam, lineup: str = None,
+                  database: str = cfg.dbase1):
 
-    lineup = dbf.db_select(
-            table='lineups',
-            columns=[f'day_{day}'],
-            where=f'team_name = "{fantateam}"')[0].split(', ')
+    if lineup is None:
+        lineup = sf.lineups([fantateam], [day], database)[(fantateam, day)]
+    else:
+        lineup = lineup.split(', ')
 
     field = lineup[:11]
     bench = lineup[11:]
@@ -506,32 +1314,42 @@ def select_lineup(day, fantateam):
 
 def solution_exists(players_needed: int, scheme_used: str,
                     roles_in_lineup: list, field_counter: Counter,
-                    is_adapted: bool, number_of_a=0, number_of_pc=0):
-
-    lineup_mtx, n_tiles = lineup_matrix_and_ntiles(
-            players_needed=players_needed, roles_in_lineup=roles_in_lineup,
-            scheme_used=scheme_used, field_counter=field_counter)
-
-    scheme_mtx, n_repeat = scheme_matrix_and_nrepeat(
-            players_needed=players_needed, scheme_used=scheme_used,
-            field_counter=field_counter, is_adapted=is_adapted,
-            counting_malus=False, number_of_a=number_of_a,
-            number_of_pc=number_of_pc)
-
-    # This check is only needed for adapted solutions
-    if is_adapted and not scheme_mtx.sum():
-        return np.array([]), np.array([])
-
-    lineup_mtx_full = np.repeat(lineup_mtx, n_repeat, axis=0)
-    scheme_mtx_full = np.tile(scheme_mtx, (n_tiles, 1))
-
-    all_res = (lineup_mtx_full == scheme_mtx_full).all(axis=1)
-
-    if not is_adapted:
-        return all_res.any()
+                    is_adapted: bool, number_of_a=0, number_of_pc=0,
+                    database: str = cfg.dbase1):
+
+    """
+    Check whether the lineup fits the scheme with the solver selected by
+    cfg.MANTRA_SOLVER. If not adapted return a bool, else the lineup options
+    which fit and the mask to select them.
+    With cfg.MANTRA_CROSS_CHECK both solvers are run and an AssertionError
+    is raised if they disagree.
+    """
+
+    def fitting_lineups(result: tuple) -> set:
+        lineups, mask = result
+        return {tuple(row) for row in lineups[mask]} if mask.size else set()
+
+    solvers = {'matching': matching_solution_exists,
+               'matrix': matrix_solution_exists}
+
+    args = dict(players_needed=players_needed, scheme_used=scheme_used,
+                roles_in_lineup=roles_in_lineup, field_counter=field_counter,
+                is_adapted=is_adapted, number_of_a=number_of_a,
+                number_of_pc=number_of_pc, database=database)
+    res = solvers[cfg.MANTRA_SOLVER](**args)
+
+    if cfg.MANTRA_CROSS_CHECK:
+        other = [slv for slv in solvers if slv != cfg.MANTRA_SOLVER][0]
+        res_other = solvers[other](**args)
+        if is_adapted:
+            agree = fitting_lineups(res) == fitting_lineups(res_other)
+        else:
+            agree = res == res_other
+        if not agree:
+            raise AssertionError(f'Mantra solvers disagree on {scheme_used} '
+                                 f'with {roles_in_lineup[0]}')
 
-    return ((lineup_mtx_full, all_res) if all_res.any() else
-            (np.array([]), np.array([])))
+    return res
 
 
 def split_roles(list_of_options: list, by: str) -> list:
@@ -560,5 +1378,33 @@ def too_many_attackers(list_of_roles: list) -> bool:
     return True if (cond1 | cond2 | cond3 | cond4) else False
 
 
+def valid_role_counts(n_pc, n_a, n_t, n_def, players_needed: int,
+                      scheme_used: str):
+
+    """
+    Conditions checked by rec_cart() on a complete option: not too many
+    attackers (see too_many_attackers(), 3 or more Pc are never valid since
+    they are checked while options are built) and enough defenders (see
+    enough_defenders()). Counts can be numbers or arrays.
+    """
+
+    too_many = ((n_pc >= 3) | ((n_pc == 2) & (n_a > 0)) |
+                ((n_pc == 2) & (n_t > 1)) | (n_pc + n_a > 3))
+
+    missing_players = 10 - players_needed
+    min_def = (int(scheme_used[0]) if scheme_used else 3) - missing_players
+
+    return np.logical_not(too_many) & (n_def >= min_def)
+
+
 RL_MAP = {'Dc': 1, 'Dd': 2, 'Ds': 3, 'E': 4, 'M': 5, 'C': 6,
           'W': 7, 'T': 8, 'A': 9, 'Pc': 10}
+
+# Types of roles which matter for the constraints on attackers and defenders
+ROLE_TYPES = {'Dc': 'D', 'Dd': 'D', 'Ds': 'D', 'A': 'A', 'Pc': 'Pc', 'T': 'T'}
+
+
+if __name__ == '__main__':
+    # Calculate again all the lineups of the season, Ex. after changing the
+    # solver
+    mantra_batch()
@@ -0,0 +1,319 @@
+import numpy as np
+import pandas as pd
+import archive as ar
+import db_functions as dbf
+import calendar_functions as cf
+import mantra_functions as mf
+import season_functions as sf
+import standings as st
+import vote_store as vs
+import config as cfg
+
+
+HALF_POINTS = ('keep', 'up', 'down')
+
+# SeasonData of each season, see get_season_data()
+_SEASONS = {}
+
+
+class Scenario(object):
+
+    def __init__(self, name, goal_threshold=cfg.GOAL_THRESHOLD,
+                 goal_step=cfg.GOAL_STEP, half_points='keep',
+                 bonus_weights=None, malus_weights=None, captain=True,
+                 rfactor=True):
+
+        """
+        A set of rules to play a season with. Defaults are the current ones.
+
+        :param name: str
+        :param goal_threshold: float, absolute points needed for the first
+                               goal
+        :param goal_step: float, absolute points needed for each other goal
+        :param half_points: str, 'keep' to convert the absolute points into
+                            goals as they are, 'up' or 'down' to round the
+                            half points first
+        :param bonus_weights: list, weights of vs.BONUS_FEATURES
+        :param malus_weights: list, weights of vs.MALUS_FEATURES
+        :param captain: bool or dict, Ex. {6.5: .5, 'sv': 0, ...}. True
+                        means the table of the season, False no captain
+        :param rfactor: bool or dict, Ex. {11: 5, 10: 3, ...} where keys are
+                        the players with vote >= 6, as 'captain'
+
+        """
+
+        if half_points not in HALF_POINTS:
+            raise ValueError(f'half_points must be one of {HALF_POINTS}')
+
+        self.name = name
+        self.goal_threshold = goal_threshold
+        self.goal_step = goal_step
+        self.half_points = half_points
+        self.bonus_weights = list(vs.BONUS_WEIGHTS if bonus_weights is None
+                                  else bonus_weights)
+        self.malus_weights = list(vs.MALUS_WEIGHTS if malus_weights is None
+                                  else malus_weights)
+        self.captain = captain
+        self.rfactor = rfactor
+
+
+class SeasonData(object):
+
+    def __init__(self, database=cfg.dbase1, name=None):
+
+        """
+        All the data of the season in 'database' needed to play it with any
+        Scenario, loaded once as arrays with one row for each team and one
+        column for each day played: votes and bonus/malus features of the
+        players in the lineups, malus of the lineups, vote of the captain
+        and schedule. Each scenario is then just arithmetic on these arrays.
+
+        :param database: str
+        :param name: str, 'database' if None
+
+        """
+
+        self.database = database
+        self.name = name or database
+        self.teams = st.load_teams(database)
+        self.n_days = st.complete_days(st.load_abs_points(self.teams,
+                                                          database))
+        self.schedule = cf.rounds_to_array(
+                [st.load_schedule(self.n_days, database)], self.teams)[0]
+
+        self.captain_details = dict(dbf.db_select(
+                table='captain_details', columns=['*'], where='',
+                database=database))
+        self.rfactor_details = dict(dbf.db_select(
+                table='rfactor_details', columns=['*'], where='',
+                database=database))
+
+        n_features = len(vs.BONUS_FEATURES) + len(vs.MALUS_FEATURES)
+        shape = (len(self.teams), self.n_days, 11)
+        self.votes = np.full(shape, np.nan)
+        self.features = np.zeros(shape + (n_features, ))
+        self.malus = np.zeros(shape[:2])
+        self.captain_vote = np.full(shape[:2], np.nan)
+        self.full_lineup = np.zeros(shape[:2], dtype=bool)
+
+        self.load()
+
+    def load(self):
+
+        """
+        Fill the arrays, see __init__().
+
+        :return: nothing
+
+        """
+
+        store = vs.get_vote_store(self.database)
+        lineups = self.load_lineups()
+        captains = self.load_captains()
+
+        for t, tm in enumerate(self.teams):
+            for d, day in enumerate(range(1, self.n_days + 1)):
+                names, malus = lineups[(tm, day)]
+                ids = [store.player_id[nm] for nm in names]
+                self.votes[t, d, :len(ids)] = store.vote[ids, day]
+                self.features[t, d, :len(ids)] = store.features[ids, day]
+                self.malus[t, d] = malus
+                self.full_lineup[t, d] = len(names) == 11
+
+                # Captain if in the lineup, else vice
+                for nm in captains.get((tm, day), ()):
+                    if nm in names:
+                        self.captain_vote[t, d] = store.vote[
+                                store.player_id[nm], day]
+                        break
+
+    def load_captains(self) -> dict:
+
+        """
+        Return {(team, day): (captain, vice)} with a single query.
+        """
+
+        return sf.captains(self.teams, range(1, self.n_days + 1),
+                           self.database)
+
+    def load_lineups(self) -> dict:
+
+        """
+        Return {(team, day): (names, malus)} of the lineups calculated by
+        mantra. For the main database they are taken from the mantra cache,
+        checking their digest. Data of the archived seasons do not change
+        anymore, so their lineups are read in bulk from the 'mantra_cache'
+        tables and only the missing ones are calculated.
+        """
+
+        pairs = [(tm, day) for tm in self.teams
+                 for day in range(1, self.n_days + 1)]
+
+        if self.database == cfg.dbase1:
+            lineups = mf.cached_mantra_batch(range(1, self.n_days + 1),
+                                             self.teams)
+            return {pair: lineups[pair][::2] for pair in pairs}
+
+        malus = {(tm, day): ml for tm, day, ml in dbf.db_select(
+                table='mantra_cache', columns=['team_name', 'day', 'malus'],
+                where='', database=self.database)}
+        names = {}
+        for tm, day, _, nm in sorted(dbf.db_select(
+                table='mantra_cache_players',
+                columns=['team_name', 'day', 'position', 'name'],
+                where='', database=self.database)):
+            names.setdefault((tm, day), []).append(nm)
+
+        return {(tm, day): ((names.get((tm, day), []), malus[(tm, day)])
+                            if (tm, day) in malus else
+                            mf.cached_mantra(day, tm,
+                                             database=self.database)[::2])
+                for tm, day in pairs}
+
+    def abs_points(self, scenarios: list) -> np.array:
+
+        """
+        Return the absolute points of every team in every day with each of
+        the 'scenarios'.
+
+        :param scenarios: list of Scenario
+
+        :return: np.array, (scenarios, teams, days)
+
+        """
+
+        weights = np.array([sc.bonus_weights + [-w for w in sc.malus_weights]
+                            for sc in scenarios])
+
+        # Empty places in the lineups are NaN
+        fantavotes = self.votes[None] + np.einsum('tdpf,sf->stdp',
+                                                  self.features, weights)
+        points = np.nansum(fantavotes, axis=-1) - self.malus[None]
+
+        n_suff = (self.votes >= 6).sum(axis=-1).astype(float)
+        for s, sc in enumerate(scenarios):
+            if sc.captain is not False:
+                table = (self.captain_details if sc.captain is True
+                         else sc.captain)
+                points[s] += table_values(table, self.captain_vote)
+
+            # R-factor only applies to lineups of 11 players
+            if sc.rfactor is not False:
+                table = (self.rfactor_details if sc.rfactor is True
+                         else sc.rfactor)
+                points[s] += np.where(self.full_lineup,
+                                      table_values(table, n_suff), 0)
+
+        return points
+
+    def play(self, scenarios: list) -> dict:
+
+        """
+        Play the season with all the 'scenarios' in a single batch.
+
+        :param scenarios: list of Scenario
+
+        :return: dict, see cf.simulate_leagues(), one league for each
+                 scenario, plus 'positions', (scenarios, teams), 0 is the
+                 first position
+
+        """
+
+        abs_points = self.abs_points(scenarios)
+
+        rounded = abs_points.copy()
+        for s, sc in enumerate(scenarios):
+            if sc.half_points == 'up':
+                rounded[s] = np.ceil(rounded[s])
+            elif sc.half_points == 'down':
+                rounded[s] = np.floor(rounded[s])
+
+        threshold = np.array([sc.goal_threshold for sc in scenarios])
+        step = np.array([sc.goal_step for sc in scenarios])
+        goals = cf.goals_from_abs_points(rounded, threshold[:, None, None],
+                                         step[:, None, None])
+
+        schedules = np.broadcast_to(self.schedule,
+                                    (len(scenarios), ) + self.schedule.shape)
+        res = cf.simulate_leagues(abs_points, schedules, goals)
+        res['positions'] = np.argsort(res['ranking'], axis=1)
+
+        return res
+
+
+def evaluate(scenarios: list, seasons: list) -> pd.DataFrame:
+
+    """
+    Play every season with every scenario. Deltas are relative to the first
+    scenario, which is usually the one with the current rules.
+
+    :param scenarios: list of Scenario
+    :param seasons: list of SeasonData or of seasons, Ex. ['2019-20', ...],
+                    see get_season_data()
+
+    :return: pd.DataFrame, one row for each (season, scenario, team) with
+             columns 'Pos' (starting from 1), 'Pt', 'G+', 'G-', 'Tot Pt',
+             'Delta Pt' and 'Delta Pos'
+
+    """
+
+    frames = []
+    for season in seasons:
+        if not isinstance(season, SeasonData):
+            season = get_season_data(season)
+        res = season.play(scenarios)
+        tot_points = np.round(res['tot_points'], 1)
+        for s, sc in enumerate(scenarios):
+            df = pd.DataFrame(
+                    {'Pos': res['positions'][s] + 1,
+                     'Pt': res['points'][s],
+                     'G+': res['goals_scored'][s],
+                     'G-': res['goals_taken'][s],
+                     'Tot Pt': tot_points[s],
+                     'Delta Pt': res['points'][s] - res['points'][0],
+                     'Delta Pos': (res['positions'][0] -
+                                   res['positions'][s])},
+                    index=season.teams)
+            frames.append(pd.concat({(season.name, sc.name): df},
+                                    names=['Stagione', 'Scenario', 'Team']))
+
+    return pd.concat(frames)
+
+
+def get_season_data(season: str = cfg.YEAR) -> SeasonData:
+
+    """
+    Return the SeasonData of 'season', loading it the first time. See
+    ar.available_seasons().
+    """
+
+    if season not in _SEASONS:
+        _SEASONS[season] = SeasonData(ar.season_database(season), season)
+    return _SEASONS[season]
+
+
+def refresh_season_data(season: str = cfg.YEAR) -> None:
+
+    """
+    Reload the SeasonData of 'season'. To be called whenever its lineups,
+    votes or points change.
+    """
+
+    if season in _SEASONS:
+        del _SEASONS[season]
+        get_season_data(season)
+
+
+def table_values(table: dict, keys: np.array) -> np.array:
+
+    """
+    Return the values of 'table' for each element of 'keys', NaN keys are
+    'sv'. Keys missing in the table are worth 0.
+    """
+
+    res = np.zeros(keys.shape)
+    res[np.isnan(keys)] = table.get('sv', 0)
+    for key in np.unique(keys[~np.isnan(keys)]):
+        res[keys == key] = table.get(float(key), 0)
+
+    return res
@@ -0,0 +1,237 @@
+import db_functions as dbf
+import config as cfg
+
+
+# Long tables with the players of each team in each day, in order, and the
+# name of their team column. 'lineups', 'all_players' and
+# 'all_players_serie_a' are views on them, see db_migrations
+PLAYER_TABLES = {'lineups': ('lineup_players', 'team_name'),
+                 'rosters': ('roster_players', 'team_name'),
+                 'serie_a_rosters': ('serie_a_players', 'team')}
+
+
+def _load_players(kind: str, teams: list, days, database: str) -> dict:
+
+    """
+    Return {(team, day): [names in order]} from the table of 'kind', see
+    PLAYER_TABLES.
+    """
+
+    table, key = PLAYER_TABLES[kind]
+    where, params = _where(key, teams, days)
+    rows = dbf.db_select(table=table, columns=[key, 'day', 'slot', 'name'],
+                         where=where, params=params, database=database)
+
+    players = {}
+    for tm, day, _, nm in sorted(rows):
+        players.setdefault((tm, day), []).append(nm)
+
+    return players
+
+
+def _load_team_days(columns: list, teams: list, days,
+                    database: str) -> dict:
+
+    """
+    Return {(team, day): value} of 'columns' of 'team_days', a tuple if more
+    than one. Rows where the first column is NULL are not included.
+    """
+
+    where, params = _where('team_name', teams, days)
+    conditions = [where] if where else []
+    where = ' AND '.join(conditions + [f'{columns[0]} IS NOT NULL'])
+    rows = dbf.db_select(table='team_days',
+                         columns=['team_name', 'day'] + columns,
+                         where=where, params=params, database=database)
+
+    if len(columns) == 1:
+        return {(tm, day): value for tm, day, value in rows}
+    return {(tm, day): tuple(values) for tm, day, *values in rows}
+
+
+def _save_players(kind: str, team: str, day: int, names: list,
+                  database: str) -> None:
+
+    """
+    Replace the players of 'team' in 'day' in the table of 'kind'.
+    """
+
+    table, key = PLAYER_TABLES[kind]
+    with dbf.transaction(database):
+        dbf.db_delete(table=table, where={key: team, 'day': day},
+                      database=database)
+        dbf.db_insert_many(table=table, columns=[key, 'day', 'slot', 'name'],
+                           rows=[(team, day, slot, nm)
+                                 for slot, nm in enumerate(names)],
+                           database=database)
+
+
+def _save_team_day(team: str, day: int, columns: list, values: list,
+                   database: str) -> None:
+
+    """
+    Set 'columns' of the row of 'team' in 'day', creating it if needed.
+    """
+
+    with dbf.transaction(database):
+        dbf.db_insert_many(table='team_days', columns=['team_name', 'day'],
+                           rows=[(team, day)], database=database,
+                           conflict='IGNORE')
+        dbf.db_update(table='team_days', columns=columns, values=values,
+                      where={'team_name': team, 'day': day},
+                      database=database)
+
+
+def _where(key: str, teams: list, days) -> (str, tuple):
+
+    """
+    Return the WHERE clause and its params to select 'teams' in 'days'. None
+    means all of them. A range of consecutive days becomes a BETWEEN, so the
+    index on the days is used.
+    """
+
+    conditions = []
+    params = []
+    if teams is not None:
+        conditions.append(f'{key} IN ({", ".join(["?"] * len(teams))})')
+        params += list(teams)
+
+    if isinstance(days, range) and days.step == 1:
+        conditions.append('day BETWEEN ? AND ?')
+        params += [days.start, days.stop - 1]
+    elif days is not None:
+        conditions.append(f'day IN ({", ".join(["?"] * len(days))})')
+        params += list(days)
+
+    return ' AND '.join(conditions), tuple(params)
+
+
+def abs_points(teams: list = None, days=None,
+               database: str = cfg.dbase1) -> dict:
+
+    """
+    Return {(team, day): absolute points}. Days not played yet are missing.
+
+    :param teams: list, all if None
+    :param days: list or range, all if None
+    :param database: str
+
+    :return: dict, Ex. {('Ciolle United', 1): 67.5, ...}
+
+    """
+
+    return _load_team_days(['abs_points'], teams, days, database)
+
+
+def captains(teams: list = None, days=None,
+             database: str = cfg.dbase1) -> dict:
+
+    """
+    Return {(team, day): (captain, vice)}, see abs_points().
+    """
+
+    return _load_team_days(['captain', 'vice'], teams, days, database)
+
+
+def last_day_played(database: str = cfg.dbase1) -> int:
+
+    """
+    Return the number of consecutive days, from the first one, where the
+    absolute points of all the teams are saved.
+    """
+
+    n_teams = len(dbf.db_select(table='teams', columns=['team_name'],
+                                where='', database=database))
+    days = dbf.db_select(
+            table='team_days', columns=['day'],
+            where=('abs_points IS NOT NULL GROUP BY day '
+                   'HAVING COUNT(*) = ? ORDER BY day'),
+            params=(n_teams, ), database=database)
+
+    last_day = 0
+    for day in days:
+        if day != last_day + 1:
+            break
+        last_day = day
+
+    return last_day
+
+
+def lineups(teams: list = None, days=None,
+            database: str = cfg.dbase1) -> dict:
+
+    """
+    Return {(team, day): [names]} of the lineups, regular players first and
+    then the bench in order, see abs_points().
+    """
+
+    return _load_players('lineups', teams, days, database)
+
+
+def rosters(teams: list = None, days=None,
+            database: str = cfg.dbase1) -> dict:
+
+    """
+    Return {(team, day): [names]} of the complete set of players of each
+    fantateam, see abs_points().
+    """
+
+    return _load_players('rosters', teams, days, database)
+
+
+def save_abs_points(team: str, day: int, points: float,
+                    database: str = cfg.dbase1) -> None:
+    _save_team_day(team, day, ['abs_points'], [points], database)
+
+
+def save_captains(team: str, day: int, captain: str, vice: str,
+                  database: str = cfg.dbase1) -> None:
+    _save_team_day(team, day, ['captain', 'vice'], [captain, vice], database)
+
+
+def save_lineup(team: str, day: int, names: list,
+                database: str = cfg.dbase1) -> None:
+    _save_players('lineups', team, day, names, database)
+
+
+def save_roster(team: str, day: int, names: list,
+                database: str = cfg.dbase1) -> None:
+    _save_players('rosters', team, day, names, database)
+
+
+def save_scheme(team: str, day: int, scheme: str,
+                database: str = cfg.dbase1) -> None:
+    _save_team_day(team, day, ['scheme'], [scheme], database)
+
+
+def save_serie_a_roster(team: str, day: int, names: list,
+                        database: str = cfg.dbase1) -> None:
+    _save_players('serie_a_rosters', team, day, names, database)
+
+
+def schemes(teams: list = None, days=None,
+            database: str = cfg.dbase1) -> dict:
+
+    """
+    Return {(team, day): scheme}, Ex. {('Ciolle United', 1): '3-4-3', ...},
+    see abs_points().
+    """
+
+    return _load_team_days(['scheme'], teams, days, database)
+
+
+def serie_a_roster(team: str, day: int, database: str = cfg.dbase1) -> list:
+
+    """
+    Return the players of the Serie A 'team' as saved in 'day' or, if not
+    scraped that day, in the last day before it. Empty if there is none.
+    """
+
+    last = dbf.db_select(table='serie_a_players', columns=['MAX(day)'],
+                         where='team = ? AND day <= ?', params=(team, day),
+                         database=database)
+    if not last:
+        return []
+
+    return _load_players('serie_a_rosters', [team], [last[0]],
+                         database)[(team, last[0])]
@@ -0,0 +1,275 @@
+import numpy as np
+import pandas as pd
+import db_functions as dbf
+import calendar_functions as cf
+import extra_functions as ef
+import season_functions as sf
+import tiebreak as tb
+import config as cfg
+
+
+# Columns of the snapshots, same as the 'classifica' table
+COLUMNS = ['G', 'V', 'N', 'P', 'Gf', 'Gs', 'Dr', 'Pt', 'Tot']
+COL = {col: i for i, col in enumerate(COLUMNS)}
+
+
+class Standings(object):
+
+    def __init__(self, teams: list, day: int = 0):
+
+        """
+        Cumulative state of the real league after 'day': one row of 'stats'
+        for each team, with the same columns of 'classifica', and the points
+        each team has gained against each of the others in 'h2h', used to
+        sort the teams with the same points.
+
+        :param teams: list, Ex. ['Ciolle United', 'FC STRESS', ...]
+        :param day: int
+
+        """
+
+        self.teams = list(teams)
+        self.team_id = {tm: i for i, tm in enumerate(self.teams)}
+        self.day = day
+        self.stats = np.zeros((len(self.teams), len(COLUMNS)))
+        self.h2h = np.zeros((len(self.teams), len(self.teams)), dtype=int)
+
+    def apply_day(self, matches: list, abs_points: dict) -> None:
+
+        """
+        Add the results of the next day.
+
+        :param matches: list, Ex. [('Ciolle United', 'FC STRESS'), ...]
+        :param abs_points: dict, Ex. {'Ciolle United': 67.5, ...}
+
+        :return: nothing
+
+        """
+
+        for team1, team2 in matches:
+            i, j = self.team_id[team1], self.team_id[team2]
+            goals1 = int(cf.goals_from_abs_points(abs_points[team1]))
+            goals2 = int(cf.goals_from_abs_points(abs_points[team2]))
+
+            for idx, opp, pts, gf, gs in ((i, j, abs_points[team1],
+                                           goals1, goals2),
+                                          (j, i, abs_points[team2],
+                                           goals2, goals1)):
+                result = 'V' if gf > gs else 'N' if gf == gs else 'P'
+                points = {'V': 3, 'N': 1, 'P': 0}[result]
+
+                self.stats[idx, COL['G']] += 1
+                self.stats[idx, COL[result]] += 1
+                self.stats[idx, COL['Gf']] += gf
+                self.stats[idx, COL['Gs']] += gs
+                self.stats[idx, COL['Dr']] += gf - gs
+                self.stats[idx, COL['Pt']] += points
+                self.stats[idx, COL['Tot']] += pts
+                self.h2h[idx, opp] += points
+
+        self.day += 1
+
+    def positions(self) -> np.array:
+
+        """
+        Return the position of each team, starting from 1, sorting them as
+        League.create_ranking() does.
+
+        :return: np.array
+
+        """
+
+        col = self.stats.T
+        stats = {'G+': col[COL['Gf']], 'G-': col[COL['Gs']],
+                 'Tot Pt': col[COL['Tot']]}
+        stats.update({c: col[COL[c]] for c in ('V', 'N', 'P', 'Dr', 'Pt')})
+        order = tb.rank_teams(stats, self.h2h)
+
+        positions = np.empty(len(order), dtype=int)
+        positions[order] = np.arange(1, len(order) + 1)
+        return positions
+
+
+def complete_days(abs_points: dict) -> int:
+
+    """
+    Return the number of consecutive days, from the first one, where the
+    absolute points of all the teams are known.
+    """
+
+    days = 0
+    for points in zip(*abs_points.values()):
+        if None in points:
+            break
+        days += 1
+    return days
+
+
+def last_snapshot(database: str = cfg.dbase1) -> int:
+
+    """
+    Return the last day with a snapshot saved, 0 if there is none.
+    """
+
+    day = dbf.db_select(table='standings', columns=['MAX(day)'], where='',
+                        database=database)
+    return day[0] if day else 0
+
+
+def load_abs_points(teams: list, database: str = cfg.dbase1) -> dict:
+
+    """
+    Return {team: [abs_points day by day]} with a single query. Days not
+    played yet are None.
+    """
+
+    points = sf.abs_points(teams, database=database)
+    return {tm: [points.get((tm, day)) for day in
+                 range(1, cfg.SEASON_DAYS + 1)] for tm in teams}
+
+
+def load_schedule(n_days: int, database: str = cfg.dbase1) -> list:
+
+    """
+    Return the real schedule as a list of days, each one a list of tuples,
+    Ex. [[('Ciolle United', 'FC STRESS'), ...], ...]
+    """
+
+    teams = load_teams(database)
+    a_round = [dbf.db_select(table='round', columns=[f'day_{i}'], where='',
+                             database=database)
+               for i in range(1, len(teams))]
+    a_round = [[tuple(match.split(' - ')) for match in day]
+               for day in a_round]
+
+    return ef.generate_schedule(a_round, n_days)
+
+
+def load_standings(day: int, database: str = cfg.dbase1) -> Standings:
+
+    """
+    Return the Standings after 'day' as saved in the snapshots, an empty one
+    if 'day' is 0.
+    """
+
+    standings = Standings(load_teams(database), day)
+    if not day:
+        return standings
+
+    rows = dbf.db_select(table='standings', columns=['team_name'] + COLUMNS,
+                         where={'day': day}, database=database)
+    if len(rows) != len(standings.teams):
+        raise ValueError(f'Classifica della giornata {day} non salvata')
+
+    for tm, *stats in rows:
+        standings.stats[standings.team_id[tm]] = stats
+
+    rows = dbf.db_select(table='standings_h2h',
+                         columns=['team_name', 'opponent', 'points'],
+                         where={'day': day}, database=database)
+    for tm, opp, points in rows:
+        standings.h2h[standings.team_id[tm], standings.team_id[opp]] = points
+
+    return standings
+
+
+def load_teams(database: str = cfg.dbase1) -> list:
+    return dbf.db_select(table='teams', columns=['team_name'], where='',
+                         database=database)
+
+
+def save_standings(standings: Standings, database: str = cfg.dbase1) -> None:
+
+    """
+    Save the snapshot of 'standings', replacing the one of the same day.
+    """
+
+    positions = standings.positions()
+
+    with dbf.transaction(database):
+        dbf.db_insert_many(
+                table='standings',
+                columns=['day', 'team_name', 'position'] + COLUMNS,
+                rows=[(standings.day, tm, int(positions[i]),
+                       *standings.stats[i].tolist())
+                      for i, tm in enumerate(standings.teams)],
+                database=database, conflict='REPLACE')
+
+        dbf.db_insert_many(
+                table='standings_h2h',
+                columns=['day', 'team_name', 'opponent', 'points'],
+                rows=[(standings.day, tm, opp,
+                       int(standings.h2h[i, standings.team_id[opp]]))
+                      for i, tm in enumerate(standings.teams)
+                      for opp in standings.teams if opp != tm],
+                database=database, conflict='REPLACE')
+
+
+def standings_table(day: int = None, database: str = cfg.dbase1
+                    ) -> pd.DataFrame:
+
+    """
+    Return the table after 'day' (the last one saved if None) with a single
+    query, teams sorted by position. Columns are the ones of
+    League.create_ranking().
+    """
+
+    day = last_snapshot(database) if day is None else day
+    rows = dbf.db_select(
+            table='standings',
+            columns=['team_name'] + COLUMNS,
+            where='day = ? ORDER BY position', params=(day, ),
+            database=database)
+
+    cols = ['G', 'V', 'N', 'P', 'G+', 'G-', 'Dr', 'Pt', 'Tot Pt']
+    df = pd.DataFrame([stats for _, *stats in rows],
+                      index=[tm for tm, *_ in rows], columns=cols)
+    for col in cols[:-1]:
+        df[col] = df[col].astype(int)
+
+    return df
+
+
+def update_standings(from_day: int = None,
+                     database: str = cfg.dbase1) -> int:
+
+    """
+    Save the snapshots of the days played after the last one saved. Only
+    the new days are applied, starting from the state of the last snapshot.
+    If the points of a day already saved change, 'from_day' is the first
+    day to calculate again.
+
+    Return the last day saved.
+    """
+
+    last_saved = last_snapshot(database)
+    start = last_saved if from_day is None else min(from_day - 1, last_saved)
+
+    teams = load_teams(database)
+    abs_points = load_abs_points(teams, database)
+    last_day = complete_days(abs_points)
+    if last_day <= start:
+        return last_saved
+
+    schedule = load_schedule(last_day, database)
+    standings = load_standings(start, database)
+
+    with dbf.transaction(database):
+        # Snapshots after the last day complete are not valid anymore
+        dbf.db_delete(table='standings', where='day > ?', params=(last_day, ),
+                      database=database)
+        dbf.db_delete(table='standings_h2h', where='day > ?',
+                      params=(last_day, ), database=database)
+
+        for day in range(start + 1, last_day + 1):
+            standings.apply_day(schedule[day - 1],
+                                {tm: pts[day - 1]
+                                 for tm, pts in abs_points.items()})
+            save_standings(standings, database)
+
+    return last_day
+
+
+if __name__ == '__main__':
+    # Calculate again all the snapshots, from the first day
+    print(f'Classifica aggiornata alla giornata {update_standings(1)}')
@@ -0,0 +1,86 @@
+import numpy as np
+import config as cfg
+
+
+def h2h_matrix(opponents: np.array, points: np.array) -> np.array:
+
+    """
+    Return the points each team has gained against each of the others.
+
+    :param opponents: np.array, (..., days, teams), index of the opponent of
+                      each team in each day, see
+                      calendar_functions.opponents_matrix()
+    :param points: np.array, (..., days, teams), points of each team in each
+                   day
+
+    :return: np.array, (..., teams, teams), row i column j are the points of
+             team i against team j
+
+    """
+
+    *leading, n_days, n_teams = opponents.shape
+    n_leagues = int(np.prod(leading))
+
+    opponents = opponents.reshape(n_leagues, n_days, n_teams)
+    team_idx = np.arange(n_teams)[None, None, :]
+    league_idx = np.arange(n_leagues)[:, None, None]
+    cells = (league_idx * n_teams + team_idx) * n_teams + opponents
+
+    h2h = np.bincount(cells.ravel(), weights=points.ravel(),
+                      minlength=n_leagues * n_teams * n_teams)
+
+    return h2h.astype(int).reshape(*leading, n_teams, n_teams)
+
+
+def h2h_points(h2h: np.array, points: np.array) -> np.array:
+
+    """
+    Return the points each team has gained in the matches against the teams
+    with its same points (classifica avulsa).
+
+    :param h2h: np.array, (..., teams, teams), see h2h_matrix()
+    :param points: np.array, (..., teams)
+
+    :return: np.array, (..., teams)
+
+    """
+
+    same_points = points[..., :, None] == points[..., None, :]
+    return (h2h * same_points).sum(axis=-1)
+
+
+def rank_teams(stats: dict, h2h: np.array = None,
+               criteria: list = None) -> np.array:
+
+    """
+    Return the team indexes sorted by position with a single lexsort over
+    'criteria' (cfg.RANKING_CRITERIA if None). Each criterion is a key of
+    'stats', higher is better, or 'h2h' for the points in the matches
+    between the teams with the same 'Pt', see h2h_points(). Teams tied on
+    every criterion keep their order.
+
+    :param stats: dict, Ex. {'Pt': np.array, 'G+': np.array, ...} where each
+                  array is (..., teams) or (teams, ) if the same for all. It
+                  can already contain 'h2h'
+    :param h2h: np.array, (..., teams, teams), see h2h_matrix(). Only needed
+                if 'h2h' is a criterion and not in 'stats'
+    :param criteria: list, Ex. ['Pt', 'h2h', 'G+']
+
+    :return: np.array, (..., teams)
+
+    """
+
+    criteria = cfg.RANKING_CRITERIA if criteria is None else criteria
+    shape = np.broadcast_shapes(*[np.shape(stats[crit]) for crit in criteria
+                                  if crit != 'h2h'])
+
+    keys = []
+    for crit in criteria:
+        if crit == 'h2h' and 'h2h' not in stats:
+            key = h2h_points(h2h, np.broadcast_to(stats['Pt'], shape))
+        else:
+            key = stats[crit]
+        keys.append(-np.broadcast_to(key, shape))
+
+    # Last key is the primary one
+    return np.lexsort(keys[::-1], axis=-1)
@@ -1,6 +1,11 @@
 import os
 import time
 import db_functions as dbf
+import db_migrations as dbm
+import mantra_functions as mf
+import season_functions as sf
+import standings as st
+import vote_store as vs
 import config as cfg
 import pandas as pd
 from openpyxl import load_workbook
@@ -12,6 +17,10 @@ from selenium.webdriver.common.by import By
 from selenium import webdriver
 
 
+VOTES_COLUMNS = ['day', 'name', 'team', 'alvin', 'gf', 'gs', 'rp', 'rs', 'rf',
+                 'au', 'amm', 'esp', 'ass', 'regular', 'going_in', 'going_out']
+
+
 def add_6_politico_if_needed(day: int) -> None:
 
 	"""
@@ -21,7 +30,7 @@ def add_6_politico_if_needed(day: int) -> None:
 	teams_in_day = set(dbf.db_select(
 			table='votes',
 			columns=['team'],
-			where=f'day = {day}'))
+			where={'day': day}))
 	if len(teams_in_day) == 20:
 		return
 
@@ -30,32 +39,21 @@ def add_6_politico_if_needed(day: int) -> None:
 
 	votes_of_day = dbf.db_select(
 			table='votes',
-			columns=['day', 'name', 'team', 'alvin', 'gf',
-			         'gs', 'rp', 'rs', 'rf', 'au', 'amm', 'esp', 'ass',
-			         'regular', 'going_in', 'going_out'],
-			where=f'day = {day}')
+			columns=VOTES_COLUMNS,
+			where={'day': day})
 
 	for team in missing:
-		shortlist = dbf.db_select(
-				table='all_players_serie_a',
-				columns=[f'day_{day}'],
-				where=f'team = "{team}"')[0]
-		shortlist = shortlist.split(', ')
-
-		for nm in shortlist:
+		for nm in sf.serie_a_roster(team, day):
 			data = (day, nm, team, 6, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
 			votes_of_day.append(data)
 
 	votes_of_day.sort(key=lambda x: x[2])
-	dbf.db_delete(table='votes', where=f'day = {day}')
 
-	for row in votes_of_day:
-		dbf.db_insert(
-				table='votes',
-				columns=['day', 'name', 'team', 'alvin',
-				         'gf', 'gs', 'rp', 'rs', 'rf', 'au', 'amm',
-				         'esp', 'ass', 'regular', 'going_in', 'going_out'],
-				values=[value for value in row])
+	# Replace the whole day in one transaction
+	with dbf.transaction():
+		dbf.db_delete(table='votes', where={'day': day})
+		dbf.db_insert_many(table='votes', columns=VOTES_COLUMNS,
+		                   rows=votes_of_day)
 
 
 def close_popup(brow: webdriver) -> None:
@@ -92,7 +90,8 @@ def format_player_name(player_name: str) -> str:
 	return player_name.strip().upper().replace('.', '').replace(' *', '')
 
 
-def get_lineup(regular_elem: webdriver, bench_elem: webdriver) -> (str, str):
+def get_lineup(regular_elem: webdriver,
+               bench_elem: webdriver) -> (tuple, list):
 
 	captain = None
 	vice = None
@@ -120,8 +119,8 @@ def get_lineup(regular_elem: webdriver, bench_elem: webdriver) -> (str, str):
 		except NoSuchElementException:
 			pass
 
-	captains = f'{captain}, {vice}'.upper()
-	complete_lineup = ', '.join(complete_lineup).upper()
+	captains = tuple(str(nm).upper() for nm in (captain, vice))
+	complete_lineup = [nm.upper() for nm in complete_lineup]
 
 	return captains, complete_lineup
 
@@ -176,15 +175,7 @@ def last_day_played() -> int:
 	last day in the db where absolute points are saved.
 	"""
 
-	list_of_abs_points = dbf.db_select(table='absolute_points',
-	                                   columns=['*'],
-	                                   where='')[0][1:]
-
-	try:
-		return list_of_abs_points.index(None)
-	except ValueError:
-		# Updating after the last day of the league will give a ValueError
-		return len(list_of_abs_points)
+	return sf.last_day_played()
 
 
 def open_excel_file(filename: str) -> pd.DataFrame:
@@ -239,7 +230,7 @@ def scrape_lineups_schemes_points() -> webdriver:
 	brow = manage_adblock()
 
 	starting_day = last_day_played() + 1
-	for day in range(starting_day, 36):
+	for day in range(starting_day, cfg.SEASON_DAYS + 1):
 
 		brow.get(f'{cfg.BASE_URL}formazioni/{day}')
 
@@ -252,7 +243,9 @@ def scrape_lineups_schemes_points() -> webdriver:
 		# Find all matches
 		matches, scrape_points = find_matches(brow=brow)
 
-		# Iterate the matches and update database
+		# Scrape the whole day first, so the write lock is not held while
+		# the pages are read
+		rows = []
 		for match in matches:
 
 			match_data = get_match_data(brow=brow, match_element=match)
@@ -261,33 +254,31 @@ def scrape_lineups_schemes_points() -> webdriver:
 
 				team_name = get_team_name(brow=brow, team_element=team)
 
-				captains, complete_lineup = get_lineup(regular_elem=regular,
-				                                       bench_elem=bench)
+				captains, complete_lineup = get_lineup(
+						regular_elem=regular, bench_elem=bench)
 
-				dbf.db_update(
-						table='captains',
-						columns=[f'day_{day}'],
-						values=[captains],
-						where=f'team_name="{team_name}"')
-
-				dbf.db_update(
-						table='lineups',
-						columns=[f'day_{day}'],
-						values=[complete_lineup],
-						where=f'team_name="{team_name}"')
+				points = None
+				if scrape_points:
+					points = get_abs_points(points_elem=abs_points)
 
-				dbf.db_update(
-						table='schemes',
-						columns=[f'day_{day}'],
-						values=[get_scheme(scheme_elem=scheme)],
-						where=f'team_name="{team_name}"')
+				rows.append((team_name, captains, complete_lineup,
+				             get_scheme(scheme_elem=scheme), points))
 
+		# Commit once per day instead of once per row
+		with dbf.transaction():
+			for team_name, captains, complete_lineup, scheme, points in rows:
+				sf.save_captains(team_name, day, *captains)
+				sf.save_lineup(team_name, day, complete_lineup)
+				sf.save_scheme(team_name, day, scheme)
 				if scrape_points:
-					dbf.db_update(
-							table='absolute_points',
-							columns=[f'day_{day}'],
-							values=[get_abs_points(points_elem=abs_points)],
-							where=f'team_name="{team_name}"')
+					sf.save_abs_points(team_name, day, points)
+
+		# Lineups of the day kept in memory might be stale now
+		mf.invalidate_mantra_cache(day=day)
+
+		# Add only the new day to the table
+		if scrape_points:
+			st.update_standings(from_day=day)
 
 	return brow
 
@@ -322,12 +313,8 @@ def scrape_allplayers_fantateam(brow: webdriver) -> webdriver:
 			name = format_player_name(player_name=name)
 			players.append(name)
 
-		# Update "all_players" table
-		dbf.db_update(
-				table='all_players',
-				columns=[f'day_{last_day_played()}'],
-				values=[', '.join(players)],
-				where=f'team_name = "{team_name}"')
+		# Update the roster of the fantateam
+		sf.save_roster(team_name, last_day_played(), players)
 
 		# Update "stats" table
 		update_players_status_in_stats(team_name, players)
@@ -338,20 +325,22 @@ def scrape_allplayers_fantateam(brow: webdriver) -> webdriver:
 def update_players_status_in_stats(team_name: str,
                                    list_of_players: list) -> None:
 
-	# First set all players of team as FREE
-	dbf.db_update(
-			table='stats',
-			columns=['status'],
-			values=['FREE'],
-			where=f'status = "{team_name}"')
+	with dbf.transaction():
 
-	# Then update the status
-	for player in list_of_players:
+		# First set all players of team as FREE
 		dbf.db_update(
 				table='stats',
 				columns=['status'],
-				values=[team_name],
-				where=f'name = "{player}"')
+				values=['FREE'],
+				where={'status': team_name})
+
+		# Then update the status
+		for player in list_of_players:
+			dbf.db_update(
+					table='stats',
+					columns=['status'],
+					values=[team_name],
+					where={'name': player})
 
 
 def scrape_classifica(brow: webdriver) -> None:
@@ -423,24 +412,19 @@ def scrape_roles_and_players_serie_a(brow: webdriver) -> webdriver:
 					columns=['name', 'role'],
 					values=[nm, rl])
 
-	# Update the db
-	teams_in_db = dbf.db_select(table='all_players_serie_a',
-	                            columns=['team'],
+	# Roles kept in memory by this process are now stale
+	mf.refresh_roles()
+
+	# Update the db. Teams scraped for the first time start from day 1
+	teams_in_db = dbf.db_select(table='serie_a_players',
+	                            columns=['DISTINCT team'],
 	                            where='')
 
-	for team, shortlist in shortlists.items():
-		shortlist = ', '.join(shortlist)
-		if team not in teams_in_db:
-			dbf.db_insert(
-					table='all_players_serie_a',
-					columns=['team', 'day_1'],
-					values=[team.upper(), shortlist])
-		else:
-			dbf.db_update(
-					table='all_players_serie_a',
-					columns=[f'day_{last_day_played()}'],
-					values=[shortlist],
-					where=f'team = "{team}"')
+	last_day = last_day_played()
+	with dbf.transaction():
+		for team, shortlist in shortlists.items():
+			day = last_day if team in teams_in_db else 1
+			sf.save_serie_a_roster(team, day, shortlist)
 
 	return brow
 
@@ -493,6 +477,7 @@ def scrape_votes(brow: webdriver) -> webdriver:
 		# all_tables = brow.find_elements_by_xpath('.//table[@role="grid"]')
 		all_tables = brow.find_elements_by_xpath(
 				'.//table[contains(@class , "table-ratings")]')
+		votes_of_day = []
 		for table in all_tables:
 			team = table.find_element_by_xpath('.//th[@class="team-header"]')
 			scroll_to_element(brow, team)
@@ -577,19 +562,20 @@ def scrape_votes(brow: webdriver) -> webdriver:
 				except NoSuchElementException:
 					ass = 0
 
-				# Update db
-				dbf.db_insert(
-						table='votes',
-						columns=['day', 'name', 'team', 'alvin',
-						         'gf', 'gs', 'rp', 'rs', 'rf', 'au', 'amm',
-						         'esp', 'ass', 'regular', 'going_in',
-						         'going_out'],
-						values=[day, nm, team, alvin,
-						        gf, gs, rp, rs, rf, au, amm,
-						        esp, ass, regular, going_in,
-						        going_out])
+				votes_of_day.append((day, nm, team, alvin, gf, gs, rp, rs, rf,
+				                     au, amm, esp, ass, regular, going_in,
+				                     going_out))
 
+		# Update db, all the rows of the day at once. Rows already in the db
+		# from a previous partial scrape are replaced, (day, name) is unique
+		dbf.db_insert_many(table='votes', columns=VOTES_COLUMNS,
+		                   rows=votes_of_day, conflict='REPLACE')
 		add_6_politico_if_needed(day)
+		mf.invalidate_mantra_cache(day=day)
+
+	# Votes kept in memory by this process are now stale
+	vs.refresh_vote_store()
+
 	return brow
 
 
@@ -640,7 +626,7 @@ def wrong_day_for_votes(day: int) -> bool:
 	teams_in_db = set(dbf.db_select(
 			table='votes',
 			columns=['team'],
-			where=f'day = {day}'))
+			where={'day': day}))
 
 	return True if len(teams_in_db) == 20 else False
 
@@ -671,7 +657,8 @@ def calculate_mv(player: str) -> (int, float):
 
 	votes = dbf.db_select(table='votes',
 	                      columns=['alvin'],
-	                      where=f'name = "{player}" AND alvin != "sv"')
+	                      where='name = ? AND alvin != ?',
+	                      params=(player, 'sv'))
 	matches = len(votes)
 	return (matches, round(sum(votes)/matches, 2)) if matches else (0, 0.0)
 
@@ -684,12 +671,12 @@ def calculate_all_bonus(player: str) -> int:
 
 	plus1 = dbf.db_select(table='votes',
 	                      columns=['ass'],
-	                      where=f'name = "{player}"')
+	                      where={'name': player})
 	plus1 = sum(plus1)
 
 	plus3 = dbf.db_select(table='votes',
 	                      columns=['gf', 'rp', 'rf'],
-	                      where=f'name = "{player}"')
+	                      where={'name': player})
 	plus3 = sum([sum(i) for i in plus3]) * 3
 
 	return plus1 + plus3
@@ -703,22 +690,22 @@ def calculate_all_malus(player: str) -> float:
 
 	minus05 = dbf.db_select(table='votes',
 	                        columns=['amm'],
-	                        where=f'name = "{player}"')
+	                        where={'name': player})
 	minus05 = sum(minus05) * .5
 
 	minus1 = dbf.db_select(table='votes',
 	                       columns=['gs', 'esp'],
-	                       where=f'name = "{player}"')
+	                       where={'name': player})
 	minus1 = sum([sum(i) for i in minus1])
 
 	minus2 = dbf.db_select(table='votes',
 	                       columns=['au'],
-	                       where=f'name = "{player}"')
+	                       where={'name': player})
 	minus2 = sum(minus2) * 2
 
 	minus3 = dbf.db_select(table='votes',
 	                       columns=['rs'],
-	                       where=f'name = "{player}"')
+	                       where={'name': player})
 	minus3 = sum(minus3) * 3
 
 	return minus05 + minus1 + minus2 + minus3
@@ -732,15 +719,15 @@ def calculate_regular_in_out(player: str) -> (int, int, int):
 
 	regular = dbf.db_select(table='votes',
 	                        columns=['regular'],
-	                        where=f'name = "{player}"')
+	                        where={'name': player})
 
 	going_in = dbf.db_select(table='votes',
 	                         columns=['going_in'],
-	                         where=f'name = "{player}"')
+	                         where={'name': player})
 
 	going_out = dbf.db_select(table='votes',
 	                          columns=['going_out'],
-	                          where=f'name = "{player}"')
+	                          where={'name': player})
 
 	return sum(regular), sum(going_in), sum(going_out)
 
@@ -774,7 +761,7 @@ def update_stats() -> None:
 			                       'price'],
 			              values=[name, team, roles, mv, mfv, regular,
 			                      going_in, going_out, price],
-			              where=f'name = "{name}"')
+			              where={'name': name})
 		else:
 			# print('New name for stats: ', name)
 			dbf.db_insert(table='stats',
@@ -797,26 +784,23 @@ def update_market_db():
 	cols = ['team', 'G', 'V', 'N', 'P', 'Gf', 'Gs', 'Dr', 'Pt', 'Tot']
 	dbf.empty_table(table='classifica', database=cfg.dbase2)
 	data = dbf.db_select(table='classifica', columns=cols, where='')
-	for el in data:
-		dbf.db_insert(
-				table='classifica',
-				columns=cols,
-				values=el,
-				database=cfg.dbase2)
+	dbf.db_insert_many(table='classifica', columns=cols, rows=data,
+	                   database=cfg.dbase2)
 
 	# Update table "players"
 	cols = ['name', 'team', 'roles', 'price', 'status']
 	dbf.empty_table(table='players', database=cfg.dbase2)
 	data = dbf.db_select(table='stats', columns=cols, where='')
-	for el in data:
-		dbf.db_insert(
-				table='players',
-				columns=[f'player_{i}' for i in cols],
-				values=el,
-				database=cfg.dbase2)
+	dbf.db_insert_many(table='players',
+	                   columns=[f'player_{i}' for i in cols],
+	                   rows=data,
+	                   database=cfg.dbase2)
 
 
 if __name__ == '__main__':
+	dbm.migrate(verbose=True)
+	mf.recalculate_legacy_lineups()
+
 	# browser = manage_adblock()
 	browser = scrape_lineups_schemes_points()
 	browser = scrape_allplayers_fantateam(browser)
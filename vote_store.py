@@ -0,0 +1,180 @@
+import numpy as np
+import db_functions as dbf
+import config as cfg
+
+
+BONUS_FEATURES = ['gf', 'rp', 'rf', 'ass']
+BONUS_WEIGHTS = [3, 3, 3, 1]
+MALUS_FEATURES = ['gs', 'rs', 'au', 'amm', 'esp']
+MALUS_WEIGHTS = [1, 3, 2, .5, 1]
+
+
+class VoteStore(object):
+
+    def __init__(self, database=cfg.dbase1):
+
+        """
+        Load the whole 'votes' table once and keep it in memory as matrices
+        with one row per player and one column per day (column 0 is unused
+        so that days can be used directly as indexes). Missing votes and 'sv'
+        are NaN.
+
+        :param database: str
+
+        """
+
+        self.database = database
+        self.data_version = None
+        self.names = []
+        self.player_id = {}
+        self.n_days = 0
+        self.vote = np.empty((0, 1))
+        self.bonus = np.empty((0, 1))
+        self.malus = np.empty((0, 1))
+        self.fantavote = np.empty((0, 1))
+
+        # Raw bonus and malus features, BONUS_FEATURES + MALUS_FEATURES,
+        # used to weight them differently, see scenarios.py
+        self.features = np.empty((0, 1, len(BONUS_FEATURES) +
+                                  len(MALUS_FEATURES)))
+
+        self.load()
+
+    def load(self):
+
+        """
+        (Re)load all the data from the database with a single query.
+
+        :return: nothing
+
+        """
+
+        # Read before the votes, so changes made meanwhile reload them again
+        self.data_version = dbf.data_version(self.database)
+        rows = dbf.db_select(
+                table='votes',
+                columns=['day', 'name', 'alvin'] + BONUS_FEATURES +
+                MALUS_FEATURES,
+                where='',
+                database=self.database)
+
+        self.names = sorted({nm for _, nm, *_ in rows})
+        self.player_id = {nm: i for i, nm in enumerate(self.names)}
+        self.n_days = max([day for day, *_ in rows], default=0)
+
+        shape = (len(self.names), self.n_days + 1)
+        self.vote = np.full(shape, np.nan)
+        self.bonus = np.zeros(shape)
+        self.malus = np.zeros(shape)
+        self.features = np.zeros(shape + (len(BONUS_FEATURES) +
+                                          len(MALUS_FEATURES), ))
+
+        if rows:
+            n_bonus = len(BONUS_FEATURES)
+            ids = np.array([self.player_id[nm] for _, nm, *_ in rows])
+            days = np.array([day for day, *_ in rows])
+            votes = np.array([np.nan if alvin in ('sv', None) else alvin
+                              for _, _, alvin, *_ in rows], dtype=float)
+            features = np.array([[ft or 0 for ft in row[3:]] for row in rows],
+                                dtype=float)
+
+            self.vote[ids, days] = votes
+            self.features[ids, days] = features
+            self.bonus[ids, days] = features[:, :n_bonus] @ BONUS_WEIGHTS
+            self.malus[ids, days] = features[:, n_bonus:] @ MALUS_WEIGHTS
+
+        self.fantavote = self.vote + self.bonus - self.malus
+
+    def _index(self, name, day):
+
+        """
+        Return the (row, column) of player 'name' in 'day' or None if the
+        player has no data for that day.
+        """
+
+        player_id = self.player_id.get(name)
+        if player_id is None or not 0 < day <= self.n_days:
+            return None
+        return player_id, day
+
+    def get_vote(self, name, day):
+
+        """
+        Return player vote if any, else 'sv'.
+
+        :param name: str
+        :param day: int
+
+        :return: float or str
+
+        """
+
+        idx = self._index(name, day)
+        if idx is None or np.isnan(self.vote[idx]):
+            return 'sv'
+        return float(self.vote[idx])
+
+    def get_bonus(self, name, day):
+        idx = self._index(name, day)
+        return float(self.bonus[idx]) if idx is not None else 0.
+
+    def get_malus(self, name, day):
+        idx = self._index(name, day)
+        return float(self.malus[idx]) if idx is not None else 0.
+
+    def get_fantavote(self, name, day):
+        idx = self._index(name, day)
+        return float(self.fantavote[idx]) if idx is not None else np.nan
+
+    def votes_of(self, names, day):
+
+        """
+        Return the votes of all the players in 'names' in 'day' as an array,
+        NaN for 'sv'.
+
+        :param names: list
+        :param day: int
+
+        :return: np.array
+
+        """
+
+        res = np.full(len(names), np.nan)
+        if not 0 < day <= self.n_days:
+            return res
+
+        for i, nm in enumerate(names):
+            if nm in self.player_id:
+                res[i] = self.vote[self.player_id[nm], day]
+        return res
+
+
+_STORES = {}
+
+
+def get_vote_store(database=cfg.dbase1, check=True):
+
+    """
+    Return the VoteStore of 'database', loading it the first time. If
+    'check' is True it is reloaded when another connection changed
+    'database' since then, which costs a query: code reading many votes
+    checks once and then uses check=False, see FantaClasses.League.
+    """
+
+    if database not in _STORES:
+        _STORES[database] = VoteStore(database)
+    elif check and _STORES[database].data_version != dbf.data_version(
+            database):
+        _STORES[database].load()
+    return _STORES[database]
+
+
+def refresh_vote_store(database=cfg.dbase1):
+
+    """
+    Reload the votes of 'database'. To be called whenever the 'votes' table
+    changes.
+    """
+
+    if database in _STORES:
+        _STORES[database].load()